@@ -2,7 +2,15 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from pathlib import Path
+import json
+
+import charts
+import cube
+import export
+import memo
+import query
+import timeseries
+import timing
 
 # ─── Page Config ──────────────────────────────────────────────────────────────
 st.set_page_config(
@@ -78,36 +86,33 @@ COLORS = {
 }
 PALETTE = ['#3b82f6', '#8b5cf6', '#06b6d4', '#10b981', '#f59e0b', '#ef4444',
            '#ec4899', '#14b8a6', '#f97316', '#6366f1', '#84cc16', '#a855f7']
-CHART_TEMPLATE = 'plotly_dark'
+
+# Nodo expanders shown at first and added by each "Cargar más"
+NODOS_PAGE = 10
+
+# ─── Timing ───────────────────────────────────────────────────────────────────
+# Opt-in per-section timings (?debug=1 or DASHBOARD_TIMING=1), shown at the bottom.
+rec = timing.Recorder(st.query_params.get('debug') == '1' or timing.enabled_by_env())
+rec.section('load')
+
+# ─── Chart Payload ────────────────────────────────────────────────────────────
+# Figure JSON this run sends, against charts.PAGE_BUDGET (see plot()); charts
+# past it load on demand and stay loaded for the session.
+payload = charts.Budget()
+st.session_state.setdefault('graficos_cargados', set())
 
 # ─── Data Loading ─────────────────────────────────────────────────────────────
-@st.cache_data
-def load_asignaciones():
-    path = Path(__file__).parent / "data" / "asignaciones_v2.csv"
-    if not path.exists():
-        # Fallback to old format
-        path = Path(__file__).parent / "data" / "asignaciones.csv"
-        df = pd.read_csv(path)
-        df['estado'] = 'DESCONOCIDO'
-        return df
-    df = pd.read_csv(path)
-    df['fecha'] = pd.to_datetime(df['mes'] + '-01')
-    df['año'] = df['fecha'].dt.year
-    df['mes_nombre'] = df['fecha'].dt.strftime('%b %Y')
-    return df
-
-@st.cache_data
-def load_nodos():
-    path = Path(__file__).parent / "data" / "nodos_detalle.csv"
-    if path.exists():
-        df = pd.read_csv(path)
-        df['fecha'] = pd.to_datetime(df['mes'] + '-01')
-        df['año'] = df['fecha'].dt.year
-        return df
-    return None
-
-df = load_asignaciones()
-df_nodos = load_nodos()
+# One Refresher per process watches data/ from a background thread: a data set
+# regenerated by generate_data.py is loaded and warmed there and then swapped
+# in, so no rerun waits on a cold load and no server restart is needed. Each
+# run takes the current Dataset once (cubes plus its cache of frames and figure
+# JSON, see memo.py) and uses it throughout.
+@st.cache_resource
+def data_service():
+    return query.Refresher().start()
+
+data = data_service().current()
+asig_cube, nodo_cube, cache = data.asig, data.nodos, data.cache
 
 # ─── Helper Functions ─────────────────────────────────────────────────────────
 def fmt(n):
@@ -119,418 +124,654 @@ def fmt(n):
     return f"{n:,.0f}"
 
 def chart_layout(fig, height=380, **kwargs):
-    """Apply consistent dark styling to charts."""
-    fig.update_layout(
-        template=CHART_TEMPLATE,
-        height=height,
-        margin=dict(l=20, r=20, t=40, b=20),
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(15,23,42,0.6)',
-        font=dict(family='Inter', color='#94a3b8'),
-        legend=dict(
-            bgcolor='rgba(0,0,0,0)',
-            font=dict(color='#94a3b8', size=11),
-        ),
-        **kwargs,
+    """Apply consistent dark styling to charts (charts.TEMPLATE)."""
+    return charts.style(fig, height=height, **kwargs)
+
+def plot(sel, name, build):
+    """Show chart ``name`` for ``sel``; ``build()`` only runs on a shared-cache miss.
+
+    Charts that would take this run past charts.PAGE_BUDGET bytes of figure
+    JSON wait behind a button that loads them.
+    """
+    with rec.span(f'chart: {name}'):
+        spec = cache.get(('fig', name, memo.key(sel)), lambda: charts.to_json(build()))
+        if not payload.fits(len(spec)) and name not in st.session_state['graficos_cargados']:
+            st.button(f"📊 Cargar gráfico ({len(spec) / 1024:,.0f} KB)", key=f'cargar:{name}',
+                      on_click=cargar_grafico, args=(name,))
+            return
+        payload.add(len(spec))
+        fig = json.loads(spec)
+        # Streamlit rejects a bare spec with no traces; an empty Figure shows the empty axes
+        st.plotly_chart(fig if fig['data'] else go.Figure(fig), width='stretch')
+
+def cargar_grafico(name):
+    st.session_state['graficos_cargados'].add(name)
+
+def mostrar_mas_nodos():
+    st.session_state['nodos_visibles'] += NODOS_PAGE
+
+def elegir_tipos(familia):
+    """Select every tipo of a family (cube.APP_TYPES or cube.MANUAL_TYPES) in the Tipo filter."""
+    st.session_state['filtro_tipo'] = [t for t in asig_cube.labels['tipo_asignacion'].tolist() if t in familia]
+
+def con_nodo(frame):
+    """Drop the 'Sin Nodo' bucket (expedientes with no match in the SOA file)."""
+    return frame[frame['nodo'] != 'Sin Nodo']
+
+def delta_kpi(comp, k):
+    """st.metric delta for KPI ``k`` of a query.Comparison (None without one)."""
+    if comp is None or comp.kpis[k]['delta'] is None:
+        return None
+    d = comp.kpis[k]
+    if k == 'pct_conclusion':
+        return f"{d['delta']:+.1f} pp"
+    return f"{d['delta']:+,}" + (f" ({d['pct']:+.1f}%)" if d['pct'] is not None else "")
+
+def tabla_comparacion(df, key, label):
+    """Show a query.compare_frames() table, busiest first; '—' where there is no base."""
+    cols = {
+        key: label,
+        'servicios': 'Servicios', 'servicios_anterior': 'Servicios ant.', 'servicios_pct': 'Δ Servicios',
+        'concluidos': 'Concluidos', 'concluidos_anterior': 'Concluidos ant.', 'concluidos_pct': 'Δ Concluidos',
+        'expedientes': 'Expedientes', 'expedientes_anterior': 'Expedientes ant.', 'expedientes_pct': 'Δ Expedientes',
+        'pct_conclusion': '% Conclusión', 'pct_conclusion_delta': 'Δ % Conclusión',
+    }
+    view = df.sort_values('servicios', ascending=False)[list(cols)].rename(columns=cols)
+    st.dataframe(
+        view.style.format({
+            **{c: '{:,.0f}' for c in ['Servicios', 'Servicios ant.', 'Concluidos', 'Concluidos ant.',
+                                      'Expedientes', 'Expedientes ant.']},
+            **{c: '{:+.1f}%' for c in ['Δ Servicios', 'Δ Concluidos', 'Δ Expedientes']},
+            '% Conclusión': '{:.1f}%',
+            'Δ % Conclusión': '{:+.1f} pp',
+        }, na_rep='—'),
+        width='stretch',
+        hide_index=True,
     )
-    fig.update_xaxes(gridcolor='rgba(51,65,85,0.4)', tickfont=dict(size=10))
-    fig.update_yaxes(gridcolor='rgba(51,65,85,0.4)', tickfont=dict(size=10))
-    return fig
+
+def linea_media(fig, df, y):
+    """Overlay the rolling mean column ``y`` of a timeseries frame as a dashed line."""
+    fig.add_trace(go.Scatter(
+        x=df['mes'], y=df[y], mode='lines', name=f'Media móvil {timeseries.WINDOW}M',
+        line=dict(color='#e2e8f0', width=1.5, dash='dash'), hovertemplate='%{y:,.1f}',
+    ))
+
+def marcar_anomalias(fig, df, y):
+    """Circle the months of ``df`` flagged as atypical by timeseries.py."""
+    fig.add_trace(go.Scatter(
+        x=df['mes'], y=df[y], mode='markers', name='Mes atípico',
+        marker=dict(color=COLORS['danger'], size=13, symbol='circle-open', line=dict(width=2.5)),
+        hovertemplate='%{x}: %{y:,.0f}<extra>Mes atípico</extra>',
+    ))
+
+def tabla_anomalias(df, key, label):
+    """Show a timeseries.Trends.anomalias table, strongest deviation first."""
+    if df.empty:
+        st.caption("Sin meses atípicos en el periodo.")
+        return
+    cols = {key: label, 'mes': 'Mes', 'servicios': 'Servicios', 'esperado': 'Esperado', 'z': 'Desviación (σ)'}
+    st.dataframe(
+        df[list(cols)].rename(columns=cols).style.format({
+            'Servicios': '{:,.0f}', 'Esperado': '{:,.0f}', 'Desviación (σ)': '{:+.1f}',
+        }),
+        width='stretch',
+        hide_index=True,
+        height=min(400, 35 * len(df) + 40),
+    )
+
+def exportar(vistas, sel):
+    """"Exportar" popover with CSV / Excel / Parquet downloads of query views ``vistas``.
+
+    ``vistas`` maps a view of query.EXPORTS to its label. Files are only
+    written when a button is clicked (in a separate thread) and come from the
+    export cache when that view was downloaded before. Streamlit serves a
+    download from memory, so views over export.INLINE_MAX_ROWS rows show the
+    query.py command that writes them instead of buttons.
+    """
+    with st.popover("⬇️ Exportar"):
+        for vista, etiqueta in vistas.items():
+            st.caption(etiqueta)
+            filas = data.export_rows(vista, sel)
+            if filas > export.INLINE_MAX_ROWS:
+                st.caption(f"{filas:,} filas, demasiadas para descargar desde el navegador. "
+                           f"Genera el archivo con `{query.export_command(vista, sel, 'csv')}`")
+                continue
+            nombre = query.export_name(vista, sel)
+            for col, (fmt, label) in zip(st.columns(3), [('csv', 'CSV'), ('xlsx', 'Excel'), ('parquet', 'Parquet')]):
+                col.download_button(label, data=lambda v=vista, f=fmt: data.export(v, sel, f).open('rb'),
+                                    file_name=f'{nombre}.{fmt}', mime=export.FORMATS[fmt],
+                                    key=f'exportar_{vista}_{fmt}', on_click='ignore')
 
 # ─── Header ───────────────────────────────────────────────────────────────────
 st.markdown("## 📊 Dashboard de Asignaciones")
 st.caption("Análisis de servicios, expedientes y estado por país y nodo")
 
 # ─── Sidebar Filters ─────────────────────────────────────────────────────────
+rec.section('filters')
 with st.sidebar:
     st.markdown("### 🔍 Filtros")
 
     # Solo Concluidos Toggle
     solo_concluidos = st.toggle("✅ Solo Concluidos", value=False)
 
-    # 1. Year Filter
-    años = sorted(df['año'].unique(), reverse=True)
-    años_opts = ["Todos"] + list(años)
-    año_sel = st.selectbox("📅 Año", años_opts, index=1 if len(años) > 0 else 0) # Default to latest year if possible
-
-    # 2. Month Filter
+    # Every filter is a multi-select: several values mean any of them, none means "Todos"
     meses_map = {1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril', 5: 'Mayo', 6: 'Junio',
                  7: 'Julio', 8: 'Agosto', 9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'}
-    df['mes_num'] = df['fecha'].dt.month
-    df['mes_txt'] = df['mes_num'].map(meses_map)
-    
-    meses_disponibles = sorted(df['mes_num'].unique())
-    meses_opciones = ["Todos"] + [meses_map[m] for m in meses_disponibles]
-    
-    mes_sel = st.selectbox("🗓 Mes", meses_opciones, index=0)
-
-    # 3. Country Filter
-    paises_list = sorted(df['pais'].unique())
-    paises_opts = ["Todos"] + paises_list
-    pais_sel = st.selectbox("🌎 País", paises_opts, index=0)
-
-    # 4. Type Filter
-    tipos = sorted(df['tipo_asignacion'].unique())
-    tipos_opts = ["Todos"] + tipos
-    tipo_sel = st.selectbox("⚙️ Tipo de Asignación", tipos_opts, index=0)
 
-    st.markdown("---")
-    st.caption("💡 *Concluidos* = servicios con estado CONCLUIDA. Selecciona filtros para refinar la vista.")
-
-# ─── Apply Filters ────────────────────────────────────────────────────────────
-mask = pd.Series(True, index=df.index)
+    # 1. Period: years and months, or a continuous range of months
+    usar_rango = st.toggle("📆 Rango de fechas", value=False)
+    if usar_rango:
+        # Months with data, in order; a range is two prefix-sum lookups per cell (see cube.py)
+        meses_rango = asig_cube.facts['mes'].cat.categories.tolist()
+        rango_sel = st.select_slider("📆 Desde / Hasta", meses_rango,
+                                     value=(meses_rango[max(len(meses_rango) - 12, 0)], meses_rango[-1]),
+                                     format_func=lambda m: f"{meses_map[int(m[5:])][:3]} {m[:4]}")
+        año_sel, mes_sel = [], []
+    else:
+        rango_sel = None
+        años = sorted(asig_cube.labels['año'].tolist(), reverse=True)
+        año_sel = st.multiselect("📅 Año", años, default=años[:1], placeholder="Todos") # Default to latest year if possible
 
-if año_sel != "Todos":
-    mask = mask & (df['año'] == año_sel)
+        meses_disponibles = asig_cube.labels['mes_num'].tolist()
+        mes_sel = st.multiselect("🗓 Mes", meses_disponibles, format_func=meses_map.get, placeholder="Todos")
 
-if mes_sel != "Todos":
-    mask = mask & (df['mes_txt'] == mes_sel)
+    # 2. Country Filter
+    paises_list = asig_cube.labels['pais'].tolist()
+    pais_sel = st.multiselect("🌎 País", paises_list, placeholder="Todos")
 
-if pais_sel != "Todos":
-    mask = mask & (df['pais'] == pais_sel)
+    # 3. Type Filter (the buttons pick a whole family)
+    tipos = asig_cube.labels['tipo_asignacion'].tolist()
+    tipo_sel = st.multiselect("⚙️ Tipo de Asignación", tipos, placeholder="Todos", key='filtro_tipo')
+    ft1, ft2 = st.columns(2)
+    ft1.button("📱 App / Automatizado", on_click=elegir_tipos, args=(cube.APP_TYPES,), width='stretch')
+    ft2.button("✍️ Manual", on_click=elegir_tipos, args=(cube.MANUAL_TYPES,), width='stretch')
 
-if tipo_sel != "Todos":
-    mask = mask & (df['tipo_asignacion'] == tipo_sel)
+    # 4. Comparison period
+    comparar_opts = {"Sin comparación": None, "Año anterior (YoY)": 'yoy', "Mes anterior (MoM)": 'mom'}
+    comparar_sel = st.selectbox("📈 Comparar con", list(comparar_opts), index=0)
 
-if solo_concluidos:
-    mask = mask & (df['estado'] == 'CONCLUIDA')
+    st.markdown("---")
+    st.caption("💡 *Concluidos* = servicios con estado CONCLUIDA. Selecciona filtros para refinar la vista.")
 
-dff = df[mask].copy()
+# ─── Apply Filters ────────────────────────────────────────────────────────────
+# Selections are answered by cube lookups (multi-selects by summing the
+# selected slots and by bitmap indexes, see cube.py); None means "Todos".
+sel = query.selection(
+    año=año_sel,
+    mes_num=mes_sel,
+    pais=pais_sel,
+    tipo=tipo_sel,
+    solo_concluidos=solo_concluidos,
+    rango=rango_sel,
+)
 
-# Pre-compute key aggregates
-total_servicios = int(dff['servicios'].sum())
-total_expedientes = int(dff['expedientes'].sum())
-concluidos = int(dff[dff['estado'] == 'CONCLUIDA']['servicios'].sum())
-cancelados = int(dff[dff['estado'] == 'CANCELADA']['servicios'].sum())
-pct_concl = (concluidos / total_servicios * 100) if total_servicios else 0
-paises_activos = dff['pais'].nunique()
+def periodo(s):
+    """'Marzo 2025', '2025', '2024, 2025' or 'Mar 2024 – Feb 2025': the period of a selection."""
+    if s.get('rango') is not None:
+        return ' – '.join(f"{meses_map[int(m[5:])][:3]} {m[:4]}" for m in s['rango'])
+    años = ', '.join(map(str, query.values(s['año'])))
+    meses = ', '.join(meses_map[m] for m in query.values(s['mes_num']))
+    return f"{meses} {años}" if meses else años
+
+# Pre-compute key aggregates: one fused pass over the cube for the whole tab
+rec.section('kpis')
+res = data.summary(sel)
+# The earlier period is one more cube lookup; both are cached per selection
+modo = comparar_opts[comparar_sel]
+comp = data.compare(sel, modo) if modo else None
+if modo and comp is None:
+    st.sidebar.warning("Elige un año (y un solo año y mes para comparar con el mes anterior; "
+                       "un rango solo se compara con el año anterior).")
+total_servicios = res.total_servicios
+total_expedientes = res.expedientes
+concluidos = res.concluidos
+cancelados = res.cancelados
+pct_concl = res.pct_conclusion
+paises_activos = res.paises_activos
 
 # ─── KPI Row ──────────────────────────────────────────────────────────────────
 k1, k2, k3, k4, k5 = st.columns(5)
-k1.metric("📋 Total Servicios", fmt(total_servicios))
-k2.metric("✅ Concluidos", fmt(concluidos))
-k3.metric("❌ Cancelados", fmt(cancelados))
-k4.metric("📁 Expedientes", fmt(total_expedientes))
-k5.metric("🏳️ % Conclusión", f"{pct_concl:.1f}%")
+k1.metric("📋 Total Servicios", fmt(total_servicios), delta_kpi(comp, 'total_servicios'))
+k2.metric("✅ Concluidos", fmt(concluidos), delta_kpi(comp, 'concluidos'))
+k3.metric("❌ Cancelados", fmt(cancelados), delta_kpi(comp, 'cancelados'), delta_color='inverse')
+k4.metric("📁 Expedientes", fmt(total_expedientes), delta_kpi(comp, 'expedientes'))
+k5.metric("🏳️ % Conclusión", f"{pct_concl:.1f}%", delta_kpi(comp, 'pct_conclusion'))
+if comp is not None:
+    st.caption(f"📈 Variación de {periodo(sel)} frente a {periodo(comp.anterior)}")
 
 st.markdown("")
 
 # ─── Tabs ─────────────────────────────────────────────────────────────────────
-tab_asig, tab_nodos = st.tabs(["📊 Asignaciones por País", "🏢 Nodos (Call Centers)"])
+# Tabs track which one is open so only the visible tab is computed and sent
+tab_asig, tab_nodos, tab_detalle = st.tabs(
+    ["📊 Asignaciones por País", "🏢 Nodos (Call Centers)", "🔎 Detalle (Expedientes)"],
+    key='tab', on_change='rerun')
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # TAB 1: ASIGNACIONES
 # ═══════════════════════════════════════════════════════════════════════════════
 with tab_asig:
-
-    # ── Row 1: Monthly Trends (3 charts side by side) ─────────────────────────
-    st.markdown("#### 📈 Tendencias Mensuales")
-    c1, c2, c3 = st.columns(3)
-
-    # Servicios totales por mes
-    df_mes = dff.groupby('mes', as_index=False)['servicios'].sum().sort_values('mes')
-    with c1:
-        fig = px.area(df_mes, x='mes', y='servicios', markers=True,
-                      color_discrete_sequence=[COLORS['primary']])
-        fig.update_traces(fill='tozeroy', fillcolor='rgba(59,130,246,0.15)',
-                          line=dict(width=2.5))
-        chart_layout(fig, title='Servicios Totales')
-        fig.update_xaxes(tickangle=-45)
-        st.plotly_chart(fig, use_container_width=True)
-
-    # Concluidos por mes
-    df_concl_mes = dff[dff['estado'] == 'CONCLUIDA'].groupby('mes', as_index=False)['servicios'].sum().sort_values('mes')
-    with c2:
-        fig = px.area(df_concl_mes, x='mes', y='servicios', markers=True,
-                      color_discrete_sequence=[COLORS['success']])
-        fig.update_traces(fill='tozeroy', fillcolor='rgba(16,185,129,0.15)',
-                          line=dict(width=2.5))
-        chart_layout(fig, title='Servicios Concluidos')
-        fig.update_xaxes(tickangle=-45)
-        st.plotly_chart(fig, use_container_width=True)
-
-    # Expedientes por mes
-    df_exp_mes = dff.groupby('mes', as_index=False)['expedientes'].sum().sort_values('mes')
-    with c3:
-        fig = px.area(df_exp_mes, x='mes', y='expedientes', markers=True,
-                      color_discrete_sequence=[COLORS['secondary']])
-        fig.update_traces(fill='tozeroy', fillcolor='rgba(139,92,246,0.15)',
-                          line=dict(width=2.5))
-        chart_layout(fig, title='Expedientes')
-        fig.update_xaxes(tickangle=-45)
-        st.plotly_chart(fig, use_container_width=True)
-
-    # ── Row 2: By Country (3 bar charts) ──────────────────────────────────────
-    st.markdown("#### 🌎 Por País")
-    c4, c5, c6 = st.columns(3)
-
-    # Servicios por país
-    df_pais_serv = dff.groupby('pais', as_index=False)['servicios'].sum() \
-                      .sort_values('servicios', ascending=True)
-    with c4:
-        fig = px.bar(df_pais_serv, x='servicios', y='pais', orientation='h',
-                     color_discrete_sequence=[COLORS['primary']])
-        h = max(350, len(df_pais_serv) * 28)
-        chart_layout(fig, height=h, title='Servicios Totales')
-        st.plotly_chart(fig, use_container_width=True)
-
-    # Concluidos por país
-    df_pais_concl = dff[dff['estado'] == 'CONCLUIDA'] \
-        .groupby('pais', as_index=False)['servicios'].sum() \
-        .sort_values('servicios', ascending=True)
-    with c5:
-        fig = px.bar(df_pais_concl, x='servicios', y='pais', orientation='h',
-                     color_discrete_sequence=[COLORS['success']])
-        chart_layout(fig, height=h, title='Concluidos')
-        st.plotly_chart(fig, use_container_width=True)
-
-    # Expedientes por país
-    df_pais_exp = dff.groupby('pais', as_index=False)['expedientes'].sum() \
-                     .sort_values('expedientes', ascending=True)
-    with c6:
-        fig = px.bar(df_pais_exp, x='expedientes', y='pais', orientation='h',
-                     color_discrete_sequence=[COLORS['secondary']])
-        chart_layout(fig, height=h, title='Expedientes')
-        st.plotly_chart(fig, use_container_width=True)
-
-    # ── Row 3: Distributions ──────────────────────────────────────────────────
-    st.markdown("#### 📊 Distribuciones")
-    c7, c8, c9 = st.columns(3)
-
-    # Estado distribution (pie)
-    with c7:
-        df_estado = dff.groupby('estado', as_index=False)['servicios'].sum()
-        color_map = {'CONCLUIDA': COLORS['success'], 'CANCELADA': COLORS['danger'],
-                     'PROCESO': COLORS['warning'], 'OTRO': COLORS['muted'],
-                     'SIN_ESTADO': '#475569', 'DESCONOCIDO': '#475569'}
-        fig = px.pie(df_estado, values='servicios', names='estado', hole=0.45,
-                     color='estado', color_discrete_map=color_map)
-        fig.update_traces(textinfo='percent+label', textfont_size=11)
-        chart_layout(fig, title='Estado de Servicios')
-        st.plotly_chart(fig, use_container_width=True)
-
-    # Tipo asignación (pie) — group small segments to avoid label overlap
-    with c8:
-        df_tipo = dff.groupby('tipo_asignacion', as_index=False)['servicios'].sum() \
-                     .sort_values('servicios', ascending=False)
-        top_n = 5
-        if len(df_tipo) > top_n:
-            top = df_tipo.head(top_n)
-            otros = pd.DataFrame([{
-                'tipo_asignacion': 'OTROS',
-                'servicios': df_tipo.iloc[top_n:]['servicios'].sum()
-            }])
-            df_tipo = pd.concat([top, otros], ignore_index=True)
-        fig = px.pie(df_tipo, values='servicios', names='tipo_asignacion', hole=0.45,
-                     color_discrete_sequence=PALETTE)
-        fig.update_traces(textinfo='percent', textfont_size=11,
-                          textposition='inside')
-        chart_layout(fig, title='Tipo de Asignación')
-        fig.update_layout(legend=dict(font=dict(size=10), orientation='v',
-                                       y=0.5, x=1.02))
-        st.plotly_chart(fig, use_container_width=True)
-
-    # App vs Manual (bar)
-    with c9:
-        app_types = ['APP', 'ANCLAJE APP SOA', 'ANCLAJE APP', 'ANCLAJE']
-        manual_types = ['MANUAL', 'ANCLAJE BASE', 'BASE AUTOMATICO']
-        def classify(t):
-            if t in app_types: return 'App / Automatizado'
-            elif t in manual_types: return 'Manual'
-            else: return 'Otro'
-        df_cat = dff.copy()
-        df_cat['categoria'] = df_cat['tipo_asignacion'].apply(classify)
-        df_cat_agg = df_cat.groupby('categoria', as_index=False)['servicios'].sum()
-        cmap = {'App / Automatizado': COLORS['accent'], 'Manual': COLORS['warning'], 'Otro': COLORS['muted']}
-        fig = px.bar(df_cat_agg, x='categoria', y='servicios', color='categoria',
-                     color_discrete_map=cmap)
-        chart_layout(fig, title='App vs Manual', showlegend=False)
-        st.plotly_chart(fig, use_container_width=True)
-
-    # ── Row 4: % Conclusión por País ──────────────────────────────────────────
-    st.markdown("#### 🎯 Tasa de Conclusión por País")
-    df_pais_all = dff.groupby('pais', as_index=False).agg(
-        servicios=('servicios', 'sum'),
-        expedientes=('expedientes', 'sum'),
-    )
-    df_pais_c = dff[dff['estado'] == 'CONCLUIDA'].groupby('pais', as_index=False)['servicios'].sum()
-    df_pais_c.columns = ['pais', 'concluidos']
-    df_rate = df_pais_all.merge(df_pais_c, on='pais', how='left').fillna(0)
-    df_rate['pct_conclusion'] = (df_rate['concluidos'] / df_rate['servicios'] * 100).round(1)
-    df_rate = df_rate.sort_values('pct_conclusion', ascending=True)
-
-    fig = px.bar(df_rate, x='pct_conclusion', y='pais', orientation='h',
-                 color='pct_conclusion',
-                 color_continuous_scale=['#ef4444', '#f59e0b', '#10b981'],
-                 range_color=[30, 85])
-    chart_layout(fig, height=max(350, len(df_rate) * 28),
-                 title='% Servicios Concluidos por País',
-                 coloraxis_colorbar=dict(title='%'))
-    fig.update_traces(texttemplate='%{x:.1f}%', textposition='outside', textfont_size=10)
-    st.plotly_chart(fig, use_container_width=True)
-
-    # ── Row 5: Data Table ─────────────────────────────────────────────────────
-    st.markdown("#### 📋 Tabla Resumen por País")
-    df_table = df_rate[['pais', 'servicios', 'concluidos', 'expedientes', 'pct_conclusion']].copy()
-    df_table = df_table.sort_values('servicios', ascending=False)
-    df_table['cancelados'] = df_table['servicios'] - df_table['concluidos']
-    df_table = df_table[['pais', 'servicios', 'concluidos', 'cancelados', 'expedientes', 'pct_conclusion']]
-    df_table.columns = ['País', 'Total Servicios', 'Concluidos', 'Cancelados', 'Expedientes', '% Conclusión']
-
-    # Add totals row
-    totals = pd.DataFrame([{
-        'País': '🟰 TOTAL',
-        'Total Servicios': df_table['Total Servicios'].sum(),
-        'Concluidos': df_table['Concluidos'].sum(),
-        'Cancelados': df_table['Cancelados'].sum(),
-        'Expedientes': df_table['Expedientes'].sum(),
-        '% Conclusión': round(df_table['Concluidos'].sum() / df_table['Total Servicios'].sum() * 100, 1) if df_table['Total Servicios'].sum() else 0,
-    }])
-    df_display = pd.concat([df_table, totals], ignore_index=True)
-
-    st.dataframe(
-        df_display.style.format({
-            'Total Servicios': '{:,.0f}',
-            'Concluidos': '{:,.0f}',
-            'Cancelados': '{:,.0f}',
-            'Expedientes': '{:,.0f}',
-            '% Conclusión': '{:.1f}%',
-        }),
-        use_container_width=True,
-        hide_index=True,
-        height=min(600, 40 * len(df_display) + 40),
-    )
-
-# ═══════════════════════════════════════════════════════════════════════════════
-# TAB 2: NODOS
-# ═══════════════════════════════════════════════════════════════════════════════
-with tab_nodos:
-    if df_nodos is not None:
-        # Apply year filter to nodos too
-        dfn = df_nodos[df_nodos['año'].isin(año_sel)].copy()
-
-        # ── KPI Row ───────────────────────────────────────────────────────────
-        # Use asignaciones data (dff) for totals to match main KPIs exactly.
-        # Nodo data groups differently (no tipo_asignacion), so expediente
-        # deduplication is tighter, causing a mismatch if summed from nodos.
-        nodos_activos = dfn[dfn['nodo'] != 'Sin Nodo']['nodo'].nunique()
-        n_total_serv = int(dff['servicios'].sum())
-        n_total_exp = int(dff['expedientes'].sum())
-        n_concl = int(dff[dff['estado'] == 'CONCLUIDA']['servicios'].sum())
-
-        nk1, nk2, nk3, nk4 = st.columns(4)
-        nk1.metric("🏢 Nodos Activos", nodos_activos)
-        nk2.metric("📋 Servicios", fmt(n_total_serv))
-        nk3.metric("✅ Concluidos", fmt(n_concl))
-        nk4.metric("📁 Expedientes", fmt(n_total_exp))
-
-        st.markdown("")
-
-        # ── Row 1: Nodo overview (bar + pie) ──────────────────────────────────
-        st.markdown("#### 🏢 Distribución por Nodo")
-        nc1, nc2 = st.columns([3, 2])
-
-        # Filter out "Sin Nodo" for cleaner display, but show as info
-        sin_nodo_serv = int(dfn[dfn['nodo'] == 'Sin Nodo']['servicios'].sum())
-        dfn_clean = dfn[dfn['nodo'] != 'Sin Nodo']
-
-        nodo_agg = dfn_clean.groupby('nodo', as_index=False).agg(
-            servicios=('servicios', 'sum'),
-            expedientes=('expedientes', 'sum'),
-        ).sort_values('servicios', ascending=True)
-
-        with nc1:
-            # Stacked bar: concluidos vs cancelados per nodo
-            nodo_estado = dfn_clean.groupby(['nodo', 'estado'], as_index=False)['servicios'].sum()
-            estado_colors = {'CONCLUIDA': COLORS['success'], 'CANCELADA': COLORS['danger'],
-                            'PROCESO': COLORS['warning'], 'OTRO': COLORS['muted'], 'SIN_ESTADO': '#475569'}
-            fig = px.bar(nodo_estado, x='servicios', y='nodo', color='estado', orientation='h',
-                         color_discrete_map=estado_colors,
-                         category_orders={'nodo': nodo_agg['nodo'].tolist()})
-            chart_layout(fig, height=max(350, len(nodo_agg) * 50),
-                         title='Servicios por Nodo (por Estado)',
-                         barmode='stack')
-            st.plotly_chart(fig, use_container_width=True)
-
-        with nc2:
-            fig = px.pie(nodo_agg, values='servicios', names='nodo', hole=0.45,
-                         color_discrete_sequence=PALETTE)
+    if tab_asig.open:
+
+        # ── Row 1: Monthly Trends (3 charts side by side) ─────────────────────
+        rec.section('asignaciones: monthly trends')
+        st.markdown("#### 📈 Tendencias Mensuales")
+        c1, c2, c3 = st.columns(3)
+
+        # Months come from the dense month index of timeseries.py (gaps are zeros)
+        tr = data.trends(sel)
+        mensual = tr.mensual
+
+        # Servicios totales por mes, with the rolling mean and atypical months
+        def fig_mes():
+            fig = px.area(mensual, x='mes', y='servicios', markers=True,
+                          color_discrete_sequence=[COLORS['primary']])
+            fig.update_traces(fill='tozeroy', fillcolor='rgba(59,130,246,0.15)',
+                              line=dict(width=2.5))
+            linea_media(fig, mensual, 'servicios_media')
+            marcar_anomalias(fig, mensual[mensual['anomalia']], 'servicios')
+            chart_layout(fig, title='Servicios Totales', showlegend=False)
+            fig.update_xaxes(tickangle=-45)
+            return fig
+        with c1:
+            plot(sel, 'mes_servicios', fig_mes)
+
+        # Concluidos por mes
+        def fig_concl_mes():
+            fig = px.area(mensual, x='mes', y='concluidos', markers=True,
+                          labels={'concluidos': 'servicios'},
+                          color_discrete_sequence=[COLORS['success']])
+            fig.update_traces(fill='tozeroy', fillcolor='rgba(16,185,129,0.15)',
+                              line=dict(width=2.5))
+            linea_media(fig, mensual, 'concluidos_media')
+            chart_layout(fig, title='Servicios Concluidos', showlegend=False)
+            fig.update_xaxes(tickangle=-45)
+            return fig
+        with c2:
+            plot(sel, 'mes_concluidos', fig_concl_mes)
+
+        # Expedientes por mes
+        def fig_exp_mes():
+            fig = px.area(mensual, x='mes', y='expedientes', markers=True,
+                          color_discrete_sequence=[COLORS['secondary']])
+            fig.update_traces(fill='tozeroy', fillcolor='rgba(139,92,246,0.15)',
+                              line=dict(width=2.5))
+            linea_media(fig, mensual, 'expedientes_media')
+            chart_layout(fig, title='Expedientes', showlegend=False)
+            fig.update_xaxes(tickangle=-45)
+            return fig
+        with c3:
+            plot(sel, 'mes_expedientes', fig_exp_mes)
+        st.caption(f"Línea discontinua: media móvil de {timeseries.WINDOW} meses · "
+                   "⭕ mes atípico frente a los mismos meses de años anteriores")
+
+        # ── Row 1b: Conclusion rate and cumulative servicios ──────────────────
+        rec.section('asignaciones: rate and cumulative')
+        st.markdown("#### 📉 Tasa de Conclusión y Acumulado")
+        t1, t2 = st.columns(2)
+
+        def fig_tasa_mes():
+            fig = px.line(mensual, x='mes', y='pct_conclusion', markers=True,
+                          labels={'pct_conclusion': '% conclusión'},
+                          color_discrete_sequence=[COLORS['accent']])
+            linea_media(fig, mensual, 'pct_conclusion_media')
+            chart_layout(fig, title='% Conclusión Mensual', showlegend=False)
+            fig.update_xaxes(tickangle=-45)
+            fig.update_yaxes(ticksuffix='%')
+            return fig
+        with t1:
+            plot(sel, 'mes_tasa', fig_tasa_mes)
+
+        def fig_acumulado():
+            fig = px.area(mensual, x='mes', y='acumulado', labels={'acumulado': 'servicios'},
+                          color_discrete_sequence=[COLORS['warning']])
+            fig.update_traces(fill='tozeroy', fillcolor='rgba(245,158,11,0.15)',
+                              line=dict(width=2.5))
+            chart_layout(fig, title='Servicios Acumulados')
+            fig.update_xaxes(tickangle=-45)
+            return fig
+        with t2:
+            plot(sel, 'mes_acumulado', fig_acumulado)
+
+        st.markdown("#### 🔎 Meses Atípicos por País")
+        tabla_anomalias(tr.anomalias, 'pais', 'País')
+
+        # ── Row 2: By Country (3 bar charts) ──────────────────────────────────
+        rec.section('asignaciones: by country')
+        st.markdown("#### 🌎 Por País")
+        c4, c5, c6 = st.columns(3)
+        h = max(350, len(res.por_pais) * 28)
+
+        # Servicios por país
+        def fig_pais_serv():
+            df_pais_serv = res.por_pais.sort_values('servicios', ascending=True)
+            fig = px.bar(df_pais_serv, x='servicios', y='pais', orientation='h',
+                         color_discrete_sequence=[COLORS['primary']])
+            chart_layout(fig, height=h, title='Servicios Totales')
+            return fig
+        with c4:
+            plot(sel, 'pais_servicios', fig_pais_serv)
+
+        # Concluidos por país
+        def fig_pais_concl():
+            df_pais_concl = res.por_pais[res.por_pais['concluidos'] != 0] \
+                .sort_values('concluidos', ascending=True)
+            fig = px.bar(df_pais_concl, x='concluidos', y='pais', orientation='h',
+                         labels={'concluidos': 'servicios'},
+                         color_discrete_sequence=[COLORS['success']])
+            chart_layout(fig, height=h, title='Concluidos')
+            return fig
+        with c5:
+            plot(sel, 'pais_concluidos', fig_pais_concl)
+
+        # Expedientes por país
+        def fig_pais_exp():
+            df_pais_exp = res.por_pais.sort_values('expedientes', ascending=True)
+            fig = px.bar(df_pais_exp, x='expedientes', y='pais', orientation='h',
+                         color_discrete_sequence=[COLORS['secondary']])
+            chart_layout(fig, height=h, title='Expedientes')
+            return fig
+        with c6:
+            plot(sel, 'pais_expedientes', fig_pais_exp)
+
+        # ── Row 3: Distributions ──────────────────────────────────────────────
+        rec.section('asignaciones: distributions')
+        st.markdown("#### 📊 Distribuciones")
+        c7, c8, c9 = st.columns(3)
+
+        # Estado distribution (pie)
+        def fig_estado():
+            color_map = {'CONCLUIDA': COLORS['success'], 'CANCELADA': COLORS['danger'],
+                         'PROCESO': COLORS['warning'], 'OTRO': COLORS['muted'],
+                         'SIN_ESTADO': '#475569', 'DESCONOCIDO': '#475569'}
+            fig = px.pie(res.por_estado, values='servicios', names='estado', hole=0.45,
+                         color='estado', color_discrete_map=color_map)
             fig.update_traces(textinfo='percent+label', textfont_size=11)
-            chart_layout(fig, title='Distribución %')
-            st.plotly_chart(fig, use_container_width=True)
-
-        if sin_nodo_serv > 0:
-            st.info(f"ℹ️ Hay **{sin_nodo_serv:,}** servicios sin nodo asignado ({sin_nodo_serv/n_total_serv*100:.1f}% del total). Estos expedientes no tienen cruce en el archivo SOA.")
-
-        # ── Row 2: Monthly trend per nodo ─────────────────────────────────────
-        st.markdown("#### 📈 Tendencia Mensual por Nodo")
-        nodo_mensual = dfn_clean.groupby(['nodo', 'mes'], as_index=False)['servicios'].sum().sort_values('mes')
-        fig = px.line(nodo_mensual, x='mes', y='servicios', color='nodo',
-                      markers=True, color_discrete_sequence=PALETTE)
-        chart_layout(fig, height=420, title='Servicios Totales por Nodo')
-        fig.update_xaxes(tickangle=-45)
-        st.plotly_chart(fig, use_container_width=True)
-
-        # ── Row 3: Countries per Nodo ─────────────────────────────────────────
-        st.markdown("#### 🌎 Países atendidos por cada Nodo")
-
-        nodo_pais = dfn_clean.groupby(['nodo', 'pais_asistencia'], as_index=False).agg(
-            servicios=('servicios', 'sum'),
-            expedientes=('expedientes', 'sum'),
-        )
-
-        # Show top nodos in expandable sections
-        top_nodos = nodo_agg.sort_values('servicios', ascending=False)['nodo'].tolist()
-        for nodo in top_nodos:
-            nodo_detail = nodo_pais[nodo_pais['nodo'] == nodo].sort_values('servicios', ascending=False)
-            total_nodo = nodo_detail['servicios'].sum()
-            with st.expander(f"🏢 **{nodo}** — {fmt(total_nodo)} servicios, {len(nodo_detail)} países"):
-                ec1, ec2 = st.columns([3, 2])
-                with ec1:
-                    fig = px.bar(nodo_detail.sort_values('servicios', ascending=True),
-                                 x='servicios', y='pais_asistencia', orientation='h',
-                                 color_discrete_sequence=[COLORS['accent']])
-                    chart_layout(fig, height=max(200, len(nodo_detail) * 25), title=f'Servicios')
-                    st.plotly_chart(fig, use_container_width=True)
-                with ec2:
-                    tbl = nodo_detail[['pais_asistencia', 'servicios', 'expedientes']].copy()
-                    tbl.columns = ['País', 'Servicios', 'Expedientes']
-                    tbl['%'] = (tbl['Servicios'] / total_nodo * 100).round(1)
-                    st.dataframe(
-                        tbl.style.format({'Servicios': '{:,.0f}', 'Expedientes': '{:,.0f}', '%': '{:.1f}%'}),
-                        use_container_width=True, hide_index=True,
-                    )
-
-        # ── Row 4: Nodo summary table ─────────────────────────────────────────
-        st.markdown("#### 📋 Tabla Resumen por Nodo")
-        nodo_summary = dfn_clean.groupby('nodo', as_index=False).agg(
-            servicios=('servicios', 'sum'),
-            expedientes=('expedientes', 'sum'),
-        )
-        nodo_concl = dfn_clean[dfn_clean['estado'] == 'CONCLUIDA'].groupby('nodo', as_index=False)['servicios'].sum()
-        nodo_concl.columns = ['nodo', 'concluidos']
-        nodo_summary = nodo_summary.merge(nodo_concl, on='nodo', how='left').fillna(0)
-        nodo_summary['pct_conclusion'] = (nodo_summary['concluidos'] / nodo_summary['servicios'] * 100).round(1)
-        nodo_summary['paises'] = nodo_summary['nodo'].apply(
-            lambda n: len(nodo_pais[nodo_pais['nodo'] == n]['pais_asistencia'].unique())
-        )
-        nodo_summary = nodo_summary.sort_values('servicios', ascending=False)
-        nodo_summary.columns = ['Nodo', 'Servicios', 'Expedientes', 'Concluidos', '% Conclusión', 'Países']
-        nodo_summary = nodo_summary[['Nodo', 'Servicios', 'Concluidos', 'Expedientes', '% Conclusión', 'Países']]
+            chart_layout(fig, title='Estado de Servicios')
+            return fig
+        with c7:
+            plot(sel, 'estado', fig_estado)
+
+        # Tipo asignación (pie) — group small segments to avoid label overlap
+        def fig_tipo():
+            df_tipo = res.por_tipo.sort_values('servicios', ascending=False)
+            top_n = 5
+            if len(df_tipo) > top_n:
+                top = df_tipo.head(top_n)
+                otros = pd.DataFrame([{
+                    'tipo_asignacion': 'OTROS',
+                    'servicios': df_tipo.iloc[top_n:]['servicios'].sum()
+                }])
+                df_tipo = pd.concat([top, otros], ignore_index=True)
+            fig = px.pie(df_tipo, values='servicios', names='tipo_asignacion', hole=0.45,
+                         color_discrete_sequence=PALETTE)
+            fig.update_traces(textinfo='percent', textfont_size=11,
+                              textposition='inside')
+            chart_layout(fig, title='Tipo de Asignación')
+            fig.update_layout(legend=dict(font=dict(size=10), orientation='v',
+                                           y=0.5, x=1.02))
+            return fig
+        with c8:
+            plot(sel, 'tipo', fig_tipo)
+
+        # App vs Manual (bar)
+        def fig_categoria():
+            cmap = {'App / Automatizado': COLORS['accent'], 'Manual': COLORS['warning'], 'Otro': COLORS['muted']}
+            fig = px.bar(res.por_categoria, x='categoria', y='servicios', color='categoria',
+                         color_discrete_map=cmap)
+            chart_layout(fig, title='App vs Manual', showlegend=False)
+            return fig
+        with c9:
+            plot(sel, 'categoria', fig_categoria)
+
+        # ── Row 4: % Conclusión por País ──────────────────────────────────────
+        rec.section('asignaciones: conclusion rate')
+        st.markdown("#### 🎯 Tasa de Conclusión por País")
+        df_rate = query.tasa_por_pais(res).sort_values('pct_conclusion', ascending=True)
+
+        def fig_rate():
+            fig = px.bar(df_rate, x='pct_conclusion', y='pais', orientation='h',
+                         color='pct_conclusion',
+                         color_continuous_scale=['#ef4444', '#f59e0b', '#10b981'],
+                         range_color=[30, 85])
+            chart_layout(fig, height=max(350, len(df_rate) * 28),
+                         title='% Servicios Concluidos por País',
+                         coloraxis_colorbar=dict(title='%'))
+            fig.update_traces(texttemplate='%{x:.1f}%', textposition='outside', textfont_size=10)
+            return fig
+        plot(sel, 'pais_conclusion', fig_rate)
+
+        # ── Row 5: Data Table ─────────────────────────────────────────────────
+        rec.section('asignaciones: table')
+        st.markdown("#### 📋 Tabla Resumen por País")
+        df_table = df_rate[['pais', 'servicios', 'concluidos', 'expedientes', 'pct_conclusion']].copy()
+        df_table = df_table.sort_values('servicios', ascending=False)
+        df_table['cancelados'] = df_table['servicios'] - df_table['concluidos']
+        df_table = df_table[['pais', 'servicios', 'concluidos', 'cancelados', 'expedientes', 'pct_conclusion']]
+        df_table.columns = ['País', 'Total Servicios', 'Concluidos', 'Cancelados', 'Expedientes', '% Conclusión']
+
+        # Add totals row
+        totals = pd.DataFrame([{
+            'País': '🟰 TOTAL',
+            'Total Servicios': df_table['Total Servicios'].sum(),
+            'Concluidos': df_table['Concluidos'].sum(),
+            'Cancelados': df_table['Cancelados'].sum(),
+            'Expedientes': total_expedientes,
+            '% Conclusión': round(df_table['Concluidos'].sum() / df_table['Total Servicios'].sum() * 100, 1) if df_table['Total Servicios'].sum() else 0,
+        }])
+        df_display = pd.concat([df_table, totals], ignore_index=True)
 
         st.dataframe(
-            nodo_summary.style.format({
-                'Servicios': '{:,.0f}',
+            df_display.style.format({
+                'Total Servicios': '{:,.0f}',
                 'Concluidos': '{:,.0f}',
+                'Cancelados': '{:,.0f}',
                 'Expedientes': '{:,.0f}',
                 '% Conclusión': '{:.1f}%',
             }),
-            use_container_width=True,
+            width='stretch',
             hide_index=True,
+            height=min(600, 40 * len(df_display) + 40),
         )
-    else:
-        st.warning("⚠️ No hay datos de nodos disponibles. Ejecuta `generate_data.py` primero.")
+        exportar({'paises': "Resumen por país", 'detalle': "Detalle filtrado (país × mes × tipo × estado)"}, sel)
+
+        if comp is not None:
+            st.markdown(f"#### 📈 Comparación por País · {periodo(sel)} vs {periodo(comp.anterior)}")
+            tabla_comparacion(comp.paises, 'pais', 'País')
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TAB 2: NODOS
+# ═══════════════════════════════════════════════════════════════════════════════
+with tab_nodos:
+    if tab_nodos.open:
+        if nodo_cube is not None:
+            # Apply year filter to nodos too
+            nsel = query.nodo_selection(sel)
+            rec.section('nodos: index')
+
+            idx = data.nodos_index(sel)
+            # Charts list nodos from least to most busy
+            nodo_asc = idx.nodos.iloc[::-1]
+
+            # ── KPI Row ───────────────────────────────────────────────────────
+            rec.section('nodos: kpis')
+            # Use asignaciones data for totals to match main KPIs exactly:
+            # nodo data has no tipo_asignacion, so the tipo filter can't apply.
+            # Expedientes are merged sketches, so they no longer overcount.
+            nodos_activos = len(idx.nodos)
+            n_total_serv = total_servicios
+            n_total_exp = total_expedientes
+            n_concl = concluidos
+
+            nk1, nk2, nk3, nk4 = st.columns(4)
+            nk1.metric("🏢 Nodos Activos", nodos_activos)
+            nk2.metric("📋 Servicios", fmt(n_total_serv), delta_kpi(comp, 'total_servicios'))
+            nk3.metric("✅ Concluidos", fmt(n_concl), delta_kpi(comp, 'concluidos'))
+            nk4.metric("📁 Expedientes", fmt(n_total_exp), delta_kpi(comp, 'expedientes'))
+
+            st.markdown("")
+
+            # ── Row 1: Nodo overview (bar + pie) ──────────────────────────────
+            rec.section('nodos: overview')
+            st.markdown("#### 🏢 Distribución por Nodo")
+            nc1, nc2 = st.columns([3, 2])
+
+            # Filter out "Sin Nodo" for cleaner display, but show as info
+            sin_nodo_serv = idx.sin_nodo
+
+            # Stacked bar: concluidos vs cancelados per nodo
+            def fig_nodo_estado():
+                estado_colors = {'CONCLUIDA': COLORS['success'], 'CANCELADA': COLORS['danger'],
+                                'PROCESO': COLORS['warning'], 'OTRO': COLORS['muted'], 'SIN_ESTADO': '#475569'}
+                fig = px.bar(idx.por_estado, x='servicios', y='nodo', color='estado', orientation='h',
+                             color_discrete_map=estado_colors,
+                             category_orders={'nodo': nodo_asc['nodo'].tolist()})
+                chart_layout(fig, height=max(350, len(nodo_asc) * 50),
+                             title='Servicios por Nodo (por Estado)',
+                             barmode='stack')
+                return fig
+            with nc1:
+                plot(nsel, 'nodo_estado', fig_nodo_estado)
+
+            def fig_nodo_pie():
+                fig = px.pie(nodo_asc, values='servicios', names='nodo', hole=0.45,
+                             color_discrete_sequence=PALETTE)
+                fig.update_traces(textinfo='percent+label', textfont_size=11)
+                chart_layout(fig, title='Distribución %')
+                return fig
+            with nc2:
+                plot(nsel, 'nodo_distribucion', fig_nodo_pie)
+
+            if sin_nodo_serv > 0 and n_total_serv:
+                st.info(f"ℹ️ Hay **{sin_nodo_serv:,}** servicios sin nodo asignado ({sin_nodo_serv/n_total_serv*100:.1f}% del total). Estos expedientes no tienen cruce en el archivo SOA.")
+
+            # ── Row 2: Monthly trend per nodo ─────────────────────────────────
+            rec.section('nodos: monthly trend')
+            st.markdown("#### 📈 Tendencia Mensual por Nodo")
+            ntr = data.nodos_trends(sel)
+            def fig_nodo_mensual():
+                fig = px.line(ntr.mensual, x='mes', y='servicios', color='nodo',
+                              markers=True, color_discrete_sequence=PALETTE)
+                marcar_anomalias(fig, ntr.mensual[ntr.mensual['anomalia']], 'servicios')
+                chart_layout(fig, height=420, title='Servicios Totales por Nodo')
+                fig.update_xaxes(tickangle=-45)
+                return fig
+            plot(nsel, 'nodo_mensual', fig_nodo_mensual)
+            with st.expander("🔎 Meses atípicos por nodo"):
+                tabla_anomalias(ntr.anomalias, 'nodo', 'Nodo')
+
+            # ── Row 3: Countries per Nodo ─────────────────────────────────────
+            rec.section('nodos: countries per nodo')
+            st.markdown("#### 🌎 Países atendidos por cada Nodo")
+
+            # Top nodos in expandable sections, NODOS_PAGE at a time; a body is
+            # only built while its expander is open
+            n_visibles = st.session_state.setdefault('nodos_visibles', NODOS_PAGE)
+            visibles = idx.nodos[['nodo', 'servicios', 'paises']].head(n_visibles)
+            for i, (nodo, total_nodo, n_paises) in enumerate(visibles.itertuples(index=False)):
+                exp = st.expander(f"🏢 **{nodo}** — {fmt(total_nodo)} servicios, {n_paises} países",
+                                  key=f'nodo_exp:{nodo}', on_change='rerun')
+                if not exp.open:
+                    continue
+                nodo_detail = idx.detail(i)
+                with exp:
+                    ec1, ec2 = st.columns([3, 2])
+                    def fig_nodo_paises():
+                        fig = px.bar(nodo_detail.sort_values('servicios', ascending=True),
+                                     x='servicios', y='pais_asistencia', orientation='h',
+                                     color_discrete_sequence=[COLORS['accent']])
+                        chart_layout(fig, height=max(200, len(nodo_detail) * 25), title='Servicios')
+                        return fig
+                    with ec1:
+                        plot(nsel, f'nodo_paises:{nodo}', fig_nodo_paises)
+                    with ec2:
+                        tbl = nodo_detail[['pais_asistencia', 'servicios', 'expedientes']].copy()
+                        tbl.columns = ['País', 'Servicios', 'Expedientes']
+                        tbl['%'] = (tbl['Servicios'] / total_nodo * 100).round(1)
+                        st.dataframe(
+                            tbl.style.format({'Servicios': '{:,.0f}', 'Expedientes': '{:,.0f}', '%': '{:.1f}%'}),
+                            width='stretch', hide_index=True,
+                        )
+
+            restantes = len(idx.nodos) - len(visibles)
+            if restantes > 0:
+                st.button(f"Cargar más ({restantes} nodos restantes)", key='nodos_mas',
+                          on_click=mostrar_mas_nodos)
+
+            # ── Row 4: Nodo summary table ─────────────────────────────────────
+            rec.section('nodos: table')
+            st.markdown("#### 📋 Tabla Resumen por Nodo")
+            nodo_summary = idx.nodos[['nodo', 'servicios', 'concluidos', 'expedientes', 'pct_conclusion', 'paises']]
+            nodo_summary.columns = ['Nodo', 'Servicios', 'Concluidos', 'Expedientes', '% Conclusión', 'Países']
+            st.dataframe(
+                nodo_summary.style.format({
+                    'Servicios': '{:,.0f}',
+                    'Concluidos': '{:,.0f}',
+                    'Expedientes': '{:,.0f}',
+                    '% Conclusión': '{:.1f}%',
+                }),
+                width='stretch',
+                hide_index=True,
+            )
+            exportar({'nodos': "Resumen por nodo", 'nodos_paises': "Países de cada nodo"}, sel)
+
+            if comp is not None:
+                # Unlike the rest of the tab, the comparison also applies the month
+                st.markdown(f"#### 📈 Comparación por Nodo · {periodo(sel)} vs {periodo(comp.anterior)}")
+                tabla_comparacion(comp.nodos, 'nodo', 'Nodo')
+        else:
+            st.warning("⚠️ No hay datos de nodos disponibles. Ejecuta `generate_data.py` primero.")
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TAB 3: DETALLE
+# ═══════════════════════════════════════════════════════════════════════════════
+# One page of asistencias at a time from the detail store (store/detalle):
+# count and page are reads of the matching (país, mes) files, never the whole table.
+with tab_detalle:
+    if tab_detalle.open:
+        if data.detail_available():
+            rec.section('detalle: page')
+            dc1, dc2 = st.columns([1, 1])
+            nodos_opts = ["Todos"] + (sorted(nodo_cube.labels['nodo'].tolist()) if nodo_cube is not None else [])
+            nodo_sel = dc1.selectbox("🏢 Nodo", nodos_opts, index=0, key='detalle_nodo')
+            expediente = dc2.text_input("🔢 Expediente", key='detalle_expediente',
+                                        placeholder="ID exacto del expediente")
+            filtros = (memo.key(sel), nodo_sel, expediente)
+            # A new filter starts over at the first page
+            if st.session_state.get('detalle_filtros') != filtros:
+                st.session_state['detalle_filtros'] = filtros
+                st.session_state['detalle_pagina'] = 1
+            nodo = None if nodo_sel == "Todos" else nodo_sel
+            total = data.detail_count(sel, nodo, expediente)
+            paginas = max(1, -(-total // query.DETAIL_PAGE))
+            pc1, pc2 = st.columns([1, 3])
+            pagina = pc1.number_input("Página", min_value=1, max_value=paginas, step=1, key='detalle_pagina')
+            pc2.caption(f"**{total:,}** asistencias · página {pagina:,} de {paginas:,}")
+            filas = data.detail_page(sel, pagina - 1, nodo, expediente)
+            filas = filas.set_axis(['Expediente', 'Asistencia', 'País', 'Mes', 'Tipo', 'Estado', 'Nodo'], axis=1)
+            st.dataframe(filas, width='stretch', hide_index=True)
+        else:
+            st.warning("⚠️ No hay detalle de expedientes disponible. Ejecuta `generate_data.py` sin `--no-detail`.")
 
 # ─── Footer ───────────────────────────────────────────────────────────────────
 st.markdown("---")
 st.caption("📊 Dashboard Addiuva · Datos procesados desde archivos Client · Concluidos = estado_asistencia == CONCLUIDA")
+
+# Shared chart cache metrics (drawn last so they include this run's lookups)
+stats = cache.stats()
+with st.sidebar:
+    st.caption(f"⚡ Caché compartida: {stats['entries']} entradas · "
+               f"{stats['hits']:,} aciertos · {stats['misses']:,} fallos "
+               f"({stats['hit_rate']:.0%})")
+    st.caption(f"📦 Gráficos: {payload.charts} · {payload.sent / 1024:,.0f} KB "
+               f"de {payload.limit / 1024:,.0f} KB por página")
+
+# ─── Debug Panel ──────────────────────────────────────────────────────────────
+rec.finish()
+if rec.enabled:
+    with st.expander("⏱️ Tiempos por sección"):
+        tiempos = pd.DataFrame(rec.rows())
+        tiempos['name'] = ['· ' * d + n for d, n in zip(tiempos['depth'], tiempos['name'])]
+        st.dataframe(tiempos[['name', 'start_ms', 'ms']], width='stretch', hide_index=True)
+        st.download_button("Descargar traza (Chrome trace)", rec.dumps(),
+                           file_name='dashboard-trace.json', mime='application/json')
@@ -0,0 +1,240 @@
+"""
+benchmarks/run.py — Timed ingestion and dashboard scenarios on synthetic data.
+
+Generates Client files at the requested scale (see synth.py), then measures:
+  ingest          generate_data.py --full: wall time, rows/s, peak RSS
+  ingest_cached   generate_data.py again with nothing changed (incremental path)
+  ingest_bounded  generate_data.py --full --memory-mb: the spill-to-disk aggregation
+  app             cold load of app.py and the rerun latency of a sequence of
+                  sidebar filter changes, first visit and repeat visit, and
+                  the Plotly figure JSON each page sends (chart_payload_kb)
+  query           query.Engine cold load and per-selection latency
+
+Each run appends one JSON record (machine, git commit, scale, results) to
+--output, so regressions show up by comparing records across commits.
+
+Usage:
+  python -m benchmarks.run [--scale 10] [--nodos 6] [--workers N] [--work-dir DIR]
+                           [--compression gzip] [--memory-mb 256] [--output benchmarks/results.jsonl] [--skip app,query]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks import synth
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS = ROOT / 'benchmarks' / 'results.jsonl'
+SCENARIOS = ('ingest', 'ingest_cached', 'ingest_bounded', 'app', 'query')
+
+def run_measured(cmd, env=None):
+    """Run ``cmd`` to completion; wall seconds and peak RSS (largest process, MB)."""
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=out, stderr=err)
+        peak = None
+        if hasattr(os, 'wait4'):
+            # Reap the child ourselves to get its rusage (ru_maxrss is in KB on Linux)
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            peak = usage.ru_maxrss / 1024
+        else:
+            proc.wait()
+        seconds = time.perf_counter() - t0
+        out.seek(0)
+        err.seek(0)
+        if proc.returncode:
+            raise RuntimeError(f"{' '.join(map(str, cmd))} failed:\n{err.read().decode(errors='replace')}")
+        return {'seconds': round(seconds, 3), 'peak_rss_mb': round(peak, 1) if peak else None}, out.read()
+
+def percentiles(values_ms):
+    values = sorted(values_ms)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'n': len(values), 'p50': round(pick(0.5), 1), 'p95': round(pick(0.95), 1),
+            'max': round(values[-1], 1)}
+
+# ─── Scenarios ────────────────────────────────────────────────────────────────
+def bench_ingest(info, workers, full=True, memory_mb=None):
+    cmd = [sys.executable, 'generate_data.py', '--input-dir', info['paises_dir'],
+           '--data-dir', info['data_dir'], '--workers', str(workers)]
+    if memory_mb:
+        cmd += ['--memory-mb', str(memory_mb)]
+    result, _ = run_measured(cmd + (['--full'] if full else []))
+    result['rows_per_s'] = round(info['rows'] / result['seconds'])
+    result['mb_per_s'] = round(info['bytes'] / 1e6 / result['seconds'], 1)
+    return result
+
+def bench_app(data_dir):
+    """Run app_child() in a fresh interpreter so the load is really cold."""
+    env = dict(os.environ, DASHBOARD_DATA_DIR=data_dir)
+    result, out = run_measured([sys.executable, '-m', 'benchmarks.run', '--app-child'], env)
+    child = json.loads(out.decode().strip().splitlines()[-1])
+    child['peak_rss_mb'] = result['peak_rss_mb']
+    return child
+
+def filter_changes(at):
+    """Sidebar changes to time, as (label, apply) pairs; every one triggers a rerun.
+
+    Año, Mes, País and Tipo are the first four multi-selects; an empty one is "Todos".
+    """
+    año, mes, pais, tipo = at.multiselect[0], at.multiselect[1], at.multiselect[2], at.multiselect[3]
+    meses = [m for m in range(1, 13) if mes.format_func(m) in mes.options]
+    picks = [(0, 'año', [int(a) for a in año.options[:3]]),
+             (1, 'mes', meses[:3] + [None]),
+             (2, 'pais', pais.options[:3] + [None]),
+             (3, 'tipo', tipo.options[:2] + [None])]
+    changes = []
+    for i, name, values in picks:
+        for value in values:
+            changes.append((f'{name}={value}',
+                            lambda a, i=i, v=value: a.multiselect[i].set_value([] if v is None else [v])))
+    changes.append(('solo_concluidos=on', lambda a: a.toggle[0].set_value(True)))
+    changes.append(('solo_concluidos=off', lambda a: a.toggle[0].set_value(False)))
+    return changes
+
+def chart_payload(at):
+    """Bytes of Plotly figure JSON the last run sent."""
+    return sum(len(chart.proto.spec) for chart in at.get('plotly_chart'))
+
+def app_child():
+    """Time app.py under streamlit's AppTest; prints one JSON line."""
+    from streamlit.testing.v1 import AppTest
+
+    import charts
+
+    at = AppTest.from_file(str(ROOT / 'app.py'), default_timeout=3600)
+    t0 = time.perf_counter()
+    at.run()
+    result = {'cold_load_s': round(time.perf_counter() - t0, 3)}
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+    changes = filter_changes(at)
+    payloads = [chart_payload(at)]
+    for phase in ('rerun_ms', 'rerun_repeat_ms'):
+        times = []
+        for _, apply in changes:
+            apply(at)
+            t0 = time.perf_counter()
+            at.run()
+            times.append((time.perf_counter() - t0) * 1000)
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+            payloads.append(chart_payload(at))
+        # The Nodos tab only renders while it is the open tab
+        at.session_state['tab'] = "🏢 Nodos (Call Centers)"
+        t0 = time.perf_counter()
+        at.run()
+        result[phase.replace('rerun', 'nodos_tab')] = round((time.perf_counter() - t0) * 1000, 1)
+        payloads.append(chart_payload(at))
+        result[phase] = percentiles(times)
+    # Figure JSON per page (KB), against the app's budget
+    result['chart_payload_kb'] = dict(percentiles([p / 1024 for p in payloads]),
+                                      budget=charts.PAGE_BUDGET // 1024)
+    print(json.dumps(result))
+
+def bench_query(data_dir):
+    import query
+
+    t0 = time.perf_counter()
+    engine = query.Engine(data_dir, Path(data_dir) / 'store')
+    asig, _ = engine.refresh()
+    result = {'cold_load_s': round(time.perf_counter() - t0, 3)}
+    sels = [query.selection(año=a, mes_num=m) for a in [None] + list(asig.labels['año'])
+            for m in [None] + list(asig.labels['mes_num'])]
+    for phase in ('query_ms', 'query_repeat_ms'):
+        times = []
+        for sel in sels:
+            t0 = time.perf_counter()
+            for name in query.TABLES:
+                engine.answer(name, sel)
+            times.append((time.perf_counter() - t0) * 1000)
+        result[phase] = percentiles(times)
+    return result
+
+# ─── Runner ───────────────────────────────────────────────────────────────────
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ingestion and the dashboard on synthetic data.')
+    parser.add_argument('--scale', type=float, default=10.0,
+                        help='multiple of production volume (about 2.2M rows at 1)')
+    parser.add_argument('--nodos', type=int, default=len(synth.NODO_NAMES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes for generate_data.py')
+    parser.add_argument('--compression', choices=sorted(synth.COMPRESSIONS.values()),
+                        help='write the synthetic Client files compressed (default: plain CSV)')
+    parser.add_argument('--memory-mb', type=int, default=256,
+                        help='aggregation memory budget of the ingest_bounded scenario')
+    parser.add_argument('--work-dir', help='where to write the synthetic data (default: a temp dir, removed after)')
+    parser.add_argument('--output', default=str(RESULTS), help='JSON-lines file the record is appended to')
+    parser.add_argument('--skip', default='', help=f"comma-separated scenarios to skip: {','.join(SCENARIOS[1:])}")
+    parser.add_argument('--app-child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.app_child:
+        return app_child()
+
+    skip = {s for s in args.skip.split(',') if s}
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='dashboard-bench-')
+    record = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'workers': args.workers,
+    }
+    try:
+        print(f"Generating scale {args.scale:g} data in {work_dir}...")
+        t0 = time.perf_counter()
+        info = synth.generate(work_dir, args.scale, args.nodos, args.seed, args.compression)
+        record.update(scale=args.scale, rows=info['rows'], bytes=info['bytes'], nodos=args.nodos,
+                      compression=args.compression,
+                      synth_s=round(time.perf_counter() - t0, 3))
+
+        # Ingestion produces the data the later scenarios read, so it always runs
+        print("Running ingest...")
+        record['ingest'] = bench_ingest(info, args.workers)
+        if 'ingest_cached' not in skip:
+            print("Running ingest_cached...")
+            record['ingest_cached'] = bench_ingest(info, args.workers, full=False)
+        if 'ingest_bounded' not in skip:
+            print("Running ingest_bounded...")
+            record['ingest_bounded'] = dict(bench_ingest(info, args.workers, memory_mb=args.memory_mb),
+                                            memory_mb=args.memory_mb)
+        if 'app' not in skip:
+            print("Running app...")
+            record['app'] = bench_app(info['data_dir'])
+        if 'query' not in skip:
+            print("Running query...")
+            record['query'] = bench_query(info['data_dir'])
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(json.dumps(record, indent=2, ensure_ascii=False))
+    print(f"\nAppended to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+benchmarks/synth.py — Synthetic Client files at a multiple of production scale.
+
+Writes one raw file per entry of generate_data.CLIENT_PAISES (semicolon
+delimited, latin-1, the columns generate_data.py reads plus filler columns),
+optionally gzip or zstd compressed, and a matching soa_nodos.csv:
+
+  <out>/paises/Client01_Puerto_Rico_20251027.csv[.gz|.zst] ...
+  <out>/data/soa_nodos.csv
+
+Scale 1 is about the production volume behind the checked-in data/ (2.2M
+asistencias over 34 months, split between countries and estados like the
+real data); --scale 10 .. 1000 gives the 10x-1000x runs. Output is
+deterministic for a given seed and scale.
+
+Usage:
+  python -m benchmarks.synth OUT_DIR [--scale 10] [--nodos 6] [--seed 0] [--compression gzip]
+"""
+import argparse
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from generate_data import CLIENT_PAISES, COMPRESSIONS
+
+FECHA = '20251027'
+
+PRODUCTION_ROWS = 2_200_000
+FIRST_MONTH = '2023-01'
+MONTHS = 34
+SERVICIOS_POR_EXPEDIENTE = 1.18
+BLOCK_ROWS = 500_000
+
+# Share of asistencias per country in the production data
+PAIS_WEIGHTS = {
+    'Puerto Rico': 1323547, 'Guatemala': 330611, 'Costa Rica': 186525, 'Dominicana': 120478,
+    'Argentina': 55768, 'Bolivia': 47236, 'Chile': 45017, 'Uruguay': 26920, 'Mexico': 17031,
+    'Ecuador': 14559, 'Peru': 6523, 'Paraguay': 2158, 'Egipto': 1545, 'El Salvador': 794,
+    'Honduras': 449, 'Estados Unidos': 413, 'Colombia': 366, 'Nicaragua': 96,
+}
+# Raw estado_asistencia / tipo_asignacion values, including the casing,
+# padding and blanks generate_data.py normalizes
+ESTADOS = (['CONCLUIDA', 'CANCELADA', 'PROCESO', 'ABIERTA', 'concluida ', ''],
+           [0.712, 0.273, 0.008, 0.001, 0.004, 0.002])
+TIPOS = (['MANUAL', '', 'ANCLAJE BASE', 'ANCLAJE APP SOA', 'ANCLAJE', 'APP', 'BASE AUTOMATICO',
+          'ANCLAJE APP', 'APIROUTE1', ' manual'],
+         [0.31, 0.195, 0.18, 0.152, 0.063, 0.051, 0.025, 0.02, 0.0005, 0.0035])
+SERVICIOS = ['Grúa', 'Cerrajería', 'Paso de corriente', 'Cambio de llanta', 'Médico a domicilio']
+NODO_NAMES = ['Puerto Rico', 'Guatemala', 'Argentina', 'Costa Rica', 'Colombia', 'Mexico']
+SIN_NODO_SHARE = 0.23
+
+HEADER = ['id_expediente', 'id_asistencia', 'numero_poliza', 'estado_asistencia', 'tipo_asignacion',
+          'servicio', 'creacion_asistencia', 'cierre_asistencia', 'observaciones']
+
+def rows_per_file(scale):
+    total = sum(PAIS_WEIGHTS.values())
+    return {pais: max(1, round(PRODUCTION_ROWS * scale * w / total)) for pais, w in PAIS_WEIGHTS.items()}
+
+def nodo_names(n):
+    return NODO_NAMES[:n] + [f'Nodo {i:03d}' for i in range(len(NODO_NAMES), n)]
+
+def client_block(rng, n, first_id, first_exp, n_exp):
+    """One block of ``n`` raw rows as a frame in Client column order."""
+    start = pd.Timestamp(FIRST_MONTH + '-01')
+    seconds = rng.integers(0, MONTHS * 30 * 86400, n)
+    creacion = start + pd.to_timedelta(seconds, unit='s')
+    cierre = creacion + pd.to_timedelta(rng.integers(600, 6 * 3600, n), unit='s')
+    return pd.DataFrame({
+        'id_expediente': first_exp + rng.integers(0, n_exp, n),
+        'id_asistencia': np.arange(first_id, first_id + n),
+        'numero_poliza': rng.integers(10**7, 10**8, n),
+        'estado_asistencia': rng.choice(ESTADOS[0], n, p=ESTADOS[1]),
+        'tipo_asignacion': rng.choice(TIPOS[0], n, p=np.array(TIPOS[1]) / sum(TIPOS[1])),
+        'servicio': rng.choice(SERVICIOS, n),
+        'creacion_asistencia': creacion.strftime('%Y-%m-%d %H:%M:%S'),
+        'cierre_asistencia': cierre.strftime('%Y-%m-%d %H:%M:%S'),
+        'observaciones': 'Atención registrada; cliente notificado',
+    }, columns=HEADER)
+
+def open_output(path, compression=None):
+    """Text file at ``path``, written through ``compression`` ('gzip' or 'zstd') if given."""
+    if compression is None:
+        return open(path, 'w', encoding='latin-1', newline='')
+    return io.TextIOWrapper(pa.CompressedOutputStream(path, compression), encoding='latin-1', newline='')
+
+def generate(out_dir, scale=1.0, nodos=len(NODO_NAMES), seed=0, compression=None):
+    """Write the Client files and soa_nodos.csv under ``out_dir``; returns a summary dict.
+
+    ``bytes`` is the size of the Client files as written (compressed or not).
+    """
+    paises_dir = os.path.join(out_dir, 'paises')
+    data_dir = os.path.join(out_dir, 'data')
+    os.makedirs(paises_dir, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    counts = rows_per_file(scale)
+    names = np.array(nodo_names(nodos))
+
+    total_rows = total_bytes = 0
+    first_exp = 1
+    soa = []
+    ext = {v: k for k, v in COMPRESSIONS.items()}.get(compression, '')
+    for num, pais in CLIENT_PAISES.items():
+        n_rows = counts[pais]
+        n_exp = max(1, round(n_rows / SERVICIOS_POR_EXPEDIENTE))
+        path = os.path.join(paises_dir, f"Client{num}_{pais.replace(' ', '_')}_{FECHA}.csv{ext}")
+        with open_output(path, compression) as f:
+            f.write(';'.join(HEADER) + '\n')
+            for lo in range(0, n_rows, BLOCK_ROWS):
+                n = min(BLOCK_ROWS, n_rows - lo)
+                client_block(rng, n, total_rows + lo + 1, first_exp, n_exp) \
+                    .to_csv(f, sep=';', header=False, index=False, lineterminator='\n')
+        ids = np.arange(first_exp, first_exp + n_exp)
+        mapped = ids[rng.random(n_exp) >= SIN_NODO_SHARE]
+        soa.append(pd.DataFrame({'Id_Expediente': mapped, 'Nodo': rng.choice(names, len(mapped))}))
+        first_exp += n_exp
+        total_rows += n_rows
+        total_bytes += os.path.getsize(path)
+
+    pd.concat(soa).to_csv(os.path.join(data_dir, 'soa_nodos.csv'), index=False)
+    return {'scale': scale, 'rows': total_rows, 'bytes': total_bytes, 'expedientes': first_exp - 1,
+            'nodos': nodos, 'paises_dir': paises_dir, 'data_dir': data_dir}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic Client files for benchmarking.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiple of production volume (about 2.2M rows at 1)')
+    parser.add_argument('--nodos', type=int, default=len(NODO_NAMES),
+                        help='number of call-center nodos in soa_nodos.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compression', choices=sorted(COMPRESSIONS.values()),
+                        help='compress the Client files (default: plain CSV)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    t0 = time.perf_counter()
+    info = generate(args.out_dir, args.scale, args.nodos, args.seed, args.compression)
+    print(f"Wrote {info['rows']:,} rows ({info['bytes'] / 1e6:,.0f} MB) in "
+          f"{time.perf_counter() - t0:.1f}s to {args.out_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+bitmap.py — Row bitmaps per dimension value for the cube's fact-row filters.
+
+A BitmapIndex holds, for every value of one dimension, the fact rows with
+that value. Bitmaps are built once when the cube loads; a filter is then
+bitmap algebra on packed arrays (8 rows to a byte, np.packbits order)
+instead of a scan of the codes column:
+
+  several values of one dimension (multi-select)  OR of their bitmaps
+  filters on several dimensions                   AND of those results
+
+so a selection touches N/8 bytes per selected value rather than comparing
+all N row codes once per dimension. PrefixBitmaps answer ranges of an
+ordered dimension (months) with one AND NOT, whatever the range length.
+
+Both are built from the rows sorted by code (one argsort, bincount
+offsets), never from an n_values x n_rows matrix. A value held by fewer
+than 1 in SPARSE_SHARE rows keeps the sorted positions of its rows (4 bytes
+a row) instead of a packed bitmap (N/8 bytes), so the many rare values of
+a dimension cost memory in proportion to their rows.
+"""
+import numpy as np
+
+# Values on fewer than n_rows / SPARSE_SHARE rows keep positions, not a bitmap
+SPARSE_SHARE = 32
+
+def sorted_rows(codes, n_values):
+    """(row positions ordered by code, offsets): the rows of code k are rows[offsets[k]:offsets[k + 1]]."""
+    codes = np.asarray(codes)
+    rows = np.argsort(codes, kind='stable').astype(np.uint32)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n_values))])
+    return rows, offsets
+
+def pack(rows, n_rows):
+    """Packed bitmap of the rows at the (distinct) positions ``rows``."""
+    rows = np.asarray(rows, dtype=np.int64)
+    # Distinct bits of a byte add up to their OR
+    bits = np.bincount(rows >> 3, weights=np.right_shift(0x80, rows & 7), minlength=(n_rows + 7) // 8)
+    return bits.astype(np.uint8)
+
+class BitmapIndex:
+    """Row bitmap of each value code of one dimension column: packed, or sorted positions when rare."""
+
+    def __init__(self, codes, n_values):
+        self.n_rows = len(codes)
+        rows, offsets = sorted_rows(codes, n_values)
+        self.values = []
+        for lo, hi in zip(offsets[:-1], offsets[1:]):
+            if (hi - lo) * SPARSE_SHARE < self.n_rows:
+                self.values.append(rows[lo:hi].copy())
+            else:
+                self.values.append(pack(rows[lo:hi], self.n_rows))
+
+    @property
+    def nbytes(self):
+        return sum(v.nbytes for v in self.values)
+
+    def any_of(self, codes):
+        """Packed bitmap of the rows holding any of the value ``codes`` (OR)."""
+        codes = np.unique(np.asarray(codes, dtype=np.intp))
+        dense = [self.values[c] for c in codes if self.values[c].dtype == np.uint8]
+        sparse = [self.values[c] for c in codes if self.values[c].dtype != np.uint8]
+        if len(dense) == 1 and not sparse:
+            return dense[0]
+        out = pack(np.concatenate(sparse), self.n_rows) if sparse else \
+            np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for bits in dense:
+            np.bitwise_or(out, bits, out=out)
+        return out
+
+class PrefixBitmaps:
+    """Packed bitmap of the rows with a code below k, for every k in 0..n_values."""
+
+    def __init__(self, codes, n_values):
+        self.n_rows = len(codes)
+        rows, offsets = sorted_rows(codes, n_values)
+        self.bits = np.zeros((n_values + 1, (self.n_rows + 7) // 8), dtype=np.uint8)
+        for k in range(n_values):
+            # Rows below k + 1: those below k plus the rows of code k
+            np.bitwise_or(self.bits[k], pack(rows[offsets[k]:offsets[k + 1]], self.n_rows),
+                          out=self.bits[k + 1])
+
+    def between(self, lo, hi):
+        """Bitmap of the rows with lo <= code < hi."""
+        return np.bitwise_and(self.bits[hi], np.invert(self.bits[lo]))
+
+def all_of(bitmaps):
+    """AND of packed bitmaps (None for an empty list: no filter)."""
+    out = None
+    for bits in bitmaps:
+        out = bits.copy() if out is None else np.bitwise_and(out, bits, out=out)
+    return out
+
+def positions(bits, n_rows):
+    """Row positions set in a packed bitmap, in order."""
+    return np.flatnonzero(np.unpackbits(bits, count=n_rows))
@@ -0,0 +1,162 @@
+"""
+charts.py — Compact Plotly figures for the dashboard.
+
+Every chart is sent to the browser as Plotly JSON on each rerun, so its size
+is paid on every filter change. Three things keep it small:
+
+  TEMPLATE    one shared template holding the whole dashboard look (colors,
+              fonts, margins, grids), instead of the full plotly_dark
+              template (about 7 KB) plus the same styling repeated in the
+              layout of every figure
+  compact()   drops trace and layout entries that only restate the
+              template or plotly.js defaults; numeric data travels as typed
+              arrays (base64, smallest integer type), never lists of numbers
+  webgl()     line/scatter traces of a figure with more than GL_POINTS points
+              are drawn as scattergl (WebGL), which renders large series
+              without an SVG node per point
+
+Budget keeps the charts of one page within PAGE_BUDGET bytes (see app.plot).
+"""
+import base64
+import json
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+
+GRID = 'rgba(51,65,85,0.4)'
+MUTED = '#94a3b8'
+
+# The parts of plotly_dark the dashboard's charts use, with the dashboard's
+# own colors, fonts and margins on top
+_axis = dict(gridcolor=GRID, linecolor='#506784', zerolinecolor='#283442', zerolinewidth=2, ticks='',
+             tickfont=dict(size=10), title=dict(standoff=15), automargin=True)
+_bar_marker = dict(line=dict(color='rgb(17,17,17)', width=0.5))
+TEMPLATE = go.layout.Template(
+    layout=dict(
+        colorway=['#636efa', '#EF553B', '#00cc96', '#ab63fa', '#FFA15A', '#19d3f3', '#FF6692', '#B6E880',
+                  '#FF97FF', '#FECB52'],
+        font=dict(family='Inter', color=MUTED),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(15,23,42,0.6)',
+        margin=dict(l=20, r=20, t=40, b=20),
+        legend=dict(bgcolor='rgba(0,0,0,0)', font=dict(color=MUTED, size=11)),
+        hovermode='closest',
+        hoverlabel=dict(align='left'),
+        title=dict(x=0.05),
+        coloraxis=dict(colorbar=dict(outlinewidth=0, ticks='')),
+        xaxis=_axis,
+        yaxis=_axis,
+    ),
+    data=dict(
+        bar=[go.Bar(marker=_bar_marker)],
+        scatter=[go.Scatter(marker=dict(line=dict(color='#283442')))],
+        scattergl=[go.Scattergl(marker=dict(line=dict(color='#283442')))],
+        pie=[go.Pie(automargin=True)],
+    ),
+)
+
+# Points (over every line/scatter trace of a figure) past which they use WebGL
+GL_POINTS = 1000
+# Bytes of chart JSON per page and rerun (DASHBOARD_PAYLOAD_KB overrides)
+PAGE_BUDGET = int(os.environ.get('DASHBOARD_PAYLOAD_KB', 256)) << 10
+
+# Trace entries equal to these values restate plotly.js defaults
+TRACE_DEFAULTS = {'legendgroup': '', 'offsetgroup': '', 'xaxis': 'x', 'yaxis': 'y', 'orientation': 'v',
+                  'textposition': 'auto', 'fillpattern': {'shape': ''}}
+MARKER_DEFAULTS = {'symbol': 'circle', 'pattern': {'shape': ''}}
+# scatter entries scattergl has no equivalent for
+NOT_GL = ('stackgroup', 'fillpattern', 'orientation', 'groupnorm', 'stackgaps', 'cliponaxis')
+
+def style(fig, height=380, **layout):
+    """Apply the dashboard look: the TEMPLATE, a height and the chart's own ``layout``.
+
+    Plotly Express sets a top margin of its own; it is cleared so the
+    template's applies.
+    """
+    fig.layout.margin = None
+    fig.update_layout(template=TEMPLATE, height=height, **layout)
+    return fig
+
+def webgl(fig, max_points=GL_POINTS):
+    """Redraw the scatter traces of ``fig`` as scattergl when they hold more than ``max_points``."""
+    scatter = [t for t in fig.data if t.type == 'scatter']
+    if sum(len(t.x if t.x is not None else t.y) for t in scatter) <= max_points:
+        return fig
+    traces = []
+    for t in fig.data:
+        if t.type != 'scatter':
+            traces.append(t)
+            continue
+        spec = t.to_plotly_json()
+        if spec.get('stackgroup'):
+            spec['fill'] = spec.get('fill') or 'tozeroy'
+        for k in NOT_GL + ('type',):
+            spec.pop(k, None)
+        traces.append(go.Scattergl(spec))
+    fig.data = ()
+    fig.add_traces(traces)
+    return fig
+
+def compact(fig):
+    """Plotly JSON (a dict) of ``fig`` without entries the template or plotly.js defaults give."""
+    spec = json.loads(webgl(fig).to_json())
+    single = len(spec['data']) == 1
+    for trace in spec['data']:
+        for k, default in TRACE_DEFAULTS.items():
+            if trace.get(k) == default:
+                del trace[k]
+        if single:
+            trace.pop('alignmentgroup', None)
+        marker = trace.get('marker')
+        if isinstance(marker, dict):
+            for k, default in MARKER_DEFAULTS.items():
+                if marker.get(k) == default:
+                    del marker[k]
+            if not marker:
+                del trace['marker']
+        for k in ('x', 'y', 'values'):
+            trace[k] = typed(trace[k]) if k in trace else None
+            if trace[k] is None:
+                del trace[k]
+    for name, axis in list(spec['layout'].items()):
+        if name[:5] in ('xaxis', 'yaxis') and isinstance(axis, dict):
+            if axis.get('domain') == [0.0, 1.0]:
+                del axis['domain']
+            if axis.get('anchor') in ('x', 'y'):
+                del axis['anchor']
+    return spec
+
+def typed(values):
+    """A list of numbers as a Plotly typed array (int32 or float64); anything else unchanged."""
+    if not isinstance(values, list) or not values:
+        return values
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return values
+    arr = np.asarray(values)
+    if arr.dtype.kind == 'i' and np.abs(arr).max() < 2**31:
+        arr = arr.astype(np.int32)
+    dtype = {'i': 'i4', 'f': 'f8'}.get(arr.dtype.kind)
+    if dtype is None or len(values) < 8:
+        # Short lists are smaller as JSON text
+        return values
+    return {'dtype': dtype, 'bdata': base64.b64encode(arr.astype('<' + dtype).tobytes()).decode('ascii')}
+
+def to_json(fig):
+    """compact() as a JSON string: what a chart costs on the wire."""
+    return json.dumps(compact(fig), separators=(',', ':'))
+
+class Budget:
+    """Bytes of chart JSON sent on one page (one rerun), against a limit."""
+
+    def __init__(self, limit=PAGE_BUDGET):
+        self.limit = limit
+        self.sent = 0
+        self.charts = 0
+
+    def fits(self, size):
+        return self.sent + size <= self.limit
+
+    def add(self, size):
+        self.sent += size
+        self.charts += 1
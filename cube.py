@@ -0,0 +1,472 @@
+"""
+cube.py — Pre-aggregated rollup cube behind the dashboard filters.
+
+The aggregates are loaded once into a dense NumPy array with one axis per
+dimension (año, mes_num, pais, tipo_asignacion, estado for asignaciones).
+Every axis has one extra ALL slot holding the total over that axis, so any
+mix of fixed filter values and "Todos" is a single index lookup, and a chart
+breakdown (by pais, by mes, ...) is a slice of that array. Rerun cost depends
+on the size of the answer, not on how many months of history are loaded.
+
+Distinct expedientes can't be summed, so they are answered by merging the
+sketches (see sketch.py) of the fact rows that match the selection.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import bitmap
+import sketch
+
+ASIG_DIMS = ['año', 'mes_num', 'pais', 'tipo_asignacion', 'estado']
+NODO_DIMS = ['año', 'mes_num', 'nodo', 'pais_asistencia', 'estado']
+
+# App vs Manual families of tipo_asignacion; anything else is 'Otro'
+APP_TYPES = ['APP', 'ANCLAJE APP SOA', 'ANCLAJE APP', 'ANCLAJE']
+MANUAL_TYPES = ['MANUAL', 'ANCLAJE BASE', 'BASE AUTOMATICO']
+CATEGORIAS = {**{t: 'App / Automatizado' for t in APP_TYPES},
+              **{t: 'Manual' for t in MANUAL_TYPES}}
+
+class Cube:
+    """Servicios (and, without sketches, summed expedientes) over ``dims``.
+
+    Selections are dicts of dimension -> value; a missing key or None means
+    "Todos" and a list (or tuple) of values means any of them. ``mes`` can be
+    requested as a breakdown and is built from the año and mes_num axes.
+
+    A selection may instead hold ``rango``, a ('YYYY-MM', 'YYYY-MM') pair of
+    first and last month (año and mes_num then stay None). Ranges are
+    answered from prefix sums along the month axis (año x mes_num, which
+    must be the first two dims): every cell of a range total is the
+    difference of two prefix cells, so any span costs the same as a month.
+    """
+
+    def __init__(self, df, dims, regs=None):
+        self.dims = list(dims)
+        self.regs = regs
+        self.labels = {}
+        self.codes = {}
+        for d in self.dims:
+            self.labels[d], self.codes[d] = encode(df[d])
+        # Month slots of the año x mes_num grid, in order, and each fact row's slot
+        años, meses = self.labels['año'], self.labels['mes_num']
+        self.months = month_labels(pd.Series(np.repeat(años, len(meses))),
+                                   pd.Series(np.tile(meses, len(años)))).to_numpy()
+        month_codes = self.codes['año'] * len(meses) + self.codes['mes_num']
+        self.facts = self._facts(month_codes)
+        self.bitmaps = {d: bitmap.BitmapIndex(self.codes[d], len(self.labels[d])) for d in self.dims}
+        self.month_bitmaps = bitmap.PrefixBitmaps(month_codes, len(self.months))
+        self.measures = ['servicios'] if regs is not None else ['servicios', 'expedientes']
+
+        shape = tuple(len(self.labels[d]) + 1 for d in self.dims)
+        flat = np.ravel_multi_index([self.codes[d] for d in self.dims], shape)
+        self.data = {}
+        self.prefix = {}
+        for m in self.measures:
+            cells = np.bincount(flat, weights=df[m].to_numpy(), minlength=int(np.prod(shape)))
+            self.data[m] = rollup(cells.astype(np.int64).reshape(shape))
+            self.prefix[m] = month_prefix(self.data[m])
+
+    def _facts(self, month_codes):
+        """Per-row dimensions (and mes) for sketch merges: integers or sorted categoricals."""
+        facts = {}
+        for d in self.dims:
+            labels, codes = self.labels[d], self.codes[d]
+            if labels.dtype.kind in 'iu':
+                facts[d] = labels[codes]
+            else:
+                facts[d] = pd.Categorical.from_codes(codes, labels)
+        facts['mes'] = pd.Categorical.from_codes(month_codes, self.months).remove_unused_categories()
+        return pd.DataFrame(facts)
+
+    def _code(self, dim, value):
+        labels = self.labels[dim]
+        i = int(np.searchsorted(labels, value))
+        return i if i < len(labels) and labels[i] == value else -1
+
+    def _codes(self, dim, value):
+        """Sorted label codes of a value or list of values (values not in the data left out)."""
+        codes = [self._code(dim, v) for v in (value if is_multi(value) else [value])]
+        return np.unique(np.array([c for c in codes if c >= 0], dtype=np.intp))
+
+    def _month_range(self, rango):
+        """Half-open [lo, hi) of the month slots from rango[0] to rango[1] ('YYYY-MM')."""
+        desde, hasta = rango
+        return (int(np.searchsorted(self.months, desde, side='left')),
+                int(np.searchsorted(self.months, hasta, side='right')))
+
+    def _select(self, sel, axes, measure):
+        """``measure`` for ``sel`` keeping the ``axes`` dimensions (in dims order), or None."""
+        rango = sel.get('rango')
+        if rango is None:
+            return self._take(self.data[measure], self.dims, sel, axes)
+        if sel.get('año') is not None or sel.get('mes_num') is not None:
+            raise ValueError("rango no se combina con año ni mes_num")
+        if 'año' in axes or 'mes_num' in axes:
+            raise ValueError("con rango solo se desglosa por mes")
+        lo, hi = self._month_range(rango)
+        prefix = self.prefix[measure]
+        before = self._take(prefix[lo], self.dims[2:], sel, axes)
+        if before is None:
+            return None
+        return self._take(prefix[hi], self.dims[2:], sel, axes) - before
+
+    def _take(self, cells, dims, sel, axes):
+        """``cells`` (one axis per ``dims``) for ``sel``, keeping ``axes``, or None.
+
+        "Todos" and single values index the rollup directly (the ALL slot or
+        one code); a list of values takes its codes along that axis and sums
+        them unless the axis is kept.
+        """
+        idx, kept, multi = [], [], []
+        for d in dims:
+            n = len(self.labels[d])
+            value = sel.get(d)
+            if value is None:
+                idx.append(slice(0, n) if d in axes else n)
+            else:
+                codes = self._codes(d, value)
+                if len(codes) == 0:
+                    return None
+                if is_multi(value):
+                    idx.append(slice(0, n))
+                    multi.append((d, codes))
+                else:
+                    idx.append(slice(codes[0], codes[0] + 1) if d in axes else codes[0])
+            if d in axes or is_multi(value):
+                kept.append(d)
+        values = cells[tuple(idx)]
+        # Last axis first, so the positions of the earlier ones don't move
+        for d, codes in reversed(multi):
+            axis = kept.index(d)
+            values = np.take(values, codes, axis=axis)
+            if d not in axes:
+                values = values.sum(axis=axis)
+        return values
+
+    def block(self, sel, by=(), measure='servicios'):
+        """Raw slice of ``measure`` for the selection, keeping the ``by`` axes.
+
+        Returns (values, labels): values has one axis per kept dimension (año
+        and mes_num merged into one 'mes' axis when 'mes' is requested) and
+        labels is a frame with one row per cell in C order. Returns
+        (None, None) if no selected value exists.
+        """
+        by = list(by)
+        if sel.get('rango') is not None and 'mes' in by:
+            # Every month, cut to the range: months are the leading axis
+            values, labels = self.block({**sel, 'rango': None}, by, measure)
+            if values is None:
+                return None, None
+            lo, hi = self._month_range(sel['rango'])
+            per_month = len(labels) // len(self.months)
+            return values[lo:hi], labels.iloc[lo * per_month:hi * per_month].reset_index(drop=True)
+        axes = [d for d in self.dims if d in by or ('mes' in by and d in ('año', 'mes_num'))]
+        values = self._select(sel, axes, measure)
+        if values is None:
+            return None, None
+        ranges = [self.labels[d] if sel.get(d) is None else self.labels[d][self._codes(d, sel[d])]
+                  for d in axes]
+        labels = pd.MultiIndex.from_product(ranges, names=axes).to_frame(index=False)
+        if 'mes' in by:
+            labels['mes'] = month_labels(labels['año'], labels['mes_num'])
+            shape = [len(r) for r in ranges]
+            t = axes.index('año')
+            values = values.reshape(shape[:t] + [shape[t] * shape[t + 1]] + shape[t + 2:])
+            labels = labels.drop(columns=['año', 'mes_num'])
+        return values, labels
+
+    def frame(self, sel, by=(), measure='servicios'):
+        """``measure`` for the selection broken down by ``by`` (empty cells dropped)."""
+        by = list(by)
+        if not by:
+            return pd.DataFrame({measure: [self.total(sel, measure)]})
+        values, labels = self.block(sel, by, measure)
+        if values is None:
+            return pd.DataFrame(columns=by + [measure])
+        labels[measure] = values.reshape(-1)
+        labels = labels[labels[measure] != 0]
+        return labels[by + [measure]].reset_index(drop=True)
+
+    def total(self, sel, measure='servicios'):
+        values = self._select(sel, (), measure)
+        return 0 if values is None else int(values)
+
+    def series(self, sel, by, measure='servicios'):
+        """Like frame() for a single breakdown dimension, as a Series indexed by it."""
+        return self.frame(sel, [by], measure).set_index(by)[measure]
+
+    def rows(self, sel):
+        """Fact rows (with their positional index) matching the selection.
+
+        Resolved on the bitmap indexes: OR over the values of a multi-select,
+        AND across the filtered dimensions and the month range.
+        """
+        filters = []
+        for d in self.dims:
+            if sel.get(d) is not None:
+                filters.append(self.bitmaps[d].any_of(self._codes(d, sel[d])))
+        if sel.get('rango') is not None:
+            filters.append(self.month_bitmaps.between(*self._month_range(sel['rango'])))
+        bits = bitmap.all_of(filters)
+        if bits is None:
+            return self.facts
+        return self.facts.iloc[bitmap.positions(bits, len(self.facts))]
+
+    def distinct(self, sel, by=(), rows=None):
+        """Distinct expedientes for the selection, overall (int) or per ``by`` (frame).
+
+        ``rows`` may pass in an earlier ``self.rows(sel)`` to skip the lookup.
+        """
+        by = list(by)
+        if self.regs is None:
+            if not by:
+                return self.total(sel, 'expedientes')
+            return self.frame(sel, by, 'expedientes')
+        rows = self.rows(sel) if rows is None else rows
+        if not by:
+            return sketch.count_distinct(rows, self.regs)
+        return sketch.count_distinct(rows, self.regs, by=by).reset_index()
+
+@dataclass
+class AsignacionesSummary:
+    """Every KPI and chart aggregate of the Asignaciones tab for one selection."""
+    total_servicios: int
+    concluidos: int
+    cancelados: int
+    expedientes: int
+    por_mes: pd.DataFrame        # mes, servicios, concluidos, cancelados, expedientes
+    por_pais: pd.DataFrame       # pais, servicios, concluidos, cancelados, expedientes
+    por_estado: pd.DataFrame     # estado, servicios
+    por_tipo: pd.DataFrame       # tipo_asignacion, servicios
+    por_categoria: pd.DataFrame  # categoria, servicios
+
+    @property
+    def pct_conclusion(self):
+        return (self.concluidos / self.total_servicios * 100) if self.total_servicios else 0
+
+    @property
+    def paises_activos(self):
+        return len(self.por_pais)
+
+def asignaciones_summary(asig, sel):
+    """Compute every Asignaciones aggregate for ``sel`` in one go.
+
+    Three cube slices (by mes, pais and tipo, each split by estado) hold all
+    the servicios figures; totals, the estado and categoria breakdowns and
+    the concluded/cancelled splits are reductions of those small arrays.
+    Expedientes merge the sketches of one shared row selection.
+    """
+    estados = asig.labels['estado']
+    keep = np.ones(len(estados), dtype=np.int64)
+    if sel.get('estado') is not None:
+        keep = (estados == sel['estado']).astype(np.int64)
+    base = {d: v for d, v in sel.items() if d != 'estado'}
+    col_concl = np.flatnonzero(estados == 'CONCLUIDA')
+    col_cancel = np.flatnonzero(estados == 'CANCELADA')
+
+    def split(by):
+        values, labels = asig.block(base, [by, 'estado'])
+        if values is None:
+            return pd.DataFrame(columns=[by, 'servicios', 'concluidos', 'cancelados']), np.zeros(len(estados))
+        values = values.reshape(-1, len(estados)) * keep
+        out = labels.drop_duplicates(by)[[by]].reset_index(drop=True)
+        out['servicios'] = values.sum(axis=1)
+        out['concluidos'] = values[:, col_concl].sum(axis=1)
+        out['cancelados'] = values[:, col_cancel].sum(axis=1)
+        return out[out['servicios'] != 0].reset_index(drop=True), values.sum(axis=0)
+
+    por_mes, _ = split('mes')
+    por_pais, por_estado = split('pais')
+    por_tipo, _ = split('tipo_asignacion')
+
+    rows = asig.rows(sel)
+    exp_mes = asig.distinct(sel, ['mes'], rows)
+    exp_pais = asig.distinct(sel, ['pais'], rows)
+    por_mes = por_mes.merge(exp_mes, on='mes', how='left').fillna({'expedientes': 0})
+    por_pais = por_pais.merge(exp_pais, on='pais', how='left').fillna({'expedientes': 0})
+
+    estado_df = pd.DataFrame({'estado': estados, 'servicios': por_estado.astype(np.int64)})
+    categoria = por_tipo['tipo_asignacion'].map(CATEGORIAS).fillna('Otro')
+    return AsignacionesSummary(
+        total_servicios=int(por_estado.sum()),
+        concluidos=int(por_estado[col_concl].sum()),
+        cancelados=int(por_estado[col_cancel].sum()),
+        expedientes=asig.distinct(sel, rows=rows),
+        por_mes=por_mes,
+        por_pais=por_pais,
+        por_estado=estado_df[estado_df['servicios'] != 0].reset_index(drop=True),
+        por_tipo=por_tipo[['tipo_asignacion', 'servicios']],
+        por_categoria=por_tipo.groupby(categoria)['servicios'].sum().rename_axis('categoria').reset_index(),
+    )
+
+@dataclass
+class NodosIndex:
+    """The Nodos tab for one selection, grouped by nodo ('Sin Nodo' left out).
+
+    ``nodos`` has one row per nodo, busiest first. ``paises`` holds the
+    countries of every nodo, stored contiguously in that same order (busiest
+    country first), so ``detail(i)`` is a slice rather than a filter.
+    """
+    nodos: pd.DataFrame      # nodo, servicios, concluidos, expedientes, paises, pct_conclusion
+    paises: pd.DataFrame     # nodo, pais_asistencia, servicios, expedientes
+    bounds: np.ndarray       # nodo i owns paises rows bounds[i]:bounds[i + 1]
+    por_estado: pd.DataFrame  # nodo, estado, servicios
+    por_mes: pd.DataFrame    # nodo, mes, servicios
+    sin_nodo: int
+
+    def detail(self, i):
+        return self.paises.iloc[self.bounds[i]:self.bounds[i + 1]]
+
+def nodos_index(nodos, sel):
+    """Build the NodosIndex for ``sel`` (which may fix año, mes_num and estado).
+
+    Servicios per nodo x pais x estado come from one cube slice; per-nodo
+    totals, concluded counts and country counts are reductions of it.
+    Expedientes come from one merge of the selected rows' sketches per
+    nodo x pais, see _nodo_distincts().
+    """
+    names = nodos.labels['nodo']
+    estados = nodos.labels['estado']
+    keep = np.ones(len(estados), dtype=np.int64)
+    if sel.get('estado') is not None:
+        keep = (estados == sel['estado']).astype(np.int64)
+    base = {d: v for d, v in sel.items() if d != 'estado'}
+    values, _ = nodos.block(base, ['nodo', 'pais_asistencia', 'estado'])
+    if values is None:
+        values = np.zeros((len(names), len(nodos.labels['pais_asistencia']), len(estados)), dtype=np.int64)
+    values = values * keep
+    cells = values.sum(axis=2)              # nodo x pais
+    nodo_estado = values.sum(axis=1)        # nodo x estado
+    servicios = cells.sum(axis=1)
+    sin_nodo = names == 'Sin Nodo'
+
+    rows = nodos.rows(sel)
+    if nodos.regs is not None:
+        exp_nodo, exp_cells = _nodo_distincts(nodos, rows, cells.shape)
+    else:
+        exp_nodo = _distinct_array(nodos, sel, ['nodo'], rows, cells.shape[:1])
+        exp_cells = _distinct_array(nodos, sel, ['nodo', 'pais_asistencia'], rows, cells.shape)
+
+    order = np.argsort(-servicios, kind='stable')
+    order = order[(servicios[order] != 0) & ~sin_nodo[order]]
+    sub = cells[order]
+    pais_order = np.argsort(-sub, axis=1, kind='stable')
+    sorted_serv = np.take_along_axis(sub, pais_order, axis=1)
+    present = sorted_serv != 0
+    counts = present.sum(axis=1)
+    nodo_idx = np.repeat(order, counts)
+    pais_idx = pais_order[present]
+
+    concluidos = nodo_estado[order][:, estados == 'CONCLUIDA'].sum(axis=1)
+    summary = pd.DataFrame({
+        'nodo': names[order],
+        'servicios': servicios[order],
+        'concluidos': concluidos,
+        'expedientes': exp_nodo[order],
+        'paises': counts,
+        'pct_conclusion': (concluidos / servicios[order] * 100).round(1),
+    })
+    paises = pd.DataFrame({
+        'nodo': names[nodo_idx],
+        'pais_asistencia': nodos.labels['pais_asistencia'][pais_idx],
+        'servicios': sorted_serv[present],
+        'expedientes': exp_cells[nodo_idx, pais_idx],
+    })
+
+    n, e = np.nonzero(nodo_estado * ~sin_nodo[:, None])
+    por_estado = pd.DataFrame({'nodo': names[n], 'estado': estados[e], 'servicios': nodo_estado[n, e]})
+    por_mes = nodos.frame(sel, ['nodo', 'mes'])
+    por_mes = por_mes[por_mes['nodo'] != 'Sin Nodo'].reset_index(drop=True)
+    return NodosIndex(
+        nodos=summary,
+        paises=paises,
+        bounds=np.concatenate([[0], np.cumsum(counts)]),
+        por_estado=por_estado,
+        por_mes=por_mes,
+        sin_nodo=int(servicios[sin_nodo].sum()),
+    )
+
+def _nodo_distincts(nodos, rows, shape):
+    """(per nodo, per nodo x pais) distinct expedientes of ``rows``, from a single merge.
+
+    The nodo x pais registers are merged a block of nodos at a time and
+    each nodo's registers are the max over its countries, so the fact rows
+    are expanded once for both counts.
+    """
+    ix = rows.index.to_numpy()
+    codes = nodos.codes['nodo'][ix].astype(np.intp) * shape[1] + nodos.codes['pais_asistencia'][ix]
+    order = np.argsort(codes, kind='stable')
+    ix, codes = ix[order], codes[order]
+    exp_nodo = np.zeros(shape[0], dtype=np.int64)
+    exp_cells = np.zeros(shape, dtype=np.int64)
+    step = max(1, sketch.BLOCK // shape[1])
+    for lo in range(0, shape[0], step):
+        hi = min(lo + step, shape[0])
+        a, b = np.searchsorted(codes, [lo * shape[1], hi * shape[1]])
+        if a == b:
+            continue
+        regs = nodos.regs.merge(ix[a:b], codes[a:b] - lo * shape[1], (hi - lo) * shape[1])
+        # Only the cells and nodos with rows need an estimate (the rest are 0)
+        used = np.unique(codes[a:b]) - lo * shape[1]
+        exp_cells[lo:hi].reshape(-1)[used] = sketch.estimate(regs[used])
+        nodo_regs = regs.reshape(hi - lo, shape[1], -1).max(axis=1)
+        present = np.unique(used // shape[1])
+        exp_nodo[lo + present] = sketch.estimate(nodo_regs[present])
+    return exp_nodo, exp_cells
+
+def _distinct_array(c, sel, by, rows, shape):
+    """Cube.distinct() per ``by`` as a dense array over the label codes of ``by``."""
+    out = np.zeros(shape, dtype=np.int64)
+    frame = c.distinct(sel, by, rows)
+    if len(frame):
+        idx = tuple(np.searchsorted(c.labels[d], frame[d].to_numpy()) for d in by)
+        out[idx] = frame['expedientes'].to_numpy()
+    return out
+
+def is_multi(value):
+    """Whether a selection value is a list of values (a multi-select)."""
+    return isinstance(value, (list, tuple, set, frozenset, np.ndarray))
+
+def encode(col):
+    """(sorted labels, int32 code per row) of a dimension column.
+
+    Categorical columns are encoded from their category codes, so only the
+    categories themselves are compared, not every row.
+    """
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        col = col.cat.remove_unused_categories()
+        categories = np.asarray(col.cat.categories, dtype=object)
+        order = np.argsort(categories, kind='stable')
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order))
+        return categories[order], rank[col.cat.codes.to_numpy()]
+    labels = np.sort(col.unique())
+    return labels, np.searchsorted(labels, col.to_numpy()).astype(np.int32)
+
+def month_prefix(cells):
+    """Prefix sums of a rollup over its month slots (the año x mes_num grid).
+
+    prefix[k] holds the total of the first k months in every cell of the
+    other axes (ALL slots included), so months [lo, hi) of any cell are
+    prefix[hi] - prefix[lo].
+    """
+    months = cells[:-1, :-1].reshape((-1,) + cells.shape[2:])
+    prefix = np.zeros((len(months) + 1,) + cells.shape[2:], dtype=np.int64)
+    np.cumsum(months, axis=0, out=prefix[1:])
+    return prefix
+
+def rollup(cells):
+    """Fill the trailing ALL slot of every axis with the total over that axis."""
+    for axis in range(cells.ndim):
+        n = cells.shape[axis] - 1
+        dst = [slice(None)] * cells.ndim
+        src = [slice(None)] * cells.ndim
+        dst[axis], src[axis] = n, slice(0, n)
+        cells[tuple(dst)] = cells[tuple(src)].sum(axis=axis)
+    return cells
+
+def month_labels(años, meses):
+    """'YYYY-MM' labels from año and mes_num columns."""
+    return años.astype(int).astype(str) + '-' + meses.astype(int).astype(str).str.zfill(2)
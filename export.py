@@ -0,0 +1,143 @@
+"""
+export.py — Downloadable files of the dashboard views (CSV, Excel, Parquet).
+
+An export is written from an iterator of DataFrame chunks, one chunk at a
+time, so a large view never has the whole table or the whole encoded file
+in memory. Finished files are cached on disk under a name hashed from (data
+version, view, selection, format): asking for the same view of the same data
+again is a file lookup, and a new data version never serves an old file.
+The MAX_FILES most recently used files are kept.
+
+Files are written under a temp name and renamed into place, and one lock per
+file keeps two sessions from generating the same export at the same time.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import store
+
+EXPORT_DIR = store.DATA_DIR / '.cache' / 'exports'
+CHUNK_ROWS = 100_000
+MAX_FILES = 64
+BLOCK_BYTES = 1 << 20
+
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Data rows per Excel sheet (the format's limit, less the header row)
+EXCEL_MAX_ROWS = 1_048_575
+# Largest view offered as a dashboard download: Streamlit holds a download's
+# whole file in memory, larger views are exported with query.py instead
+INLINE_MAX_ROWS = 500_000
+
+def frame_chunks(df, chunk_rows=CHUNK_ROWS):
+    """``df`` as consecutive row slices; a single (possibly empty) chunk when small."""
+    for lo in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[lo:lo + chunk_rows]
+
+# ─── Writers ──────────────────────────────────────────────────────────────────
+def write_csv(chunks, path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, index=False, header=i == 0, lineterminator='\n')
+
+def write_xlsx(chunks, path, sheet='datos'):
+    """Excel workbook in openpyxl's write-only mode (rows are streamed to disk)."""
+    # Only Excel exports need openpyxl
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws, rows, header = None, 0, None
+    for chunk in chunks:
+        if header is None:
+            header = [str(c) for c in chunk.columns]
+        values = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+        for row in values:
+            if ws is None or rows == EXCEL_MAX_ROWS:
+                ws = wb.create_sheet(sheet if ws is None else f'{sheet}_{len(wb.worksheets) + 1}')
+                ws.append(header)
+                rows = 0
+            ws.append(row)
+            rows += 1
+    if ws is None:
+        wb.create_sheet(sheet).append(header or [])
+    wb.save(path)
+
+def write_parquet(chunks, path):
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression='zstd')
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx, 'parquet': write_parquet}
+
+# ─── Cache ────────────────────────────────────────────────────────────────────
+class ExportCache:
+    """Export files on disk, keyed on (data version, view, selection, format)."""
+
+    def __init__(self, export_dir=EXPORT_DIR, max_files=MAX_FILES):
+        self.export_dir = Path(export_dir)
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def path(self, key, fmt):
+        digest = hashlib.sha256(json.dumps(key, default=str).encode('utf-8')).hexdigest()[:24]
+        return self.export_dir / f'{digest}.{fmt}'
+
+    def get(self, key, fmt, chunks):
+        """Path of the ``fmt`` file for ``key``; ``chunks()`` is only called to write a missing one."""
+        if fmt not in WRITERS:
+            raise ValueError(f"formato desconocido: {fmt}")
+        path = self.path(key, fmt)
+        with self.lock:
+            lock = self.locks.setdefault(path, threading.Lock())
+        with lock:
+            if path.exists():
+                os.utime(path)
+                return path
+            self.export_dir.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f'.{path.name}.{threading.get_ident()}.tmp')
+            try:
+                WRITERS[fmt](chunks(), tmp)
+                os.replace(tmp, path)
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+        self.prune(keep=path)
+        return path
+
+    def prune(self, keep=None):
+        """Delete the least recently used files beyond ``max_files``."""
+        files = []
+        for p in self.export_dir.glob('*.*'):
+            if p.name.startswith('.'):
+                continue
+            try:
+                files.append((p.stat().st_mtime, p))
+            except FileNotFoundError:
+                continue
+        files.sort(reverse=True)
+        for _, p in files[self.max_files:]:
+            if p != keep:
+                p.unlink(missing_ok=True)
+
+def read_blocks(path, block_bytes=BLOCK_BYTES):
+    """Contents of ``path`` as a stream of byte blocks (for HTTP responses)."""
+    with open(path, 'rb') as f:
+        while block := f.read(block_bytes):
+            yield block
@@ -1,71 +1,190 @@
 """
 generate_data.py — Regenerate dashboard CSVs from raw Client files.
-Produces:
-  1. asignaciones_v2.csv: pais,mes,tipo_asignacion,estado,servicios,expedientes
-  2. nodos_detalle.csv: nodo,pais_asistencia,mes,estado,servicios,expedientes
+Produces (CSV exports plus the Parquet store read by the app, see store.py):
+  1. asignaciones_v2.csv: pais,mes,tipo_asignacion,estado,servicios,expedientes,expedientes_hll
+  2. nodos_detalle.csv: nodo,pais_asistencia,mes,estado,servicios,expedientes,expedientes_hll
+  3. store/asignaciones/ and store/nodos/: the same rows, partitioned by año
+  4. store/detalle/: one row per asistencia (expediente, asistencia, país, mes,
+     tipo, estado, nodo), partitioned by país and mes, for drill-downs
+
+expedientes is the exact distinct count per row; expedientes_hll is a mergeable
+HyperLogLog sketch of the same IDs (see sketch.py) for counts across rows.
+
+Usage:
+  python generate_data.py [--workers N] [--chunk-mb MB] [--input-dir DIR] [--data-dir DIR] [--full]
+                          [--no-detail] [--memory-mb MB [--spill-dir DIR]]
+  python generate_data.py --serial      # original row-by-row reader
+  python generate_data.py --from-csv    # rebuild data/store from the CSVs only
+  python generate_data.py --trace FILE  # also time each phase, write a Chrome trace
+
+Client files are found in the input dir by name (ClientNN_<Pais>_YYYYMMDD,
+newest date per client) and may be gzip, zstd or zip compressed; compressed
+files are decoded as a stream, never written out decompressed.
+
+By default each Client file is memory-mapped (or streamed through the
+decompressor) and read in fixed-size blocks by its own worker process,
+decoding only the columns used; the output is byte-identical to the --serial
+path. Partial results are cached under data/.cache and only new or changed files are re-read on the next
+run (--full forces a complete rebuild); each file's rows of the outputs are
+cached too, so only those files are rolled up again and only their países'
+store files rewritten (an unchanged run writes nothing). Each worker also writes its file's
+país partition of the detail store; the serial path and --no-detail skip
+it and remove the detail store, so it never disagrees with the aggregates.
+
+The merged pair table (one row per group and expediente) grows with the
+distinct expedientes of every país. --memory-mb caps it instead: partials
+are folded in one at a time and, past the budget, spilled to sorted runs on
+disk that are merged at the end (see spill.py), with the same exact counts.
 """
+import argparse
 import csv
+import hashlib
+import io
+import json
+import multiprocessing
 import os
+import re
+import shutil
+import time
+import zipfile
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import sketch
+import spill
+import store
+import timing
+from nodomap import NodoMap
 
 PAISES_DIR = r'C:\Users\Ricardo\OneDrive - Global Solutions Center SAS\Escritorio\Paises'
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 
-# All Client files
-CLIENT_FILES = [
-    ('Client01_Puerto_Rico_20251027.csv', 'Puerto Rico'),
-    ('Client03_Dominicana_20251027.csv', 'Dominicana'),
-    ('Client04_Salvador_20251027.csv', 'El Salvador'),
-    ('Client05_Mexico_20251027.csv', 'Mexico'),
-    ('Client06_Argentina_20251027.csv', 'Argentina'),
-    ('Client07_Egipto_20251027.csv', 'Egipto'),
-    ('Client08_Costa_Rica_20251027.csv', 'Costa Rica'),
-    ('Client10_Ecuador_20251027.csv', 'Ecuador'),
-    ('Client11_Chile_20251027.csv', 'Chile'),
-    ('Client12_Uruguay_20251027.csv', 'Uruguay'),
-    ('Client13_Bolivia_20251027.csv', 'Bolivia'),
-    ('Client15_Guatemala_20251027.csv', 'Guatemala'),
-    ('Client17_Peru_20251027.csv', 'Peru'),
-    ('Client18_Paraguay_20251027.csv', 'Paraguay'),
-    ('Client19_Colombia_20251027.csv', 'Colombia'),
-    ('Client20_Honduras_20251027.csv', 'Honduras'),
-    ('Client22_Nicaragua_20251027.csv', 'Nicaragua'),
-    ('Client24_Estados_Unidos_20251027.csv', 'Estados Unidos'),
-]
-
-def load_nodo_map():
-    """Load expediente -> nodo mapping from soa_nodos.csv."""
-    nodo_map = {}
-    soa_path = os.path.join(DATA_DIR, 'soa_nodos.csv')
-    if os.path.exists(soa_path):
-        with open(soa_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                exp_id = row.get('Id_Expediente', '').strip()
-                nodo = row.get('Nodo', '').strip()
-                if exp_id and nodo:
-                    nodo_map[exp_id] = nodo
+# País of each client number. Exports are named ClientNN_<Pais>_YYYYMMDD.csv
+# and may be compressed: .csv.gz, .csv.zst, or a .zip holding the .csv
+CLIENT_PAISES = {
+    '01': 'Puerto Rico',
+    '03': 'Dominicana',
+    '04': 'El Salvador',
+    '05': 'Mexico',
+    '06': 'Argentina',
+    '07': 'Egipto',
+    '08': 'Costa Rica',
+    '10': 'Ecuador',
+    '11': 'Chile',
+    '12': 'Uruguay',
+    '13': 'Bolivia',
+    '15': 'Guatemala',
+    '17': 'Peru',
+    '18': 'Paraguay',
+    '19': 'Colombia',
+    '20': 'Honduras',
+    '22': 'Nicaragua',
+    '24': 'Estados Unidos',
+}
+CLIENT_PATTERN = re.compile(r'Client(\d+)_(\w+?)_(\d{8})\.(csv|csv\.gz|csv\.zst|zip)', re.IGNORECASE)
+# Preferred format when one export exists in several (first wins)
+CLIENT_FORMATS = ('csv', 'csv.gz', 'csv.zst', 'zip')
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# Raw columns used by the aggregation (the rest of each Client row is ignored)
+USED_COLUMNS = ['id_expediente', 'estado_asistencia', 'tipo_asignacion', 'creacion_asistencia']
+# Also read for the detail store
+DETAIL_COLUMNS = USED_COLUMNS + ['id_asistencia']
+ESTADOS = ('CONCLUIDA', 'CANCELADA', 'PROCESO')
+PAIR_KEYS = ['pais', 'mes', 'tipo_asignacion', 'estado', 'id_expediente']
+ASIG_KEYS = ['pais', 'mes', 'tipo_asignacion', 'estado']
+NODO_KEYS = ['nodo', 'pais_asistencia', 'mes', 'estado']
+
+# Bytes per streamed block when reading a Client file in chunks
+CHUNK_BYTES = 16 << 20
+
+def load_nodo_map(data_dir=DATA_DIR, cache_dir=None, incremental=True):
+    """Load the expediente -> nodo mapping (a nodomap.NodoMap) from soa_nodos.csv.
+
+    The parsed map is cached as memory-mapped arrays under cache_dir/nodo_map
+    and reused while soa_nodos.csv is unchanged.
+    """
+    soa_path = os.path.join(data_dir, 'soa_nodos.csv')
+    if not os.path.exists(soa_path):
+        print("  Loaded 0 expediente->nodo mappings")
+        return NodoMap.empty()
+    map_dir = os.path.join(cache_dir or os.path.join(data_dir, '.cache'), 'nodo_map')
+    cached, source = NodoMap.load(map_dir) if incremental else (None, None)
+    current = file_fingerprint(soa_path, source)
+    if cached is not None and source['sha256'] == current['sha256']:
+        print(f"  Loaded {len(cached):,} expediente->nodo mappings (cached)")
+        return cached
+    nodo_map = NodoMap.from_csv(soa_path)
+    nodo_map.save(map_dir, current)
     print(f"  Loaded {len(nodo_map):,} expediente->nodo mappings")
     return nodo_map
 
-def process_client_files(nodo_map):
+def client_files(paises_dir=PAISES_DIR):
+    """(filename, pais) of the newest export of every client in ``paises_dir``, by client number.
+
+    Files are matched by CLIENT_PATTERN; clients missing from CLIENT_PAISES
+    take their país from the file name.
+    """
+    try:
+        names = os.listdir(paises_dir)
+    except FileNotFoundError:
+        names = []
+    newest = {}
+    for name in names:
+        m = CLIENT_PATTERN.fullmatch(name)
+        if not m:
+            continue
+        num, slug, fecha, fmt = m.groups()
+        rank = (fecha, -CLIENT_FORMATS.index(fmt.lower()))
+        if num not in newest or rank > newest[num][0]:
+            newest[num] = (rank, name, CLIENT_PAISES.get(num, slug.replace('_', ' ')))
+    for num, pais in CLIENT_PAISES.items():
+        if num not in newest:
+            print(f"  SKIP (not found): Client{num} ({pais})")
+    return [(name, pais) for _, (_, name, pais) in sorted(newest.items(), key=lambda kv: int(kv[0]))]
+
+def open_client_file(filepath):
+    """Binary stream of the CSV bytes of a Client export, decompressed as it is read.
+
+    Plain files are memory-mapped; .gz and .zst are decoded incrementally by
+    pyarrow and a .zip streams its (first) .csv member, so a compressed export
+    is never written out decompressed.
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.zip':
+        with zipfile.ZipFile(filepath) as zf:
+            members = [n for n in zf.namelist() if n.lower().endswith('.csv')]
+            if not members:
+                raise ValueError(f"{filepath}: no .csv inside the zip")
+            # The member keeps the archive open after the with block
+            return pa.PythonFile(zf.open(members[0]), mode='r')
+    if ext in COMPRESSIONS:
+        return pa.CompressedInputStream(pa.OSFile(filepath), COMPRESSIONS[ext])
+    return pa.memory_map(filepath)
+
+def open_client_text(filepath):
+    """open_client_file() as latin-1 text, for csv.reader."""
+    return io.TextIOWrapper(open_client_file(filepath), encoding='latin-1')
+
+def process_client_files(nodo_map, paises_dir=PAISES_DIR):
     """Process all Client CSVs and aggregate data."""
     # Key: (pais, mes, tipo_asignacion, estado) -> {servicios: count, expedientes: set}
     asig_data = defaultdict(lambda: {'servicios': 0, 'expedientes': set()})
     # Key: (nodo, pais, mes, estado) -> {servicios: count, expedientes: set}
     nodo_data = defaultdict(lambda: {'servicios': 0, 'expedientes': set()})
     
-    for filename, pais in CLIENT_FILES:
-        filepath = os.path.join(PAISES_DIR, filename)
-        if not os.path.exists(filepath):
-            print(f"  SKIP (not found): {filename}")
-            continue
-        
+    for filename, pais in client_files(paises_dir):
+        filepath = os.path.join(paises_dir, filename)
         print(f"  Processing {pais} ({filename})...")
         row_count = 0
         
-        with open(filepath, 'r', encoding='latin-1') as f:
+        with open_client_text(filepath) as f:
             reader = csv.reader(f, delimiter=';')
             headers = next(reader)
             
@@ -111,23 +230,492 @@ def process_client_files(nodo_map):
     
     return asig_data, nodo_data
 
-def write_asignaciones(asig_data):
+# ─── Chunked / parallel ingestion ─────────────────────────────────────────────
+def read_header(filepath):
+    """Return the column index of each DETAIL_COLUMNS entry (last occurrence wins, like the serial path)."""
+    with open_client_text(filepath) as f:
+        headers = next(csv.reader(f, delimiter=';'))
+    cols = {h: i for i, h in enumerate(headers)}
+    return headers, {c: cols[c] for c in DETAIL_COLUMNS}
+
+def decode_latin1(arr):
+    """latin-1 bytes column -> string column; only non-ASCII values are decoded in Python."""
+    text = pc.cast(arr, options=pc.CastOptions(pa.string(), allow_invalid_utf8=True))
+    ascii_only = pc.string_is_ascii(text)
+    if pc.all(ascii_only).as_py() is not False:
+        return text
+    other = pc.invert(ascii_only)
+    values = arr.filter(other).dictionary_encode()
+    decoded = pa.array([v.decode('latin-1') for v in values.dictionary.to_pylist()], pa.string())
+    return pc.replace_with_mask(text, other, decoded.take(values.indices))
+
+def iter_chunks(filepath, chunk_bytes=CHUNK_BYTES, tolerant=False, columns=USED_COLUMNS):
+    """Yield DataFrames holding the raw ``columns`` strings of a Client file.
+
+    The file is memory-mapped (or decompressed as a stream, see
+    open_client_file) and pyarrow splits the raw bytes into fields
+    (quotes and ';' included) without transcoding them; only the ``columns``
+    values are decoded from latin-1. A row whose field count differs from the
+    header raises pyarrow.ArrowInvalid.
+
+    With ``tolerant`` the whole file is transcoded instead and such rows are
+    re-parsed with csv.reader so that long rows are kept and rows too short to
+    hold every USED_COLUMNS entry are dropped, exactly as the row-by-row loop
+    does (id_asistencia is left blank when only it is missing).
+    (pyarrow hands invalid rows back as UTF-8 text, which only works once the
+    file is transcoded.)
+    """
+    headers, idx = read_header(filepath)
+    names = [f'c{i}' for i in range(len(headers))]
+    used = [names[idx[c]] for c in columns]
+    need = max(idx[c] for c in USED_COLUMNS) + 1
+    odd_rows = []
+
+    def on_invalid(row):
+        odd_rows.append(row.text)
+        return 'skip'
+
+    with open_client_file(filepath) as source:
+        reader = pacsv.open_csv(
+            source,
+            read_options=pacsv.ReadOptions(skip_rows=1, column_names=names, block_size=chunk_bytes,
+                                           encoding='latin1' if tolerant else 'utf8'),
+            parse_options=pacsv.ParseOptions(delimiter=';', newlines_in_values=True,
+                                             invalid_row_handler=on_invalid if tolerant else None),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=used,
+                column_types={n: pa.string() if tolerant else pa.binary() for n in used},
+                strings_can_be_null=False, quoted_strings_can_be_null=False),
+        )
+        for batch in reader:
+            if tolerant:
+                chunk = batch.to_pandas()
+            else:
+                chunk = pa.table([decode_latin1(batch.column(n)) for n in used], names=used).to_pandas()
+            chunk.columns = columns
+            if odd_rows:
+                rows = [r for r in csv.reader(io.StringIO('\n'.join(odd_rows)), delimiter=';') if len(r) >= need]
+                odd_rows.clear()
+                if rows:
+                    extra = pd.DataFrame([[r[idx[c]] if idx[c] < len(r) else '' for c in columns] for r in rows],
+                                         columns=columns)
+                    chunk = pd.concat([chunk, extra], ignore_index=True)
+            yield chunk
+
+def normalize_chunk(chunk, pais):
+    """Vectorized version of the per-row parsing done in process_client_files."""
+    fecha = chunk['creacion_asistencia']
+    chunk = chunk[fecha.str.len() >= 7]
+    estado = chunk['estado_asistencia'].str.strip().str.upper()
+    tipo = chunk['tipo_asignacion'].str.strip().str.upper()
+    norm = pd.DataFrame({
+        'pais': pais,
+        'mes': chunk['creacion_asistencia'].str[:7],
+        'tipo_asignacion': tipo.where(tipo != '', 'SIN_TIPO'),
+        'estado': estado.where(estado.isin(ESTADOS), 'OTRO'),
+        'id_expediente': chunk['id_expediente'].str.strip(),
+    })
+    if 'id_asistencia' in chunk:
+        norm['id_asistencia'] = chunk['id_asistencia'].str.strip()
+    return norm
+
+def combine_pairs(frames):
+    """Merge partial (pais, mes, tipo, estado, expediente) -> servicios tables."""
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return pd.DataFrame(columns=PAIR_KEYS + ['servicios'])
+    pairs = pd.concat(frames, ignore_index=True)
+    return pairs.groupby(PAIR_KEYS, as_index=False, sort=False)['servicios'].sum()
+
+def process_client_file(filepath, pais, chunk_bytes=CHUNK_BYTES, store_dir=None, nodo_dir=None):
+    """Aggregate one Client file chunk by chunk into its partial pair table.
+
+    With ``store_dir`` the file's rows also replace its país partition of the
+    detail store, with nodos from the NodoMap cached in ``nodo_dir`` (none
+    mapped without one).
+    """
+    columns = DETAIL_COLUMNS if store_dir else USED_COLUMNS
+    detail = [] if store_dir else None
+    try:
+        result = aggregate_chunks(iter_chunks(filepath, chunk_bytes, columns=columns), pais, detail)
+    except pa.ArrowInvalid:
+        # Rows with a different field count: start over with the tolerant reader
+        detail = [] if store_dir else None
+        result = aggregate_chunks(iter_chunks(filepath, chunk_bytes, tolerant=True, columns=columns),
+                                  pais, detail)
+    if store_dir:
+        nodo_map = NodoMap.load(nodo_dir)[0] if nodo_dir else None
+        write_detail(detail, pais, nodo_map or NodoMap.empty(), store_dir)
+    return result
+
+def aggregate_chunks(chunks, pais, detail=None):
+    """(pair table, row count) of the raw chunks of one Client file.
+
+    The normalized rows of each chunk are appended to ``detail`` if given.
+    """
+    parts = []
+    row_count = 0
+    for chunk in chunks:
+        norm = normalize_chunk(chunk, pais)
+        row_count += len(norm)
+        if detail is not None:
+            detail.append(norm.drop(columns='pais'))
+        parts.append(norm.groupby(PAIR_KEYS, as_index=False, sort=False).size()
+                         .rename(columns={'size': 'servicios'}))
+        if len(parts) >= 8:
+            parts = [combine_pairs(parts)]
+    return combine_pairs(parts), row_count
+
+def write_detail(frames, pais, nodo_map, store_dir):
+    """Write the normalized rows of one país, with their nodo, as its detail store partition."""
+    cols = [c for c in store.DETAIL_COLUMNS if c not in ('pais', 'nodo')]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=cols)
+    df['nodo'] = nodo_map.categorical(df['id_expediente'].to_numpy())
+    store.write_detail(df, pais, store_dir)
+
+def remap_detail(pais, nodo_map, store_dir):
+    """Recompute the nodo column of a país partition after soa_nodos.csv changed."""
+    df = store.read_detail(pais, store_dir)
+    df['nodo'] = nodo_map.categorical(df['id_expediente'].to_numpy())
+    store.write_detail(df, pais, store_dir)
+
+def drop_detail(store_dir):
+    """Remove the detail store (a run that doesn't rebuild it would leave it stale)."""
+    shutil.rmtree(os.path.join(store_dir, store.DETAIL), ignore_errors=True)
+
+# ─── Incremental cache ────────────────────────────────────────────────────────
+# manifest.json records size, mtime and sha256 of every processed Client file;
+# partials/<file>.parquet holds that file's pair table. The nodo mapping is
+# applied after merging, so a new soa_nodos.csv does not invalidate the cache.
+# An entry's 'detalle' records the nodo map (soa_nodos.csv sha256) its detail
+# store partition was written with; a changed map only remaps that partition.
+#
+# rollups/<file>.<name>.parquet holds that file's rows of the asignaciones and
+# nodos frames (every row has its país in the keys, so files never share a
+# row); the nodos one records the nodo map it was rolled up with. They are
+# removed whenever the file is read again. outputs.json records the stamp
+# (store.version()) of the CSVs and store as last written, so a run that
+# finds them untouched only rewrites the store files of the países that
+# changed, or nothing at all.
+CACHE_DIR = os.path.join(DATA_DIR, '.cache')
+CACHE_VERSION = 1
+ROLLUPS = ('asignaciones', 'nodos')
+
+def partial_path(filename, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, 'partials', filename.split('.')[0] + '.parquet')
+
+def rollup_path(filename, name, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, 'rollups', f"{filename.split('.')[0]}.{name}.parquet")
+
+def file_fingerprint(filepath, previous=None):
+    """Size, mtime and content hash of a file.
+
+    If size and mtime match ``previous`` the stored hash is trusted instead of
+    re-reading the file.
+    """
+    st = os.stat(filepath)
+    fp = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if previous and previous.get('size') == fp['size'] and previous.get('mtime_ns') == fp['mtime_ns']:
+        fp['sha256'] = previous['sha256']
+        return fp
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    fp['sha256'] = h.hexdigest()
+    return fp
+
+def load_manifest(cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != CACHE_VERSION:
+        return {}
+    return manifest['files']
+
+def save_manifest(files, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'files': files}, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def save_partial(filename, pairs, cache_dir=CACHE_DIR):
+    path = partial_path(filename, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pairs.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+def load_rollup(filename, name, nodo_stamp=None, cache_dir=CACHE_DIR):
+    """The cached ``name`` rollup of a file, or None (missing, or nodos of another nodo map)."""
+    path = rollup_path(filename, name, cache_dir)
+    try:
+        meta = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if name == 'nodos' and meta.get(b'nodo_map', b'').decode() != (nodo_stamp or ''):
+        return None
+    return pd.read_parquet(path)
+
+def save_rollup(filename, name, df, nodo_stamp=None, cache_dir=CACHE_DIR):
+    path = rollup_path(filename, name, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, nodo_map=nodo_stamp or ''))
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def drop_rollups(filename, cache_dir=CACHE_DIR):
+    for name in ROLLUPS:
+        try:
+            os.remove(rollup_path(filename, name, cache_dir))
+        except FileNotFoundError:
+            pass
+
+def outputs_stamp(data_dir, store_dir):
+    """store.version() of the outputs, as saved in outputs.json."""
+    return [list(entry) for entry in store.version(data_dir, store_dir)]
+
+def load_outputs(cache_dir=CACHE_DIR):
+    """(stamp, países) of the outputs as last written, see save_outputs()."""
+    try:
+        with open(os.path.join(cache_dir, 'outputs.json'), 'r', encoding='utf-8') as f:
+            outputs = json.load(f)
+    except (OSError, ValueError):
+        return None, []
+    if outputs.get('version') != CACHE_VERSION:
+        return None, []
+    return outputs['stamp'], outputs['paises']
+
+def save_outputs(stamp, paises, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, 'outputs.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'stamp': stamp, 'paises': sorted(paises)}, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def clear_outputs(cache_dir=CACHE_DIR):
+    """Forget the saved output stamp (the next run rewrites every output)."""
+    try:
+        os.remove(os.path.join(cache_dir, 'outputs.json'))
+    except FileNotFoundError:
+        pass
+
+def process_client_file_timed(filepath, pais, chunk_bytes=CHUNK_BYTES, store_dir=None, nodo_dir=None):
+    """process_client_file() plus (start, end, pid) of the work, for --trace."""
+    start = time.time()
+    pairs, row_count = process_client_file(filepath, pais, chunk_bytes, store_dir, nodo_dir)
+    return pairs, row_count, (start, time.time(), os.getpid())
+
+def run_jobs(jobs, workers, chunk_bytes=CHUNK_BYTES, store_dir=None, nodo_dir=None):
+    """Yield (filename, pais, pairs, row_count, span) for each job, one worker process per file."""
+    if workers <= 1 or len(jobs) <= 1:
+        for fp, pais, filename in jobs:
+            yield (filename, pais) + process_client_file_timed(fp, pais, chunk_bytes, store_dir, nodo_dir)
+        return
+
+    # spawn (the Windows default) rather than fork: pyarrow's thread pools don't survive a fork
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=ctx) as pool:
+        futures = {pool.submit(process_client_file_timed, fp, pais, chunk_bytes, store_dir, nodo_dir): (pais, fn)
+                   for fp, pais, fn in jobs}
+        for fut in as_completed(futures):
+            pais, filename = futures[fut]
+            yield (filename, pais) + fut.result()
+
+def process_client_files_parallel(workers, paises_dir=PAISES_DIR, chunk_bytes=CHUNK_BYTES,
+                                  incremental=True, cache_dir=CACHE_DIR, rec=None,
+                                  store_dir=None, nodo_dir=None):
+    """Process every Client file in its own worker process and merge the partials.
+
+    See iter_partials() for the arguments.
+    """
+    rec = rec or timing.Recorder()
+    partials = [pairs for _, _, pairs in iter_partials(workers, paises_dir, chunk_bytes, incremental,
+                                                         cache_dir, rec, store_dir, nodo_dir)]
+    with rec.span('combine partials'):
+        return combine_pairs(partials)
+
+def iter_partials(workers, paises_dir=PAISES_DIR, chunk_bytes=CHUNK_BYTES,
+                  incremental=True, cache_dir=CACHE_DIR, rec=None,
+                  store_dir=None, nodo_dir=None, lazy=False):
+    """Yield (filename, pais, pair table) of every Client file, each read by its own worker process.
+
+    The partial of each file is cached on disk; with ``incremental`` only
+    files that are new or changed since the last run (see the manifest) are
+    read again, and their cached rollups dropped. With ``lazy`` the pair
+    table of an unchanged file is None instead of being loaded (see
+    partial_path()). ``rec`` (a timing.Recorder) gets one span per file. The
+    manifest is saved once every partial has been yielded.
+
+    With ``store_dir`` the detail store is kept in step too: workers write
+    the partitions of the files they read, cached files whose partition used
+    another nodo map (``nodo_dir``, see load_nodo_map) are remapped, and
+    partitions of files no longer present are removed.
+    """
+    rec = rec or timing.Recorder()
+    manifest = load_manifest(cache_dir) if incremental else {}
+    nodo_map, nodo_source = NodoMap.load(nodo_dir) if nodo_dir else (None, None)
+    nodo_stamp = nodo_source['sha256'] if nodo_source else None
+    new_manifest = {}
+    jobs = []
+    paises = []
+    for filename, pais in client_files(paises_dir):
+        filepath = os.path.join(paises_dir, filename)
+        paises.append(pais)
+        entry = manifest.get(filename)
+        if entry and entry['pais'] == pais and os.path.exists(partial_path(filename, cache_dir)):
+            current = file_fingerprint(filepath, entry)
+            has_detail = ('detalle' in entry and store.detail_dir(pais, store_dir).is_dir()) if store_dir else True
+            if current['sha256'] == entry['sha256'] and has_detail:
+                print(f"  Cached {pais} ({filename})")
+                if lazy:
+                    pairs = None
+                else:
+                    with rec.span(f'cached {filename}'):
+                        pairs = pd.read_parquet(partial_path(filename, cache_dir))
+                yield filename, pais, pairs
+                new_manifest[filename] = dict(entry, **current)
+                if store_dir and entry['detalle'] != nodo_stamp:
+                    with rec.span(f'remap detail {filename}'):
+                        remap_detail(pais, nodo_map or NodoMap.empty(), store_dir)
+                    new_manifest[filename]['detalle'] = nodo_stamp
+                elif not store_dir:
+                    new_manifest[filename].pop('detalle', None)
+                continue
+        jobs.append((filepath, pais, filename))
+        drop_rollups(filename, cache_dir)
+
+    for filename, pais, pairs, row_count, (start, end, pid) in run_jobs(jobs, workers, chunk_bytes,
+                                                                        store_dir, nodo_dir):
+        print(f"  Processed {pais} ({filename}) -> {row_count:,} rows")
+        rec.add(f'process {filename}', start, end, depth=1, pid=pid, rows=row_count)
+        yield filename, pais, pairs
+        save_partial(filename, pairs, cache_dir)
+        filepath = os.path.join(paises_dir, filename)
+        new_manifest[filename] = dict(file_fingerprint(filepath), pais=pais, rows=row_count)
+        if store_dir:
+            new_manifest[filename]['detalle'] = nodo_stamp
+
+    if store_dir:
+        keep = {store.detail_dir(p, store_dir) for p in paises}
+        for path in store.detail_partitions(store_dir):
+            if path not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+    save_manifest(new_manifest, cache_dir)
+
+def aggregate_pairs(pairs, nodo_map):
+    """Roll the merged pair table up into the asignaciones and nodos frames."""
+    return rollup(pairs, ASIG_KEYS), rollup(nodo_pairs(pairs, nodo_map), NODO_KEYS)
+
+def aggregate_partials(partials, nodo_map, budget, spill_dir=None):
+    """aggregate_pairs() over a stream of pair tables, holding about ``budget`` bytes of pairs.
+
+    ``partials`` yields (filename, pais, pair table) as iter_partials() does.
+    Past the budget the pairs spill to sorted runs on disk (under ``spill_dir``,
+    default the system temp dir) that are merged at the end (see spill.py);
+    counts stay exact and the frames match aggregate_pairs().
+    """
+    asig = spill.SpillRollup(ASIG_KEYS, budget // 2, spill_dir)
+    nodos = spill.SpillRollup(NODO_KEYS, budget // 2, spill_dir)
+    try:
+        for _, _, pairs in partials:
+            asig.add(pairs)
+            nodos.add(nodo_pairs(pairs, nodo_map))
+        spilled = len(asig.runs) + len(nodos.runs)
+        if spilled:
+            print(f"  Merging {spilled} sorted runs spilled to disk")
+        return asig.result(), nodos.result()
+    finally:
+        asig.close()
+        nodos.close()
+
+def aggregate_files(partials, nodo_map, nodo_stamp=None, cache_dir=CACHE_DIR, rec=None):
+    """aggregate_pairs() one Client file at a time, reusing the rollups cached for unchanged files.
+
+    Every asignaciones and nodos row has its país in the keys, so the frames
+    are the concatenation of the rollups of each file. ``partials`` yields
+    (filename, pais, pair table or None) as iter_partials(lazy=True) does; a
+    file with a pair table, or without a cached rollup, is rolled up again
+    (a nodos rollup also when the nodo map, ``nodo_stamp``, changed). Files
+    of the same país are rolled up together and not cached.
+
+    Returns (asignaciones, nodos, changed): ``changed`` maps each frame's
+    name to the países whose rows were rolled up again.
+    """
+    rec = rec or timing.Recorder()
+    files = defaultdict(list)
+    for filename, pais, pairs in partials:
+        files[pais].append((filename, pairs))
+    frames = {name: [] for name in ROLLUPS}
+    changed = {name: set() for name in ROLLUPS}
+    for pais, entries in files.items():
+        filename, pairs = entries[0]
+        cached = {name: load_rollup(filename, name, nodo_stamp, cache_dir) if pairs is None else None
+                  for name in ROLLUPS}
+        if len(entries) > 1:
+            cached = dict.fromkeys(ROLLUPS)
+            pairs = combine_pairs([p if p is not None else pd.read_parquet(partial_path(f, cache_dir))
+                                   for f, p in entries])
+        for name in ROLLUPS:
+            if cached[name] is not None:
+                frames[name].append(cached[name])
+                continue
+            with rec.span(f'rollup {name} {pais}'):
+                if pairs is None:
+                    pairs = pd.read_parquet(partial_path(filename, cache_dir))
+                if name == 'asignaciones':
+                    df = rollup(pairs, ASIG_KEYS)
+                else:
+                    df = rollup(nodo_pairs(pairs, nodo_map), NODO_KEYS)
+            if len(entries) == 1:
+                save_rollup(filename, name, df, nodo_stamp, cache_dir)
+            frames[name].append(df)
+            changed[name].add(pais)
+    empty = combine_pairs([])
+    asig = pd.concat(frames['asignaciones'], ignore_index=True) if files else rollup(empty, ASIG_KEYS)
+    nodos = pd.concat(frames['nodos'], ignore_index=True) if files else \
+        rollup(nodo_pairs(empty, nodo_map), NODO_KEYS)
+    return asig, nodos, changed
+
+def nodo_pairs(pairs, nodo_map):
+    """The pair table with its país as pais_asistencia and the nodo of each expediente."""
+    nodos = pairs.rename(columns={'pais': 'pais_asistencia'})
+    nodos['nodo'] = nodo_map.map(nodos['id_expediente'].to_numpy())
+    return nodos
+
+def rollup(pairs, keys):
+    """Servicios, exact expedientes and an expediente sketch per ``keys`` group."""
+    groups = pairs.groupby(keys)
+    df = groups.agg(
+        servicios=('servicios', 'sum'),
+        expedientes=('id_expediente', 'nunique'),
+    ).reset_index()
+    df['expedientes_hll'] = sketch.encode_groups(groups.ngroup(), pairs['id_expediente'], len(df))
+    return df
+
+def groups_to_frame(data, keys):
+    """Turn the serial path's {key: {servicios, expedientes:set}} dict into a frame."""
+    rows = [dict(zip(keys, key), servicios=vals['servicios'], expedientes=len(vals['expedientes']))
+            for key, vals in data.items()]
+    df = pd.DataFrame(rows, columns=keys + ['servicios', 'expedientes'])
+    codes = np.repeat(np.arange(len(df)), df['expedientes'].to_numpy())
+    ids = [exp_id for vals in data.values() for exp_id in vals['expedientes']]
+    df['expedientes_hll'] = sketch.encode_groups(codes, ids, len(df))
+    return df
+
+def write_csv(df, out_path):
+    """Write ``df`` to a temp file and rename it over ``out_path``, so the app never reads half a file."""
+    df.to_csv(out_path + '.tmp', index=False)
+    os.replace(out_path + '.tmp', out_path)
+
+def write_asignaciones(df, data_dir=DATA_DIR):
     """Write asignaciones_v2.csv."""
-    out_path = os.path.join(DATA_DIR, 'asignaciones_v2.csv')
-    rows = []
-    for (pais, mes, tipo, estado), vals in asig_data.items():
-        rows.append({
-            'pais': pais,
-            'mes': mes,
-            'tipo_asignacion': tipo,
-            'estado': estado,
-            'servicios': vals['servicios'],
-            'expedientes': len(vals['expedientes']),
-        })
-    
-    df = pd.DataFrame(rows)
+    out_path = os.path.join(data_dir, 'asignaciones_v2.csv')
     df = df.sort_values(['pais', 'mes', 'tipo_asignacion', 'estado'])
-    df.to_csv(out_path, index=False)
+    write_csv(df, out_path)
     print(f"\n  Written {len(df):,} rows to {out_path}")
     
     # Summary
@@ -138,23 +726,11 @@ def write_asignaciones(asig_data):
     concl = df[df['estado'] == 'CONCLUIDA'].groupby('pais')['servicios'].sum().sort_values(ascending=False)
     print(concl)
 
-def write_nodos(nodo_data):
+def write_nodos(df, data_dir=DATA_DIR):
     """Write nodos_detalle.csv."""
-    out_path = os.path.join(DATA_DIR, 'nodos_detalle.csv')
-    rows = []
-    for (nodo, pais, mes, estado), vals in nodo_data.items():
-        rows.append({
-            'nodo': nodo,
-            'pais_asistencia': pais,
-            'mes': mes,
-            'estado': estado,
-            'servicios': vals['servicios'],
-            'expedientes': len(vals['expedientes']),
-        })
-    
-    df = pd.DataFrame(rows)
+    out_path = os.path.join(data_dir, 'nodos_detalle.csv')
     df = df.sort_values(['nodo', 'pais_asistencia', 'mes', 'estado'])
-    df.to_csv(out_path, index=False)
+    write_csv(df, out_path)
     print(f"\n  Written {len(df):,} rows to {out_path}")
     
     # Summary
@@ -162,23 +738,120 @@ def write_nodos(nodo_data):
     nodo_sum = df.groupby('nodo').agg({'servicios': 'sum', 'expedientes': 'sum'}).sort_values('servicios', ascending=False)
     print(nodo_sum)
 
-if __name__ == '__main__':
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Regenerate dashboard CSVs from raw Client files.')
+    parser.add_argument('--input-dir', default=PAISES_DIR,
+                        help='directory holding the raw Client exports (.csv, .csv.gz, .csv.zst or .zip)')
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help='directory holding soa_nodos.csv and receiving the outputs')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes for the chunked engine (one Client file per worker)')
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES >> 20,
+                        help='size of each streamed block, in MB')
+    parser.add_argument('--full', action='store_true',
+                        help='re-read every Client file and rebuild the incremental cache')
+    parser.add_argument('--from-csv', action='store_true',
+                        help='only rebuild the columnar store from the CSVs already in data/')
+    parser.add_argument('--serial', action='store_true',
+                        help='use the original row-by-row reader (reference path, no detail store)')
+    parser.add_argument('--memory-mb', type=int, default=0,
+                        help='bound the memory of the final aggregation, spilling sorted runs to disk '
+                             'past this many MB (0: aggregate in memory)')
+    parser.add_argument('--spill-dir', default=None,
+                        help='directory for the spilled runs (default: the system temp dir)')
+    parser.add_argument('--no-detail', action='store_true',
+                        help='skip (and remove) the expediente-level detail store')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='time each phase and write a Chrome trace (JSON) to FILE')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    rec = timing.Recorder(enabled=bool(args.trace))
+    data_dir = args.data_dir
+    store_dir = os.path.join(data_dir, 'store')
+
+    if args.from_csv:
+        print("Rebuilding columnar store from CSV exports...")
+        store.build_from_csv(data_dir, store_dir)
+        return
+
     print("=" * 60)
     print("Generating dashboard data files...")
     print("=" * 60)
     
     print("\n1. Loading nodo mapping...")
-    nodo_map = load_nodo_map()
+    rec.section('load nodo map')
+    cache_dir = os.path.join(data_dir, '.cache')
+    nodo_map = load_nodo_map(data_dir, cache_dir, incremental=not args.full)
+    # Workers memory-map the cached map (load_nodo_map keeps it current)
+    nodo_dir = os.path.join(cache_dir, 'nodo_map') if os.path.exists(os.path.join(data_dir, 'soa_nodos.csv')) else None
     
     print("\n2. Processing Client files...")
-    asig_data, nodo_data = process_client_files(nodo_map)
-    
-    print("\n3. Writing asignaciones_v2.csv...")
-    write_asignaciones(asig_data)
-    
-    print("\n4. Writing nodos_detalle.csv...")
-    write_nodos(nodo_data)
+    rec.section('process client files')
+    if args.serial or args.no_detail:
+        drop_detail(store_dir)
+    # Países whose rows changed since the outputs were last written (None: unknown, rewrite everything)
+    changed = None
+    if args.serial:
+        asig_data, nodo_data = process_client_files(nodo_map, args.input_dir)
+        df_asig = groups_to_frame(asig_data, ASIG_KEYS)
+        df_nodos = groups_to_frame(nodo_data, NODO_KEYS)
+    elif args.memory_mb:
+        partials = iter_partials(args.workers, args.input_dir, args.chunk_mb << 20,
+                                 incremental=not args.full, cache_dir=cache_dir, rec=rec,
+                                 store_dir=None if args.no_detail else store_dir, nodo_dir=nodo_dir)
+        df_asig, df_nodos = aggregate_partials(partials, nodo_map, args.memory_mb << 20, args.spill_dir)
+    else:
+        partials = iter_partials(args.workers, args.input_dir, args.chunk_mb << 20,
+                                 incremental=not args.full, cache_dir=cache_dir, rec=rec,
+                                 store_dir=None if args.no_detail else store_dir, nodo_dir=nodo_dir,
+                                 lazy=True)
+        nodo_stamp = NodoMap.load(nodo_dir)[1]['sha256'] if nodo_dir else None
+        df_asig, df_nodos, changed = aggregate_files(partials, nodo_map, nodo_stamp, cache_dir, rec)
+
+    # Only the changed países need writing if the outputs are as this cache last left them
+    paises = set(df_asig['pais']) | set(df_nodos['pais_asistencia'])
+    stamp, previous = load_outputs(cache_dir)
+    only = None
+    if changed is not None and not args.full and stamp == outputs_stamp(data_dir, store_dir):
+        removed = set(previous) - paises
+        only = {name: changed[name] | removed for name in ROLLUPS}
+    if only is not None and not any(only.values()):
+        print("\n3. Outputs up to date, nothing to write")
+    else:
+        # A run stopped halfway leaves outputs no stamp describes
+        clear_outputs(cache_dir)
+        if only is None or only['asignaciones']:
+            print("\n3. Writing asignaciones_v2.csv...")
+            rec.section('write asignaciones_v2.csv')
+            write_asignaciones(df_asig, data_dir)
+
+        if only is None or only['nodos']:
+            print("\n4. Writing nodos_detalle.csv...")
+            rec.section('write nodos_detalle.csv')
+            write_nodos(df_nodos, data_dir)
+
+        print("\n5. Writing columnar store...")
+        rec.section('write store')
+        for df, name in ((df_asig, 'asignaciones'), (df_nodos, 'nodos')):
+            part = only[name] if only else None
+            if part is None or part:
+                target = store.write(df, name, store_dir, only=part)
+                print(f"  Written {target}" + (f" ({', '.join(sorted(part))})" if part else ''))
+        save_outputs(outputs_stamp(data_dir, store_dir), paises, cache_dir)
+    rec.finish()
+
+    if rec.enabled:
+        print("\n6. Timings...")
+        for row in rec.rows():
+            print(f"  {'  ' * row['depth']}{row['name']:<{48 - 2 * row['depth']}} {row['ms'] / 1000:8.2f}s")
+        rec.write(args.trace)
+        print(f"  Trace written to {args.trace}")
     
     print("\n" + "=" * 60)
     print("DONE!")
     print("=" * 60)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+memo.py — Shared LRU cache for the dashboard's computed frames and figures.
+
+Every sidebar change reruns the whole script, and many sessions ask for the
+same few filter combinations (latest year, all countries, ...). Each loaded
+data set (query.Dataset, shared by every session) carries an LRUCache holding
+the aggregated frames and the serialized figure JSON for each normalized
+selection, so a popular view is built once and then served to every session.
+
+A cache can also be tied to a data version (see store.version()) with sync():
+when the stamp changes it empties itself.
+"""
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 512
+
+def key(sel):
+    """Hashable, normalized form of a selection dict (NumPy scalars -> Python)."""
+    return tuple((d, v.item() if hasattr(v, 'item') else v) for d, v in sorted(sel.items()))
+
+class LRUCache:
+    """Thread-safe bounded mapping with hit/miss counters, tied to one data version."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # key -> Event set once the thread computing it is done
+        self.pending = {}
+        self.hits = self.misses = self.evictions = 0
+
+    def sync(self, version):
+        """Drop every entry if the data changed since they were computed."""
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def get(self, key, compute):
+        """Cached value for ``key``, calling ``compute()`` on a miss.
+
+        A miss on a key another thread is already computing waits for that
+        result instead of computing it again. Values are shared between
+        sessions and must not be mutated.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            done = self.pending.get(key)
+            if done is None:
+                self.misses += 1
+                version = self.version
+                done = self.pending[key] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            done.wait()
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key]
+            # The other thread failed, or the data was swapped meanwhile
+            return self.get(key, compute)
+        try:
+            value = compute()
+            with self.lock:
+                # Don't store a value computed against data that was swapped meanwhile
+                if version == self.version:
+                    self.entries[key] = value
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                        self.evictions += 1
+        finally:
+            with self.lock:
+                del self.pending[key]
+            done.set()
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
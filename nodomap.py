@@ -0,0 +1,155 @@
+"""
+nodomap.py — Compact expediente -> nodo lookup for generate_data.py.
+
+soa_nodos.csv maps a few hundred thousand expediente IDs to a handful of
+nodos. Instead of a dict of Python strings, NodoMap keeps:
+
+  keys    sorted int64 array of the IDs that are plain integers
+  codes   nodo code per key (int16, or int32 past 32767 nodos)
+  names   the distinct nodo names; codes index into it
+  others  any IDs that are not plain integers (leading zeros, letters...),
+          sorted, with their codes; normally empty
+
+so lookups stay exact on the ID strings ('007' and '7' are different
+expedientes). `lookup` resolves a whole column of IDs with one searchsorted.
+`save` writes the arrays as .npy files that `load` memory-maps, so later
+runs skip parsing the CSV.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+SIN_NODO = 'Sin Nodo'
+
+# IDs stored as integers: no sign, no leading zeros, fits in int64
+INTEGER_ID = r'^(0|[1-9][0-9]{0,17})$'
+
+def split_ids(ids):
+    """(integer mask, int64 values) for an array of ID strings; values are 0 where not an integer."""
+    arr = pa.array(ids, pa.string())
+    mask = pc.match_substring_regex(arr, INTEGER_ID).to_numpy(zero_copy_only=False)
+    values = np.zeros(len(arr), dtype=np.int64)
+    if mask.any():
+        values[mask] = pc.cast(arr.filter(pa.array(mask)), pa.int64()).to_numpy()
+    return mask, values
+
+def last_wins(keys, codes):
+    """Sorted unique keys with the code of their last occurrence (like repeated dict assignment)."""
+    keys, first = np.unique(keys[::-1], return_index=True)
+    return keys, codes[::-1][first]
+
+def find(keys, values):
+    """Index of each value in sorted ``keys``, or -1 where absent."""
+    pos = np.searchsorted(keys, values)
+    pos[pos == len(keys)] = 0
+    hit = keys[pos] == values if len(keys) else np.zeros(len(values), dtype=bool)
+    return np.where(hit, pos, -1)
+
+class NodoMap:
+    """Expediente ID -> nodo name, as sorted key arrays and interned nodo codes."""
+
+    def __init__(self, keys, codes, names, other_keys=(), other_codes=()):
+        self.keys = keys
+        self.codes = codes
+        self.names = np.asarray(names, dtype=object)
+        self.other_keys = np.asarray(other_keys, dtype=object)
+        self.other_codes = np.asarray(other_codes, dtype=codes.dtype)
+
+    @classmethod
+    def from_pairs(cls, ids, nodos):
+        """Build from parallel sequences of stripped ID and nodo strings; later pairs win."""
+        codes, names = pd.factorize(pd.Series(nodos, dtype=object))
+        codes = codes.astype(np.int16 if len(names) <= np.iinfo(np.int16).max else np.int32)
+        mask, values = split_ids(ids)
+        keys, key_codes = last_wins(values[mask], codes[mask])
+        other_keys, other_codes = last_wins(np.asarray(ids, dtype=object)[~mask], codes[~mask])
+        return cls(keys, key_codes, list(names), other_keys, other_codes)
+
+    @classmethod
+    def from_csv(cls, path):
+        """Parse soa_nodos.csv (Id_Expediente,Nodo); rows with a blank ID or nodo are skipped."""
+        df = pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8')
+        if 'Id_Expediente' not in df or 'Nodo' not in df:
+            return cls.empty()
+        ids = df['Id_Expediente'].str.strip()
+        nodos = df['Nodo'].str.strip()
+        keep = (ids != '') & (nodos != '')
+        return cls.from_pairs(ids[keep].to_numpy(), nodos[keep].to_numpy())
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int16), [])
+
+    def __len__(self):
+        return len(self.keys) + len(self.other_keys)
+
+    def lookup(self, ids):
+        """Nodo code of each ID string (-1 where unmapped), vectorized over the whole array."""
+        mask, values = split_ids(ids)
+        out = np.full(len(values), -1, dtype=np.int32)
+        pos = find(self.keys, values[mask])
+        out[np.flatnonzero(mask)[pos >= 0]] = self.codes[pos[pos >= 0]]
+        if len(self.other_keys) and not mask.all():
+            rest = np.flatnonzero(~mask)
+            pos = find(self.other_keys, np.asarray(ids, dtype=object)[rest])
+            out[rest[pos >= 0]] = self.other_codes[pos[pos >= 0]]
+        return out
+
+    def map(self, ids, default=SIN_NODO):
+        """Nodo name of each ID string, ``default`` where unmapped."""
+        names = np.append(self.names, np.array([default], dtype=object))
+        return names[self.lookup(ids)]
+
+    def categorical(self, ids, default=SIN_NODO):
+        """map() as a pandas Categorical, built from the codes without per-row strings."""
+        names = list(self.names)
+        if default not in names:
+            names.append(default)
+        codes = self.lookup(ids)
+        codes[codes < 0] = names.index(default)
+        return pd.Categorical.from_codes(codes, names)
+
+    def get(self, exp_id, default=SIN_NODO):
+        """Single-ID lookup, for the row-by-row reader."""
+        plain = exp_id.isascii() and exp_id.isdigit() and len(exp_id) <= 18
+        if plain and (exp_id[0] != '0' or exp_id == '0'):
+            keys, codes, value = self.keys, self.codes, int(exp_id)
+        else:
+            keys, codes, value = self.other_keys, self.other_codes, exp_id
+        i = int(keys.searchsorted(value))
+        return self.names[codes[i]] if i < len(keys) and keys[i] == value else default
+
+    # ─── Binary cache ─────────────────────────────────────────────────────────
+    # keys.npy and codes.npy are memory-mapped on load; meta.json holds the
+    # nodo names, the non-integer IDs and the caller's ``source`` stamp. meta
+    # is written last and removed first, so a half-written cache never loads.
+    def save(self, cache_dir, source):
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name, arr in (('keys', self.keys), ('codes', self.codes)):
+            path = os.path.join(cache_dir, name + '.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(path + '.tmp', path)
+        meta = {'source': source, 'names': list(self.names),
+                'other_keys': list(self.other_keys), 'other_codes': self.other_codes.tolist()}
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    @classmethod
+    def load(cls, cache_dir):
+        """(NodoMap, source stamp) from a cache written by save(), or (None, None)."""
+        try:
+            with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            keys = np.load(os.path.join(cache_dir, 'keys.npy'), mmap_mode='r')
+            codes = np.load(os.path.join(cache_dir, 'codes.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None, None
+        return cls(keys, codes, meta['names'], meta['other_keys'], meta['other_codes']), meta['source']
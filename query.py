@@ -0,0 +1,779 @@
+"""
+query.py — Headless queries over the dashboard aggregates.
+
+The load / filter / aggregate steps behind app.py, usable without Streamlit:
+from Python (Engine), over a small local HTTP/JSON endpoint or from the
+command line. Answers come from the same rollup cubes as the dashboard and
+are memoized per selection in-process (see memo.py), so a query costs a few
+array lookups instead of a script rerun.
+
+Usage:
+  python query.py kpis --año 2025 --mes 3
+  python query.py paises --mes 2025-03 [--csv]
+  python query.py mensual --pais Chile --solo-concluidos
+  python query.py kpis --año 2024,2025 --pais Guatemala,Honduras,Nicaragua
+  python query.py paises --desde 2024-07 --hasta 2025-06
+  python query.py nodos --año 2025
+  python query.py export --view detalle --format xlsx --año 2025 [--output FILE]
+  python query.py serve [--host 127.0.0.1] [--port 8600] [--threads 8]
+
+HTTP: GET /kpis, /paises, /mensual and /nodos take the same filters as query
+parameters (año or anio, mes, pais, tipo, solo_concluidos; several values
+comma-separated or repeated; desde and hasta, 'YYYY-MM', for a range of
+months instead of año and mes); GET /health reports the loaded data and cache
+counters. Responses are JSON. The server
+picks up regenerated data in the background (see Refresher) without a restart.
+GET /export/<view>.<fmt> (views in EXPORTS, formats csv, xlsx and parquet)
+downloads a view as a file, streamed from the export cache (see export.py).
+"""
+import argparse
+import json
+import re
+import shlex
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, urlsplit
+
+import pandas as pd
+
+import cube
+import export
+import memo
+import sketch
+import store
+import timeseries
+
+DATA_DIR = store.DATA_DIR
+TABLES = ('kpis', 'paises', 'mensual', 'nodos')
+# Views that can be downloaded as files (see Dataset.export)
+EXPORTS = ('detalle', 'paises', 'nodos', 'nodos_paises')
+# Rows per page of the expediente drill-down (see Dataset.detail_page)
+DETAIL_PAGE = 100
+
+# Columns of each store used by the queries (the cubes need neither fecha nor mes_nombre)
+ASIG_COLUMNS = ['pais', 'mes', 'tipo_asignacion', 'estado', 'servicios', 'expedientes',
+                'expedientes_hll', 'año', 'mes_num']
+DETALLE_COLUMNS = ['pais', 'mes', 'tipo_asignacion', 'estado', 'servicios', 'expedientes']
+NODOS_COLUMNS = ['nodo', 'pais_asistencia', 'mes', 'estado', 'servicios', 'expedientes',
+                 'expedientes_hll', 'año', 'mes_num']
+
+# ─── Loading ──────────────────────────────────────────────────────────────────
+def load_sketches(df):
+    """Pop the expedientes_hll column into a sketch.Sketches (None for older files)."""
+    if 'expedientes_hll' not in df:
+        return None
+    return sketch.Sketches.from_encoded(df.pop('expedientes_hll'))
+
+def load_asignaciones(data_dir=DATA_DIR, store_dir=store.STORE_DIR, columns=ASIG_COLUMNS):
+    """(frame, sketches) for asignaciones, from the store or else the CSV export."""
+    if store.exists('asignaciones', store_dir):
+        return store.read('asignaciones', columns=columns, store_dir=store_dir)
+    path = Path(data_dir) / "asignaciones_v2.csv"
+    if not path.exists():
+        # Fallback to old format
+        path = Path(data_dir) / "asignaciones.csv"
+        df = pd.read_csv(path)
+        df['estado'] = 'DESCONOCIDO'
+        return store.compact(store.add_date_columns(df), 'asignaciones'), None
+    df = pd.read_csv(path)
+    regs = load_sketches(df)
+    return store.compact(store.add_date_columns(df), 'asignaciones'), regs
+
+def load_nodos(data_dir=DATA_DIR, store_dir=store.STORE_DIR, columns=NODOS_COLUMNS):
+    """(frame, sketches) for nodos, or (None, None) if they were never generated."""
+    if store.exists('nodos', store_dir):
+        return store.read('nodos', columns=columns, store_dir=store_dir)
+    path = Path(data_dir) / "nodos_detalle.csv"
+    if path.exists():
+        df = pd.read_csv(path)
+        regs = load_sketches(df)
+        return store.compact(store.add_date_columns(df), 'nodos'), regs
+    return None, None
+
+def build_cubes(asignaciones, nodos):
+    """Rollup cubes from the (frame, sketches) pairs returned by the loaders."""
+    asig = cube.Cube(asignaciones[0], cube.ASIG_DIMS, asignaciones[1])
+    df_nodos, regs_nodos = nodos
+    return asig, cube.Cube(df_nodos, cube.NODO_DIMS, regs_nodos) if df_nodos is not None else None
+
+# ─── Selections and tables ────────────────────────────────────────────────────
+def selection(año=None, mes_num=None, pais=None, tipo=None, solo_concluidos=False, rango=None):
+    """Cube selection for the dashboard filters (None means "Todos").
+
+    año, mes_num, pais and tipo also take a list of values (multi-select,
+    see choice()). ``rango`` is a ('YYYY-MM', 'YYYY-MM') pair of first and
+    last month; it replaces año and mes_num.
+    """
+    if rango is not None:
+        año = mes_num = None
+        rango = tuple(sorted(rango))
+    return {
+        'año': choice(año),
+        'mes_num': choice(mes_num),
+        'pais': choice(pais),
+        'tipo_asignacion': choice(tipo),
+        'estado': 'CONCLUIDA' if solo_concluidos else None,
+        'rango': rango,
+    }
+
+def choice(value):
+    """Normalized filter value: a list of values becomes a sorted tuple, a single
+    value or None ("Todos", for an empty list), so equal filters share cache keys."""
+    if not cube.is_multi(value):
+        return value
+    values = sorted({v.item() if hasattr(v, 'item') else v for v in value})
+    if not values:
+        return None
+    return values[0] if len(values) == 1 else tuple(values)
+
+def values(value):
+    """The values of a filter as a list (empty for "Todos")."""
+    if value is None:
+        return []
+    return list(value) if cube.is_multi(value) else [value]
+
+def range_months(rango):
+    """Every 'YYYY-MM' label from rango[0] to rango[1], inclusive."""
+    desde, hasta = (pd.Period(m, freq='M') for m in rango)
+    return [str(p) for p in pd.period_range(desde, hasta, freq='M')]
+
+def nodo_selection(sel, mes=False):
+    """The part of ``sel`` the Nodos tab applies: only the year (and the month with ``mes``),
+    or the range of months."""
+    if sel.get('rango') is not None:
+        return {'rango': sel['rango']}
+    if mes and sel['mes_num'] is not None:
+        return {'año': sel['año'], 'mes_num': sel['mes_num']}
+    return {'año': sel['año']}
+
+def history_selection(sel):
+    """``sel`` over every month, with the step between its months (12 when one month is fixed)
+    and the calendar months kept when several are selected (None: all of them)."""
+    mes = sel.get('mes_num')
+    if mes is not None and not cube.is_multi(mes):
+        return {**sel, 'año': None, 'rango': None}, 12, None
+    return {**sel, 'año': None, 'rango': None}, 1, (None if mes is None else tuple(values(mes)))
+
+def export_name(name, sel):
+    """Download file name (without extension) of view ``name`` for ``sel``."""
+    if name.startswith('nodos'):
+        sel = nodo_selection(sel)
+    parts = [name]
+    if sel.get('rango') is not None:
+        parts.append('a'.join(sel['rango']))
+    if sel.get('año') is not None:
+        meses = '+'.join(f'{m:02d}' for m in values(sel.get('mes_num')))
+        parts.append('+'.join(map(str, values(sel['año']))) + (f'-{meses}' if meses else ''))
+    parts += ['+'.join(map(str, values(sel[d]))) for d in ('pais', 'tipo_asignacion') if sel.get(d) is not None]
+    if sel.get('estado') is not None:
+        parts.append('concluidos')
+    return '_'.join(p.replace(' ', '-') for p in parts)
+
+def export_command(name, sel, fmt):
+    """query.py command line writing the ``fmt`` export of view ``name`` for ``sel``."""
+    args = ['python', 'query.py', 'export', '--view', name, '--format', fmt]
+    if sel.get('rango') is not None:
+        args += ['--desde', sel['rango'][0], '--hasta', sel['rango'][1]]
+    for flag, d in (('--anio', 'año'), ('--mes', 'mes_num'), ('--pais', 'pais'), ('--tipo', 'tipo_asignacion')):
+        if sel.get(d) is not None:
+            args += [flag, ','.join(map(str, values(sel[d])))]
+    if sel.get('estado') is not None:
+        args.append('--solo-concluidos')
+    return shlex.join(args)
+
+def kpis(res):
+    return {
+        'total_servicios': res.total_servicios,
+        'concluidos': res.concluidos,
+        'cancelados': res.cancelados,
+        'expedientes': res.expedientes,
+        'pct_conclusion': round(res.pct_conclusion, 1),
+        'paises_activos': res.paises_activos,
+    }
+
+def tasa_por_pais(res):
+    """Servicios, concluidos, expedientes and % conclusión per país."""
+    df = res.por_pais.copy()
+    df['pct_conclusion'] = (df['concluidos'] / df['servicios'] * 100).round(1)
+    return df
+
+# ─── Period comparison ────────────────────────────────────────────────────────
+# Modes: 'yoy' compares with the same period a year earlier, 'mom' with the
+# previous month. Both periods are cube lookups, so a comparison costs two
+# cached summaries and a join of two small tables.
+COMPARISONS = ('yoy', 'mom')
+COMPARED_KPIS = ('total_servicios', 'concluidos', 'cancelados', 'expedientes', 'pct_conclusion')
+
+def previous_period(sel, mode):
+    """``sel`` moved back one year ('yoy') or month ('mom'); None if there is no such period.
+
+    Both need a year; 'mom' also needs a month (January goes back to December)
+    and takes a single año and month only, 'yoy' moves every selected año. A
+    range of months only has a 'yoy' period: the same range a year earlier.
+    """
+    if mode not in COMPARISONS:
+        raise ValueError(f"comparación desconocida: {mode}")
+    if sel.get('rango') is not None:
+        if mode == 'mom':
+            return None
+        return dict(sel, rango=tuple(str(pd.Period(m, freq='M') - 12) for m in sel['rango']))
+    año, mes = sel['año'], sel['mes_num']
+    if año is None or (mode == 'mom' and (mes is None or cube.is_multi(año) or cube.is_multi(mes))):
+        return None
+    if mode == 'yoy':
+        return dict(sel, año=choice([a - 1 for a in values(año)]))
+    return dict(sel, año=año - 1, mes_num=12) if mes == 1 else dict(sel, mes_num=mes - 1)
+
+def growth(delta, base):
+    """Percent change, or None without a base to compare with."""
+    return round(delta / base * 100, 1) if base else None
+
+def kpi_deltas(actual, anterior):
+    """{kpi: {valor, anterior, delta, pct}} from two kpis() dicts.
+
+    pct_conclusion is already a rate: its delta is in points (None if the
+    earlier period had no servicios) and its pct is always None.
+    """
+    out = {}
+    for k in COMPARED_KPIS:
+        delta = actual[k] - anterior[k]
+        if k == 'pct_conclusion':
+            delta = round(delta, 1) if anterior['total_servicios'] else None
+        out[k] = {'valor': actual[k], 'anterior': anterior[k], 'delta': delta,
+                  'pct': None if k == 'pct_conclusion' else growth(delta, anterior[k])}
+    return out
+
+def compare_frames(actual, anterior, key, measures):
+    """Outer join of two period tables on ``key``.
+
+    Every measure gets <m>_anterior, <m>_delta and <m>_pct (percent change,
+    NaN where the earlier period had none) columns; pct_conclusion gets its
+    delta in points only (NaN where the earlier period had no servicios, so
+    ``measures`` must include servicios). Rows keep the order of ``actual``,
+    then rows only present in ``anterior``.
+    """
+    cur = actual.set_index(key)[measures]
+    prev = anterior.set_index(key)[measures]
+    keys = cur.index.append(prev.index.difference(cur.index, sort=False))
+    df = cur.reindex(keys).join(prev.reindex(keys).add_suffix('_anterior')).fillna(0)
+    df = df.rename_axis(key).reset_index()
+    for m in measures:
+        ant = f'{m}_anterior'
+        if m == 'pct_conclusion':
+            df[[m, ant]] = df[[m, ant]].astype('float64')
+            df[f'{m}_delta'] = (df[m] - df[ant]).where(df['servicios_anterior'] != 0).round(1)
+        else:
+            df[[m, ant]] = df[[m, ant]].astype('int64')
+            df[f'{m}_delta'] = df[m] - df[ant]
+            df[f'{m}_pct'] = (df[f'{m}_delta'] / df[ant].where(df[ant] != 0) * 100).round(1)
+    return df
+
+@dataclass
+class Comparison:
+    """A selection against the same filters in an earlier period."""
+    actual: dict            # selection
+    anterior: dict          # selection of the earlier period
+    kpis: dict              # see kpi_deltas()
+    paises: pd.DataFrame    # pais + servicios, concluidos, expedientes, pct_conclusion and their changes
+    nodos: pd.DataFrame     # nodo + the same columns, for año and mes (None without nodo data)
+
+def parse_params(params):
+    """Selection from string filters (query string or CLI); raises ValueError on bad input.
+
+    ``mes`` is either a month number (1-12) or 'YYYY-MM', which also sets año.
+    año, mes (as month numbers), pais and tipo take several values separated
+    by commas. ``desde`` and ``hasta`` ('YYYY-MM', both or neither) select a
+    range of months instead of año and mes.
+    """
+    def split(key):
+        return [v.strip() for v in str(params.get(key) or '').split(',') if v.strip()]
+
+    rango = [m for k in ('desde', 'hasta') for m in split(k)[-1:]]
+    if rango:
+        if len(rango) != 2:
+            raise ValueError("el rango necesita desde y hasta")
+        if split('año') or split('anio') or split('mes'):
+            raise ValueError("el rango no se combina con año ni mes")
+        for m in rango:
+            if not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', m):
+                raise ValueError(f"mes no válido (YYYY-MM): {m}")
+
+    años = [int(a) for a in split('año') or split('anio')]
+    meses = split('mes')
+    if len(meses) == 1 and '-' in meses[0]:
+        año, mes = meses[0].split('-', 1)
+        años, meses = [int(año)], [mes]
+    mes_num = [int(m) for m in meses]
+    for m in mes_num:
+        if not 1 <= m <= 12:
+            raise ValueError(f"mes fuera de rango: {m}")
+    flag = str(params.get('solo_concluidos') or '').split(',')[-1].lower()
+    return selection(
+        año=años,
+        mes_num=mes_num,
+        pais=split('pais'),
+        tipo=split('tipo'),
+        solo_concluidos=flag in ('1', 'true', 'si', 'sí', 'yes'),
+        rango=rango or None,
+    )
+
+# ─── Datasets and background refresh ──────────────────────────────────────────
+# Seconds between checks of the data files, and the time a new version must
+# hold still (generate_data.py writes several files) before it is loaded.
+POLL_SECONDS = 2.0
+
+@dataclass
+class Dataset:
+    """One loaded version of the data: its cubes and the answers computed from them.
+
+    Each version gets its own memo cache, so swapping the Dataset swaps the
+    cached answers with it. Values are shared between threads and must not
+    be mutated.
+    """
+    version: tuple
+    asig: cube.Cube
+    nodos: cube.Cube
+    cache: memo.LRUCache
+    loaded_at: float
+    data_dir: Path = DATA_DIR
+    store_dir: Path = store.STORE_DIR
+    exports: export.ExportCache = None
+
+    def summary(self, sel):
+        return self.cache.get(('asignaciones', memo.key(sel)),
+                              lambda: cube.asignaciones_summary(self.asig, sel))
+
+    def nodos_index(self, sel, mes=False):
+        """NodosIndex for the Nodos-tab part of ``sel``, or None without nodo data."""
+        if self.nodos is None:
+            return None
+        nsel = nodo_selection(sel, mes)
+        return self.cache.get(('nodos', memo.key(nsel)), lambda: cube.nodos_index(self.nodos, nsel))
+
+    def trends(self, sel):
+        """timeseries.Trends of the Asignaciones tab, computed over the whole history of ``sel``."""
+        def build():
+            hist, step, meses = history_selection(sel)
+            por_pais_mes = self.asig.frame(hist, ['pais', 'mes'])
+            return timeseries.asignaciones_trends(self.summary(hist).por_mes, por_pais_mes,
+                                                  sel['año'], step, rango=sel.get('rango'), meses=meses)
+        return self.cache.get(('tendencias', memo.key(sel)), build)
+
+    def nodos_trends(self, sel):
+        """timeseries.Trends of the Nodos tab, or None without nodo data."""
+        if self.nodos is None:
+            return None
+        nsel = nodo_selection(sel)
+
+        def build():
+            # Servicios per nodo and month over the whole history: a cube slice,
+            # no distinct counts needed
+            hist, step, meses = history_selection(nsel)
+            por_mes = self.nodos.frame(hist, ['nodo', 'mes'])
+            por_mes = por_mes[por_mes['nodo'] != 'Sin Nodo'].reset_index(drop=True)
+            return timeseries.nodos_trends(por_mes, nsel.get('año'), step, rango=nsel.get('rango'),
+                                           meses=meses)
+        return self.cache.get(('tendencias_nodos', memo.key(nsel)), build)
+
+    def compare(self, sel, mode):
+        """Comparison of ``sel`` with its previous period (see previous_period), or None."""
+        anterior = previous_period(sel, mode)
+        if anterior is None:
+            return None
+
+        def build():
+            actual, prev = self.summary(sel), self.summary(anterior)
+            measures = ['servicios', 'concluidos', 'expedientes', 'pct_conclusion']
+            nodos = None
+            if self.nodos is not None:
+                nodos = compare_frames(self.nodos_index(sel, mes=True).nodos,
+                                       self.nodos_index(anterior, mes=True).nodos, 'nodo', measures)
+            return Comparison(
+                actual=sel,
+                anterior=anterior,
+                kpis=kpi_deltas(kpis(actual), kpis(prev)),
+                paises=compare_frames(tasa_por_pais(actual), tasa_por_pais(prev), 'pais', measures),
+                nodos=nodos,
+            )
+        return self.cache.get(('comparacion', mode, memo.key(sel)), build)
+
+    def table(self, name, sel):
+        """Frame (or KPI dict) ``name`` for ``sel``; one of TABLES."""
+        if name == 'kpis':
+            return kpis(self.summary(sel))
+        if name == 'paises':
+            return tasa_por_pais(self.summary(sel))
+        if name == 'mensual':
+            return self.summary(sel).por_mes
+        if name == 'nodos':
+            idx = self.nodos_index(sel)
+            return idx.nodos if idx is not None else pd.DataFrame()
+        raise KeyError(name)
+
+    def detalle(self, sel, chunk_rows=export.CHUNK_ROWS):
+        """Asignaciones rows matching ``sel`` (DETALLE_COLUMNS), as chunks read from the store."""
+        where = {d: v for d, v in sel.items() if v is not None and d != 'rango'}
+        if sel.get('rango') is not None:
+            where['mes'] = tuple(range_months(sel['rango']))
+        if store.exists('asignaciones', self.store_dir):
+            yield from store.scan('asignaciones', DETALLE_COLUMNS, where, chunk_rows, self.store_dir)
+            return
+        path = self.data_dir / "asignaciones_v2.csv"
+        if not path.exists():
+            path = self.data_dir / "asignaciones.csv"
+        empty = True
+        for chunk in pd.read_csv(path, chunksize=chunk_rows):
+            chunk = store.add_date_columns(chunk)
+            mask = pd.Series(True, index=chunk.index)
+            for d, v in where.items():
+                mask &= chunk[d].isin(values(v))
+            if mask.any() or empty:
+                empty = False
+                yield chunk.loc[mask, DETALLE_COLUMNS]
+
+    def detail_where(self, sel, nodo=None, expediente=None):
+        """Detail-store filter (see store.where_filter) for ``sel`` plus a nodo and an expediente ID."""
+        where = {d: sel[d] for d in ('pais', 'tipo_asignacion', 'estado') if sel.get(d) is not None}
+        años = values(sel.get('año')) or self.asig.labels['año'].tolist()
+        if sel.get('rango') is not None:
+            where['mes'] = tuple(range_months(sel['rango']))
+        elif sel.get('año') is not None or sel.get('mes_num') is not None:
+            meses = values(sel.get('mes_num')) or range(1, 13)
+            where['mes'] = tuple(f'{int(a)}-{int(m):02d}' for a in años for m in meses)
+        if nodo is not None:
+            where['nodo'] = nodo
+        if expediente:
+            where['id_expediente'] = expediente.strip()
+        return where
+
+    def detail_available(self):
+        return bool(store.detail_partitions(self.store_dir))
+
+    def detail_count(self, sel, nodo=None, expediente=None):
+        """Detail rows (asistencias) matching ``sel``, ``nodo`` and ``expediente``."""
+        where = self.detail_where(sel, nodo, expediente)
+        return self.cache.get(('detalle_n', memo.key(where)),
+                              lambda: store.detail_count(where, self.store_dir))
+
+    def detail_page(self, sel, page, nodo=None, expediente=None, page_rows=DETAIL_PAGE):
+        """Page ``page`` (from 0) of the matching detail rows, ``page_rows`` at a time."""
+        where = self.detail_where(sel, nodo, expediente)
+        return self.cache.get(('detalle_pagina', page, page_rows, memo.key(where)),
+                              lambda: store.detail_page(where, page * page_rows, page_rows, self.store_dir))
+
+    def export(self, name, sel, fmt):
+        """Path of the ``fmt`` file (see export.FORMATS) of view ``name``; one of EXPORTS.
+
+        Files are cached per data version and selection; the nodos views only
+        depend on the part of ``sel`` the Nodos tab applies.
+        """
+        if name not in EXPORTS:
+            raise KeyError(name)
+        if name == 'detalle':
+            chunks = lambda: self.detalle(sel)
+        elif name == 'paises':
+            chunks = lambda: export.frame_chunks(tasa_por_pais(self.summary(sel)))
+        else:
+            if self.nodos is None:
+                raise KeyError(name)
+            sel = nodo_selection(sel)
+            attr = 'nodos' if name == 'nodos' else 'paises'
+            chunks = lambda: export.frame_chunks(getattr(self.nodos_index(sel), attr))
+        return self.exports.get([self.version, name, memo.key(sel)], fmt, chunks)
+
+    def export_rows(self, name, sel):
+        """Data rows of export ``name`` for ``sel``, without writing it."""
+        if name == 'detalle':
+            return len(self.asig.rows(sel))
+        if name == 'paises':
+            return len(self.summary(sel).por_pais)
+        idx = self.nodos_index(nodo_selection(sel))
+        return len(getattr(idx, 'nodos' if name == 'nodos' else 'paises')) if idx is not None else 0
+
+    def answer(self, name, sel):
+        """JSON document for table ``name``; memoized alongside the frames."""
+        def render():
+            value = self.table(name, sel)
+            filtros = json.dumps(dict(memo.key(sel)), ensure_ascii=False)
+            if isinstance(value, dict):
+                body = json.dumps(value, ensure_ascii=False)
+                return f'{{"filtros": {filtros}, "kpis": {body}}}'
+            body = value.to_json(orient='records', force_ascii=False)
+            return f'{{"filtros": {filtros}, "filas": {body}}}'
+        return self.cache.get(('json', name, memo.key(sel)), render)
+
+def load_dataset(data_dir=DATA_DIR, store_dir=store.STORE_DIR, version=None):
+    version = store.version(data_dir, store_dir) if version is None else version
+    asig, nodos = build_cubes(load_asignaciones(data_dir, store_dir), load_nodos(data_dir, store_dir))
+    cache = memo.LRUCache()
+    cache.sync(version)
+    exports = export.ExportCache(Path(data_dir) / '.cache' / 'exports')
+    return Dataset(version, asig, nodos, cache, time.time(), Path(data_dir), Path(store_dir), exports)
+
+def warm(dataset):
+    """Answer the dashboard's opening views (latest year and all years) ahead of time."""
+    años = dataset.asig.labels['año']
+    for año in ([años[-1].item()] if len(años) else []) + [None]:
+        sel = selection(año=año)
+        dataset.summary(sel)
+        dataset.trends(sel)
+        dataset.nodos_index(sel)
+
+class Refresher:
+    """The current Dataset of a data directory, reloaded when generate_data.py rewrites it.
+
+    Without start() every current() call checks the data version and reloads
+    in the calling thread. After start() a daemon thread does the checking:
+    it loads and warms a new version in the background and then replaces the
+    Dataset in a single assignment, so current() never blocks and a caller
+    that holds on to one Dataset never sees a mix of old and new data.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, store_dir=store.STORE_DIR, interval=POLL_SECONDS, warm=warm):
+        self.data_dir = data_dir
+        self.store_dir = store_dir
+        self.interval = interval
+        self.warm = warm
+        self.dataset = None
+        self.lock = threading.Lock()
+        self.pending = None
+        self.loads = 0
+        self.last_error = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def current(self):
+        if self.thread is None:
+            self.reload()
+        return self.dataset
+
+    def reload(self, background=False):
+        """Load the data if its version changed; True if a new Dataset was swapped in.
+
+        In the ``background`` (watcher) case a new version is only loaded once
+        it has been seen unchanged on two consecutive checks, and it is warmed
+        before it goes live.
+        """
+        version = store.version(self.data_dir, self.store_dir)
+        with self.lock:
+            if self.dataset is not None and version == self.dataset.version:
+                self.pending = None
+                return False
+            if background and self.dataset is not None and version != self.pending:
+                self.pending = version
+                return False
+            dataset = load_dataset(self.data_dir, self.store_dir, version)
+            if store.version(self.data_dir, self.store_dir) != version:
+                # Rewritten while loading: keep the current data, try again next time
+                self.pending = None
+                return False
+            if background:
+                self.warm(dataset)
+            self.dataset = dataset
+            self.pending = None
+            self.loads += 1
+            return True
+
+    def start(self):
+        """Load the data now and keep watching it from a background thread.
+
+        The thread first warms the Dataset loaded here, like the ones it
+        loads later; a visitor asking for a view it is still computing waits
+        for that result (see memo.LRUCache.get) rather than building it too.
+        """
+        if self.thread is None:
+            self.reload()
+            self.thread = threading.Thread(target=self._watch, name='data-refresh', daemon=True)
+            self.thread.start()
+        return self
+
+    def _watch(self):
+        try:
+            self.warm(self.dataset)
+        except Exception as e:
+            self.last_error = repr(e)
+        while not self.stopping.wait(self.interval):
+            try:
+                self.reload(background=True)
+                self.last_error = None
+            except Exception as e:
+                # Keep serving the data already loaded; retry on the next check
+                self.last_error = repr(e)
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+# ─── Engine ───────────────────────────────────────────────────────────────────
+class Engine:
+    """Thread-safe query entry point; reloads the cubes when the data is regenerated."""
+
+    def __init__(self, data_dir=DATA_DIR, store_dir=store.STORE_DIR):
+        self.refresher = Refresher(data_dir, store_dir)
+
+    def start(self):
+        """Reload in the background from now on (see Refresher.start)."""
+        self.refresher.start()
+        return self
+
+    def refresh(self):
+        data = self.refresher.current()
+        return data.asig, data.nodos
+
+    def summary(self, sel):
+        return self.refresher.current().summary(sel)
+
+    def nodos_index(self, sel):
+        return self.refresher.current().nodos_index(sel)
+
+    def table(self, name, sel):
+        return self.refresher.current().table(name, sel)
+
+    def answer(self, name, sel):
+        return self.refresher.current().answer(name, sel)
+
+    def export(self, name, sel, fmt):
+        return self.refresher.current().export(name, sel, fmt)
+
+    def health(self):
+        data = self.refresher.current()
+        return {'data_files': len(data.version), 'loaded_at': data.loaded_at,
+                'loads': self.refresher.loads, 'last_error': self.refresher.last_error,
+                'cache': data.cache.stats()}
+
+# ─── HTTP ─────────────────────────────────────────────────────────────────────
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        name = url.path.strip('/')
+        params = {k: ','.join(v) for k, v in parse_qs(url.query).items()}
+        try:
+            if name == 'health':
+                body = json.dumps(self.server.engine.health())
+            elif name in TABLES:
+                body = self.server.engine.answer(name, parse_params(params))
+            elif name.startswith('export/'):
+                return self.send_export(name[len('export/'):], params)
+            else:
+                return self.reply(404, {'error': f"recurso desconocido: /{name}"})
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+        self.reply(200, body)
+
+    def send_export(self, filename, params):
+        """Stream /export/<view>.<fmt> from the export cache, one block at a time."""
+        view, _, fmt = filename.partition('.')
+        if view not in EXPORTS or fmt not in export.FORMATS:
+            return self.reply(404, {'error': f"exportación desconocida: {filename}"})
+        sel = parse_params(params)
+        try:
+            path = self.server.engine.export(view, sel, fmt)
+        except KeyError:
+            return self.reply(404, {'error': f"sin datos para {view}"})
+        self.send_response(200)
+        self.send_header('Content-Type', export.FORMATS[fmt])
+        self.send_header('Content-Length', str(path.stat().st_size))
+        self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(export_name(view, sel))}.{fmt}")
+        self.end_headers()
+        for block in export.read_blocks(path):
+            self.wfile.write(block)
+
+    def reply(self, status, body):
+        if not isinstance(body, str):
+            body = json.dumps(body, ensure_ascii=False)
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class Server(HTTPServer):
+    """HTTPServer answering requests from a bounded thread pool."""
+
+    def __init__(self, address, engine, threads=8):
+        super().__init__(address, Handler)
+        self.engine = engine
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+# ─── CLI ──────────────────────────────────────────────────────────────────────
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Query the dashboard aggregates without Streamlit.')
+    parser.add_argument('command', choices=TABLES + ('export', 'serve'))
+    parser.add_argument('--año', '--anio', dest='año', help='year, e.g. 2025')
+    parser.add_argument('--mes', help='month number (1-12) or YYYY-MM')
+    parser.add_argument('--pais')
+    parser.add_argument('--tipo', help='tipo_asignacion')
+    parser.add_argument('--desde', help='first month of a range, YYYY-MM (with --hasta)')
+    parser.add_argument('--hasta', help='last month of a range, YYYY-MM (with --desde)')
+    parser.add_argument('--solo-concluidos', action='store_true')
+    parser.add_argument('--csv', action='store_true', help='print tables as CSV instead of JSON')
+    parser.add_argument('--view', choices=EXPORTS, default='detalle', help='view to export')
+    parser.add_argument('--format', choices=list(export.FORMATS), default='csv', help='export file format')
+    parser.add_argument('--output', help='copy the export here (default: print its cached path)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--threads', type=int, default=8, help='request handler threads for serve')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    engine = Engine()
+
+    if args.command == 'serve':
+        engine.start()
+        server = Server((args.host, args.port), engine, args.threads)
+        print(f"Serving {', '.join('/' + t for t in TABLES)} on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    try:
+        sel = parse_params({'año': args.año, 'mes': args.mes, 'pais': args.pais, 'tipo': args.tipo,
+                            'desde': args.desde, 'hasta': args.hasta,
+                            'solo_concluidos': '1' if args.solo_concluidos else ''})
+    except ValueError as e:
+        sys.exit(f"error: {e}")
+    if args.command == 'export':
+        try:
+            path = engine.export(args.view, sel, args.format)
+        except KeyError:
+            sys.exit(f"error: sin datos para {args.view}")
+        if args.output:
+            shutil.copyfile(path, args.output)
+            path = args.output
+        print(path)
+        return
+    if args.csv and args.command != 'kpis':
+        sys.stdout.write(engine.table(args.command, sel).to_csv(index=False))
+    else:
+        print(engine.answer(args.command, sel))
+
+if __name__ == '__main__':
+    main()
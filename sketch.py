@@ -0,0 +1,244 @@
+"""
+sketch.py — HyperLogLog sketches for distinct expediente counts.
+
+Each aggregate row carries a sketch of the expedientes behind it
+(`expedientes_hll`, base64 of the zlib-compressed registers). Sketches of any
+set of rows merge with an element-wise max, so the dashboard can count unique
+expedientes for a whole filter selection instead of summing per-row counts,
+which overcounts expedientes that appear in several months, tipos or estados.
+
+With P = 12 (4096 registers) the standard error is about 1.6%.
+
+Most rows (a nodo x país x mes x estado) hold a handful of expedientes, so
+a sketch is stored sparse, as ENTRY records (register, rank) of its non-zero
+registers, unless it has more than SPARSE_MAX of them; only then are all M
+register bytes kept. The length tells the two apart (3 bytes per entry never
+adds up to M). Sketches keeps a table's sketches in that stored form and
+only expands the rows a query merges.
+"""
+import base64
+import zlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+P = 12
+M = 1 << P
+ALPHA = 0.7213 / (1 + 1.079 / M)
+
+# Groups per block when building or merging sketches, bounds memory to BLOCK * M bytes
+BLOCK = 1024
+# Non-zero registers up to which a sketch is stored sparse (3 * SPARSE_MAX < M)
+SPARSE_MAX = 1024
+ENTRY = np.dtype([('idx', '<u2'), ('rank', 'u1')])
+# 2 ** -rank for every possible register value
+_INVERSE = np.exp2(-np.arange(64 - P + 2, dtype=np.float64))
+
+def hash_ids(ids):
+    """Stable 64-bit hash of each expediente ID."""
+    return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+def _bit_length(x):
+    """Vectorized int.bit_length for uint64 arrays."""
+    x = x.copy()
+    n = np.zeros(x.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = x >= (np.uint64(1) << np.uint64(shift))
+        n[big] += shift
+        x[big] >>= np.uint64(shift)
+    n += (x > 0).astype(np.uint8)
+    return n
+
+def registers(codes, hashes, n_groups):
+    """Build one register row per group code from hashed IDs."""
+    idx = (hashes >> np.uint64(64 - P)).astype(np.intp)
+    rest = hashes & np.uint64((1 << (64 - P)) - 1)
+    rank = (64 - P + 1) - _bit_length(rest)
+    regs = np.zeros((n_groups, M), dtype=np.uint8)
+    np.maximum.at(regs, (codes, idx), rank)
+    return regs
+
+def stored(regs):
+    """Stored bytes of each register row of ``regs``: sparse ENTRY records, or M bytes when dense."""
+    regs = np.atleast_2d(regs)
+    rows, idx = np.nonzero(regs)
+    entries = np.empty(len(rows), dtype=ENTRY)
+    entries['idx'] = idx
+    entries['rank'] = regs[rows, idx]
+    raw = entries.tobytes()
+    counts = np.bincount(rows, minlength=len(regs))
+    ends = np.cumsum(counts) * ENTRY.itemsize
+    out = []
+    for i, n in enumerate(counts):
+        out.append(regs[i].tobytes() if n > SPARSE_MAX else raw[ends[i] - n * ENTRY.itemsize:ends[i]])
+    return out
+
+def expand(raw):
+    """Register row (M bytes) of one stored sketch."""
+    data = np.frombuffer(raw, dtype=np.uint8)
+    if len(data) == M:
+        return data.copy()
+    regs = np.zeros(M, dtype=np.uint8)
+    entries = data.view(ENTRY)
+    regs[entries['idx']] = entries['rank']
+    return regs
+
+def encode(regs):
+    return encode_stored(stored(regs)[0])
+
+def encode_stored(raw):
+    return base64.b64encode(zlib.compress(raw)).decode('ascii')
+
+def decode(text):
+    """Register row of an encoded sketch (sparse or dense)."""
+    return expand(zlib.decompress(base64.b64decode(text)))
+
+def encode_groups(codes, ids, n_groups):
+    """Encoded sketch per group, for ``ids`` labelled with group ``codes`` (0..n_groups-1)."""
+    codes = np.asarray(codes, dtype=np.intp)
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    hashes = hash_ids(ids)[order]
+    out = []
+    for lo in range(0, n_groups, BLOCK):
+        hi = min(lo + BLOCK, n_groups)
+        a, b = np.searchsorted(codes, [lo, hi])
+        regs = registers(codes[a:b] - lo, hashes[a:b], hi - lo)
+        out.extend(encode_stored(raw) for raw in stored(regs))
+    return out
+
+class Sketches:
+    """The sketches of a table's rows in stored form (see stored()), one after another.
+
+    Row i is data[offsets[i]:offsets[i + 1]]. Queries expand and merge only
+    the rows they select, a block of groups at a time, so memory stays
+    near the stored size instead of M bytes per row.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.uint8)
+
+    @classmethod
+    def from_stored(cls, raws):
+        """Sketches of stored rows; dense rows with few registers set (older encodings) become sparse."""
+        raws = list(raws)
+        dense = [i for i, raw in enumerate(raws) if len(raw) == M]
+        for lo in range(0, len(dense), BLOCK):
+            pick = dense[lo:lo + BLOCK]
+            regs = np.frombuffer(b''.join(raws[i] for i in pick), dtype=np.uint8).reshape(len(pick), M)
+            for i, raw in zip(pick, stored(regs)):
+                raws[i] = raw
+        lengths = np.fromiter((len(r) for r in raws), dtype=np.int64, count=len(raws))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return cls(offsets, np.frombuffer(b''.join(raws), dtype=np.uint8))
+
+    @classmethod
+    def from_encoded(cls, values):
+        """Sketches of a column of encoded sketches (see encode())."""
+        return cls.from_stored(zlib.decompress(base64.b64decode(text)) for text in values)
+
+    @classmethod
+    def from_arrow(cls, array):
+        """Sketches of an Arrow binary column of stored sketches (or of fixed-size M dense ones)."""
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+        n, first = len(array), array.offset
+        if pa.types.is_fixed_size_binary(array.type):
+            regs = np.frombuffer(array.buffers()[1], dtype=np.uint8)[first * M:(first + n) * M].reshape(n, M)
+            return cls.from_stored(raw for lo in range(0, n, BLOCK) for raw in stored(regs[lo:lo + BLOCK]))
+        width = np.int64 if pa.types.is_large_binary(array.type) else np.int32
+        offsets = np.frombuffer(array.buffers()[1], dtype=width)[first:first + n + 1]
+        data = np.frombuffer(array.buffers()[2], dtype=np.uint8) if n else np.zeros(0, dtype=np.uint8)
+        return cls(offsets, data)
+
+    def to_arrow(self):
+        """The sketches as an Arrow binary column."""
+        offsets = (self.offsets - self.offsets[0]).astype(np.int32)
+        data = self.data[self.offsets[0]:self.offsets[-1]]
+        return pa.Array.from_buffers(pa.binary(), len(self), [None, pa.py_buffer(offsets), pa.py_buffer(data)])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.data.nbytes
+
+    def merge(self, rows, codes, n_groups):
+        """(n_groups, M) registers: the element-wise max of ``rows`` per group ``codes``."""
+        rows = np.asarray(rows, dtype=np.intp)
+        codes = np.asarray(codes, dtype=np.intp)
+        order = np.argsort(codes, kind='stable')
+        rows, codes = rows[order], codes[order]
+        regs = np.zeros((n_groups, M), dtype=np.uint8)
+        start = self.offsets[rows]
+        length = self.offsets[rows + 1] - start
+        dense = length == M
+        for lo in range(0, int(dense.sum()), BLOCK):
+            # Dense rows: max over runs of equal codes, then into their groups
+            first = start[dense][lo:lo + BLOCK]
+            c = codes[dense][lo:lo + BLOCK]
+            block = self.data[first[:, None] + np.arange(M)]
+            heads = np.flatnonzero(np.concatenate([[True], c[1:] != c[:-1]]))
+            regs[c[heads]] = np.maximum(regs[c[heads]], np.maximum.reduceat(block, heads, axis=0))
+        flat = regs.reshape(-1)
+        sparse = np.flatnonzero(~dense)
+        for lo in range(0, len(sparse), BLOCK):
+            pick = sparse[lo:lo + BLOCK]
+            n = length[pick]
+            pos = np.repeat(start[pick] - np.cumsum(n) + n, n) + np.arange(n.sum())
+            entries = self.data[pos].view(ENTRY)
+            np.maximum.at(flat, np.repeat(codes[pick], n // ENTRY.itemsize) * M + entries['idx'],
+                          entries['rank'])
+        return regs
+
+    def count(self, rows, codes=None, n_groups=1):
+        """Distinct-count estimate of the union of ``rows`` per group ``codes`` (all one group for None)."""
+        rows = np.asarray(rows, dtype=np.intp)
+        codes = np.zeros(len(rows), dtype=np.intp) if codes is None else np.asarray(codes, dtype=np.intp)
+        order = np.argsort(codes, kind='stable')
+        rows, codes = rows[order], codes[order]
+        out = np.zeros(n_groups, dtype=np.int64)
+        for lo in range(0, n_groups, BLOCK):
+            hi = min(lo + BLOCK, n_groups)
+            a, b = np.searchsorted(codes, [lo, hi])
+            out[lo:hi] = estimate(self.merge(rows[a:b], codes[a:b] - lo, hi - lo))
+        return out
+
+def estimate(regs):
+    """Distinct-count estimate per register row (linear counting for small sets).
+
+    Every zero register adds 1 to the harmonic sum, so a row with at least
+    ALPHA * M / 2.5 zeros is certainly in the linear range; the sum is only
+    computed for the others.
+    """
+    regs = np.atleast_2d(regs)
+    zeros = (regs == 0).sum(axis=1)
+    est = M * np.log(M / np.maximum(zeros, 1))
+    big = np.flatnonzero(zeros < ALPHA * M / 2.5)
+    if len(big):
+        raw = ALPHA * M * M / _INVERSE[regs[big]].sum(axis=1)
+        est[big] = np.where((raw <= 2.5 * M) & (zeros[big] > 0), est[big], raw)
+    return np.rint(est).astype(np.int64)
+
+def count_distinct(frame, regs, by=None, col='expedientes'):
+    """Distinct expedientes behind the rows of ``frame``, overall or per ``by`` group.
+
+    ``frame`` must keep the positional index of the loaded data so its rows
+    can be located in ``regs`` (a Sketches). Without sketches (``regs`` is
+    None, e.g. data generated before they existed) the per-row counts are
+    summed instead.
+    """
+    if regs is None:
+        if by is None:
+            return int(frame[col].sum())
+        return frame.groupby(by)[col].sum()
+    rows = frame.index.to_numpy()
+    if by is None:
+        return int(regs.count(rows)[0]) if len(rows) else 0
+    if not len(rows):
+        return frame.groupby(by).size().rename(col)
+    groups = frame.groupby(by)
+    counts = regs.count(rows, groups.ngroup().to_numpy(), groups.ngroups)
+    return pd.Series(counts, index=groups.size().index, name=col)
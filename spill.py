@@ -0,0 +1,191 @@
+"""
+spill.py — Exact group counts in bounded memory, spilling sorted runs to disk.
+
+SpillRollup computes what rollup() in generate_data.py computes (servicios,
+the exact number of distinct expedientes and an expediente sketch per group
+of ``keys``) from a stream of pair tables (keys..., id_expediente,
+servicios), holding at most ``budget`` bytes of buffered pairs:
+
+  add()     buffers a pair table; past the budget the buffer is combined (one
+            row per group and expediente), sorted and written to a temporary
+            Arrow IPC file, a run
+  result()  streams a k-way merge of the runs, combining the rows of equal
+            (group, expediente) so each pair is counted once
+
+Groups come out of the merge in order and complete, so only the group being
+merged is held in memory, never the expediente sets of all of them. The merge
+reads one record batch per run at a time from the memory-mapped run files.
+
+Rows are ordered by one string, the clave: the key fields and the expediente
+joined by NUL, which sorts before any other character, so ordering by the
+clave is ordering by the (keys..., expediente) tuple.
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import sketch
+
+SEP = '\x00'
+# Rows per record batch of a run; the merge holds one batch per run
+RUN_BATCH = 65_536
+
+class SpillRollup:
+    """servicios, expedientes and expedientes_hll per ``keys`` group, in bounded memory."""
+
+    def __init__(self, keys, budget, spill_dir=None):
+        self.keys = list(keys)
+        self.budget = budget
+        self.spill_dir = spill_dir
+        self.tmp = None
+        self.runs = []
+        self.buffer = []
+        self.buffered = 0
+
+    def add(self, pairs):
+        """Buffer ``pairs`` (a frame with the keys, id_expediente and servicios)."""
+        fields = [pc.cast(pa.array(pairs[c]), pa.string()) for c in self.keys + ['id_expediente']]
+        table = pa.table({'clave': pc.binary_join_element_wise(*fields, SEP),
+                          'servicios': pc.cast(pa.array(pairs['servicios']), pa.int64())})
+        self.buffer.append(table)
+        self.buffered += table.nbytes
+        if self.buffered > self.budget:
+            self.spill()
+
+    def combined(self):
+        """The buffer as one table sorted by clave, one row per clave; empties the buffer."""
+        table = pa.concat_tables(self.buffer)
+        self.buffer, self.buffered = [], 0
+        table = table.group_by('clave', use_threads=False).aggregate([('servicios', 'sum')])
+        table = table.select(['clave', 'servicios_sum']).rename_columns(['clave', 'servicios'])
+        return table.take(pc.sort_indices(table, [('clave', 'ascending')]))
+
+    def spill(self):
+        """Write the buffer as a sorted run."""
+        if self.tmp is None:
+            self.tmp = tempfile.TemporaryDirectory(prefix='spill-', dir=self.spill_dir)
+        path = os.path.join(self.tmp.name, f'run-{len(self.runs):05d}.arrow')
+        table = self.combined()
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=RUN_BATCH)
+        self.runs.append(path)
+
+    def result(self):
+        """Frame of keys, servicios, expedientes and expedientes_hll, one row per group."""
+        if self.runs and self.buffer:
+            self.spill()
+        if self.runs:
+            sources = [run_batches(path) for path in self.runs]
+        else:
+            sources = [iter(self.combined().to_batches(RUN_BATCH))] if self.buffer else []
+        groups = Groups(self.keys)
+        for clave, servicios in merge(sources):
+            groups.add(clave, servicios)
+        self.close()
+        return groups.frame()
+
+    def close(self):
+        """Remove the runs."""
+        if self.tmp is not None:
+            self.tmp.cleanup()
+            self.tmp = None
+        self.runs = []
+
+def run_batches(path):
+    """Record batches of a run file, read one at a time from a memory map."""
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+def merge(sources):
+    """k-way merge of sorted batch streams, as (clave, servicios) blocks with one row per clave.
+
+    Each block takes, from every stream, the rows up to the smallest last
+    clave among the batches in hand: no later batch can hold a smaller clave.
+    """
+    heads = []
+    for source in sources:
+        head = next_head(source)
+        if head is not None:
+            heads.append(head)
+    while heads:
+        bound = min(keys[-1] for _, _, keys in heads)
+        parts = []
+        for i, (source, batch, keys) in enumerate(heads):
+            n = int(np.searchsorted(keys, bound, side='right'))
+            parts.append(batch.slice(0, n))
+            heads[i] = (source, batch.slice(n), keys[n:]) if n < len(keys) else next_head(source)
+        heads = [h for h in heads if h is not None]
+        block = pa.Table.from_batches([p for p in parts if len(p)])
+        if len(parts) > 1:
+            block = block.take(pc.sort_indices(block, [('clave', 'ascending')]))
+        clave = block.column('clave').combine_chunks()
+        starts = np.flatnonzero(np.concatenate([[True], changes(clave)]))
+        yield clave.take(starts), np.add.reduceat(block.column('servicios').to_numpy(), starts)
+
+def next_head(source):
+    """(source, batch, claves of the batch) for the next non-empty batch of ``source``, or None."""
+    for batch in source:
+        if len(batch):
+            return source, batch, batch.column('clave').to_numpy(zero_copy_only=False)
+    return None
+
+def changes(values):
+    """Whether each element of an Arrow array differs from the one before it (from the second on)."""
+    return pc.not_equal(values[1:], values[:-1]).to_numpy(zero_copy_only=False)
+
+class Groups:
+    """Per-group totals and sketches of merged (clave, servicios) blocks, in clave order."""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.out = {k: [] for k in keys + ['servicios', 'expedientes', 'expedientes_hll']}
+        # [key, servicios, expedientes, registers] of the last group seen, which
+        # the next block may continue
+        self.open = None
+
+    def add(self, clave, servicios):
+        k = len(self.keys)
+        flat = pc.list_flatten(pc.split_pattern(clave, SEP, max_splits=k))
+        fields = [flat.take(np.arange(j, len(flat), k + 1)) for j in range(k + 1)]
+        ids = fields.pop()
+        grupos = pc.binary_join_element_wise(*fields, SEP)
+        starts = np.flatnonzero(np.concatenate([[True], changes(grupos)]))
+        ends = np.append(starts[1:], len(clave))
+        totals = np.add.reduceat(servicios, starts)
+        keys = list(zip(*(f.take(starts).to_pylist() for f in fields)))
+        hashes = sketch.hash_ids(ids.to_numpy(zero_copy_only=False))
+        for lo in range(0, len(starts), sketch.BLOCK):
+            hi = min(lo + sketch.BLOCK, len(starts))
+            a, b = starts[lo], ends[hi - 1]
+            codes = np.repeat(np.arange(hi - lo), ends[lo:hi] - starts[lo:hi])
+            regs = sketch.registers(codes, hashes[a:b], hi - lo)
+            for g in range(lo, hi):
+                group = [keys[g], int(totals[g]), int(ends[g] - starts[g]), regs[g - lo]]
+                if self.open is not None and self.open[0] == group[0]:
+                    group[1] += self.open[1]
+                    group[2] += self.open[2]
+                    group[3] = np.maximum(group[3], self.open[3])
+                elif self.open is not None:
+                    self.emit(self.open)
+                self.open = group
+
+    def emit(self, group):
+        key, servicios, expedientes, regs = group
+        for name, value in zip(self.keys, key):
+            self.out[name].append(value)
+        self.out['servicios'].append(servicios)
+        self.out['expedientes'].append(expedientes)
+        self.out['expedientes_hll'].append(sketch.encode(regs))
+
+    def frame(self):
+        if self.open is not None:
+            self.emit(self.open)
+            self.open = None
+        df = pd.DataFrame(self.out)
+        return df.astype({k: str for k in self.keys} | {'servicios': 'int64', 'expedientes': 'int64'})
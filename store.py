@@ -0,0 +1,320 @@
+"""
+store.py — Columnar Parquet store for the dashboard aggregates.
+
+generate_data.py writes each aggregate as a Hive-partitioned Parquet dataset
+(data/store/<name>/año=YYYY/<país>.parquet, one file per año and país so a
+changed Client file only rewrites its own) with dictionary-encoded dimensions,
+int32 measures, an integer month key and the date columns the dashboard uses
+already computed, so the app skips CSV parsing and datetime conversion.
+Readers pass column projections and año filters down to pyarrow, which only
+opens the matching partitions and columns.
+
+The CSVs in data/ remain the export format; `python store.py` rebuilds the
+store from them.
+
+store/detalle/ is the expediente-level detail behind the aggregates (one
+row per asistencia), partitioned by país and mes (pais=<p>/mes=YYYY-MM/) and
+sorted inside each file by expediente and asistencia ID in small row groups,
+so a drill-down opens one file per (país, mes) and an expediente lookup
+skips row groups by their ID statistics. generate_data.py writes one país partition per Client file.
+"""
+import os
+import shutil
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pathlib import Path
+
+import sketch
+
+# DASHBOARD_DATA_DIR points the dashboard and query.py at another data set (e.g. benchmarks)
+DATA_DIR = Path(os.environ.get('DASHBOARD_DATA_DIR') or Path(__file__).parent / 'data')
+STORE_DIR = DATA_DIR / 'store'
+
+DIMENSIONS = {
+    'asignaciones': ['pais', 'mes', 'tipo_asignacion', 'estado'],
+    'nodos': ['nodo', 'pais_asistencia', 'mes', 'estado'],
+}
+# Column each file of a dataset holds a single value of (see write())
+SPLIT = {
+    'asignaciones': 'pais',
+    'nodos': 'pais_asistencia',
+}
+CSV_FILES = {
+    'asignaciones': 'asignaciones_v2.csv',
+    'nodos': 'nodos_detalle.csv',
+}
+PARTITIONING = ds.partitioning(pa.schema([('año', pa.int16())]), flavor='hive')
+
+DETAIL = 'detalle'
+DETAIL_COLUMNS = ['id_expediente', 'id_asistencia', 'pais', 'mes', 'tipo_asignacion', 'estado', 'nodo']
+DETAIL_SORT = ['id_expediente', 'id_asistencia']
+DETAIL_DICTIONARY = ['tipo_asignacion', 'estado', 'nodo']
+DETAIL_SCHEMA = pa.schema([(c, pa.dictionary(pa.int32(), pa.string()) if c in DETAIL_DICTIONARY else pa.string())
+                           for c in DETAIL_COLUMNS])
+DETAIL_PARTITIONING = ds.partitioning(pa.schema([('pais', pa.string()), ('mes', pa.string())]),
+                                      flavor='hive')
+DETAIL_ROW_GROUP = 16_384
+
+def add_date_columns(df):
+    """Derive fecha, año, mes_num, mes_key (año*12 + mes_num - 1) and mes_nombre from mes."""
+    fecha = pd.to_datetime(df['mes'] + '-01')
+    df['fecha'] = fecha
+    df['año'] = fecha.dt.year.astype('int16')
+    df['mes_num'] = fecha.dt.month.astype('int8')
+    df['mes_key'] = (df['año'].astype('int32') * 12 + df['mes_num'] - 1).astype('int32')
+    df['mes_nombre'] = fecha.dt.strftime('%b %Y')
+    return df
+
+def to_table(df, name):
+    """Typed Arrow table for one aggregate frame (as produced by generate_data.py)."""
+    dims = DIMENSIONS[name]
+    df = add_date_columns(df.sort_values(dims, ignore_index=True))
+    cols = {d: pa.array(df[d].astype(str)).dictionary_encode() for d in dims}
+    cols['servicios'] = pa.array(df['servicios'], pa.int32())
+    cols['expedientes'] = pa.array(df['expedientes'], pa.int32())
+    cols['fecha'] = pa.array(df['fecha'], pa.timestamp('ms'))
+    cols['año'] = pa.array(df['año'], pa.int16())
+    cols['mes_num'] = pa.array(df['mes_num'], pa.int8())
+    cols['mes_key'] = pa.array(df['mes_key'], pa.int32())
+    cols['mes_nombre'] = pa.array(df['mes_nombre']).dictionary_encode()
+    if 'expedientes_hll' in df:
+        # Stored form (see sketch.stored()): a few bytes for most rows
+        cols['expedientes_hll'] = sketch.Sketches.from_encoded(df['expedientes_hll']).to_arrow()
+    return pa.table(cols)
+
+def part_name(value):
+    return f'{quote(value, safe="")}.parquet'
+
+def write_parts(table, name, root):
+    """Write ``table`` under ``root`` as one file per año and SPLIT value; returns the paths."""
+    keys = pd.DataFrame({'año': table['año'].to_numpy(),
+                         'value': table[SPLIT[name]].cast(pa.string()).to_numpy(zero_copy_only=False)})
+    paths = []
+    for (año, value), rows in keys.groupby(['año', 'value']).indices.items():
+        path = Path(root) / f'año={año}' / part_name(value)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'.{path.name}.tmp')
+        pq.write_table(table.take(rows).drop_columns(['año']), tmp, compression='zstd')
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+def write(df, name, store_dir=STORE_DIR, only=None):
+    """Write the ``name`` dataset from ``df``; the old one stays readable until the swap.
+
+    With ``only`` (a set of SPLIT values) just the files of those values are
+    replaced, from their rows in ``df`` (a value without rows loses its
+    files), and the rest of the dataset is kept. Each file is swapped in on
+    its own.
+    """
+    target = Path(store_dir) / name
+    if only is not None:
+        table = to_table(df[df[SPLIT[name]].isin(only)], name)
+        written = set(write_parts(table, name, target))
+        stale = [p for value in only for p in target.glob(f'año=*/{part_name(value)}') if p not in written]
+        for path in stale:
+            path.unlink()
+            if not any(path.parent.iterdir()):
+                path.parent.rmdir()
+        return target
+    tmp = Path(store_dir) / f'.{name}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    write_parts(to_table(df, name), name, tmp)
+    old = Path(store_dir) / f'.{name}.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if target.exists():
+        os.replace(target, old)
+    os.replace(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+    return target
+
+def exists(name, store_dir=STORE_DIR):
+    return (Path(store_dir) / name).is_dir()
+
+def version(data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Stamp of the data files the dashboard reads; changes whenever they are rewritten.
+
+    Built from (path, size, mtime_ns) of the CSV exports and the store's
+    Parquet files, so it only costs a few stat calls.
+    """
+    paths = sorted(Path(store_dir).glob('*/año=*/*.parquet'))
+    paths += [Path(data_dir) / f for f in ('asignaciones_v2.csv', 'asignaciones.csv', 'nodos_detalle.csv')]
+    stamp = []
+    for path in paths:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        stamp.append((str(path), st.st_size, st.st_mtime_ns))
+    return tuple(stamp)
+
+def read(name, columns=None, años=None, store_dir=STORE_DIR):
+    """Load ``name`` as (frame, sketch.Sketches or None).
+
+    ``columns`` limits the columns read; ``años`` limits the year partitions.
+    Dimensions come back as categoricals and measures as int32, see compact().
+    """
+    dataset = ds.dataset(Path(store_dir) / name, format='parquet', partitioning=PARTITIONING)
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names]
+    filt = ds.field('año').isin(list(años)) if años is not None else None
+    table = dataset.to_table(columns=columns, filter=filt)
+
+    regs = None
+    if 'expedientes_hll' in table.column_names:
+        # Stores written before sparse sketches hold fixed-size (dense) ones
+        regs = sketch.Sketches.from_arrow(table.column('expedientes_hll'))
+        table = table.drop_columns(['expedientes_hll'])
+    # Dictionary-encoded columns convert to pandas categoricals as they are
+    return table.to_pandas(), regs
+
+def where_filter(where):
+    """pyarrow filter for ``where``: column -> value, or a list of accepted values."""
+    filt = None
+    for col, value in where.items():
+        cond = ds.field(col).isin(value) if isinstance(value, (list, tuple)) else ds.field(col) == value
+        filt = cond if filt is None else filt & cond
+    return filt
+
+def scan(name, columns=None, where=None, batch_rows=100_000, store_dir=STORE_DIR):
+    """Iterate over ``name`` as frames of at most ``batch_rows`` rows.
+
+    ``where`` maps columns (año, mes_num, dimensions) to the value they must
+    equal or a list of accepted values; the filter and the column projection
+    are pushed down to pyarrow, so only matching partitions are opened and
+    one batch is in memory at a time. Yields a single empty frame when
+    nothing matches.
+    """
+    dataset = ds.dataset(Path(store_dir) / name, format='parquet', partitioning=PARTITIONING)
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names]
+    reader = dataset.scanner(columns=columns, filter=where_filter(where or {}),
+                             batch_size=batch_rows).to_reader()
+    empty = True
+    for batch in reader:
+        if batch.num_rows:
+            empty = False
+            yield batch.to_pandas()
+    if empty:
+        yield reader.schema.empty_table().to_pandas()
+
+# ─── Detail store ─────────────────────────────────────────────────────────────
+def detail_dir(pais, store_dir=STORE_DIR):
+    return Path(store_dir) / DETAIL / f'pais={quote(pais, safe="")}'
+
+def write_detail(df, pais, store_dir=STORE_DIR):
+    """Replace the ``pais`` partition of the detail store with ``df`` (DETAIL_COLUMNS but pais)."""
+    target = detail_dir(pais, store_dir)
+    tmp = target.with_name(f'.{target.name}.tmp')
+    old = target.with_name(f'.{target.name}.old')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    columns = {}
+    for c in [c for c in DETAIL_COLUMNS if c not in ('pais', 'mes')]:
+        col = pa.array(df[c])
+        if c in DETAIL_DICTIONARY and not pa.types.is_dictionary(col.type):
+            col = col.cast(pa.string()).dictionary_encode()
+        columns[c] = col.cast(DETAIL_SCHEMA.field(c).type)
+    table = pa.table(columns)
+    # Group the rows by month, then sort each month's rows by ID: many small
+    # string sorts are about twice as fast as one sort on (mes, IDs)
+    codes, meses = pd.factorize(df['mes'], sort=True)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(meses)))])
+    keys = table.select(DETAIL_SORT)
+    for mes, lo, hi in zip(meses, bounds[:-1], bounds[1:]):
+        rows = order[lo:hi]
+        rows = rows[pc.sort_indices(keys.take(rows), [(c, 'ascending') for c in DETAIL_SORT]).to_numpy()]
+        (tmp / f'mes={mes}').mkdir()
+        pq.write_table(table.take(rows), tmp / f'mes={mes}' / 'part-0.parquet',
+                       row_group_size=DETAIL_ROW_GROUP, compression='zstd')
+    shutil.rmtree(old, ignore_errors=True)
+    if target.exists():
+        os.replace(target, old)
+    os.replace(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+    return target
+
+def detail_dataset(store_dir=STORE_DIR):
+    return ds.dataset(Path(store_dir) / DETAIL, schema=DETAIL_SCHEMA, format='parquet',
+                      partitioning=DETAIL_PARTITIONING)
+
+def read_detail(pais, store_dir=STORE_DIR):
+    """The whole ``pais`` partition as a frame (DETAIL_COLUMNS)."""
+    dataset = detail_dataset(store_dir)
+    table = dataset.to_table(filter=ds.field('pais') == pais)
+    return table.to_pandas()[DETAIL_COLUMNS]
+
+def detail_partitions(store_dir=STORE_DIR):
+    """País partition directories of the detail store."""
+    root = Path(store_dir) / DETAIL
+    return sorted(p for p in root.glob('pais=*') if p.is_dir()) if root.is_dir() else []
+
+def detail_count(where, store_dir=STORE_DIR):
+    """Rows of the detail store matching ``where`` (see where_filter)."""
+    dataset = detail_dataset(store_dir)
+    return dataset.count_rows(filter=where_filter(where))
+
+def detail_page(where, offset=0, limit=100, store_dir=STORE_DIR):
+    """Rows ``offset`` .. ``offset + limit`` of the matches, in (país, mes, sort key) order.
+
+    Whole (país, mes) files before the page are skipped by their match count
+    and the rest is read one batch at a time, so memory stays bounded by the
+    batch size whatever the offset.
+    """
+    dataset = detail_dataset(store_dir)
+    filt = where_filter(where)
+    batches = []
+    for fragment in dataset.get_fragments(filter=filt):
+        if limit <= 0:
+            break
+        scanner = fragment.scanner(schema=dataset.schema, columns=DETAIL_COLUMNS, filter=filt,
+                                   batch_size=DETAIL_ROW_GROUP, use_threads=False)
+        n = scanner.count_rows()
+        if offset >= n:
+            offset -= n
+            continue
+        for batch in scanner.to_batches():
+            if offset >= batch.num_rows:
+                offset -= batch.num_rows
+                continue
+            batch = batch.slice(offset, limit)
+            offset = 0
+            batches.append(batch)
+            limit -= batch.num_rows
+            if limit <= 0:
+                break
+    return pa.Table.from_batches(batches, schema=DETAIL_SCHEMA).to_pandas()
+
+def compact(df, name):
+    """Give a frame read from the CSV exports the dtypes read() returns.
+
+    Dimensions (and mes_nombre) become categoricals and the measures int32,
+    a fraction of the memory of object strings and int64.
+    """
+    for col in DIMENSIONS[name] + ['mes_nombre']:
+        if col in df:
+            df[col] = df[col].astype('category')
+    for col in ('servicios', 'expedientes'):
+        if col in df:
+            df[col] = df[col].astype('int32')
+    return df
+
+def build_from_csv(data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Rebuild the store from the CSV exports in ``data_dir``."""
+    for name, filename in CSV_FILES.items():
+        path = Path(data_dir) / filename
+        if not path.exists():
+            print(f"  SKIP (not found): {filename}")
+            continue
+        target = write(pd.read_csv(path), name, store_dir)
+        print(f"  Written {name} store to {target}")
+
+if __name__ == '__main__':
+    build_from_csv()
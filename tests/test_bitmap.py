@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import bitmap
+
+@pytest.fixture(scope='module')
+def codes():
+    # A few frequent values (packed bitmaps) and many rare ones (positions)
+    rng = np.random.default_rng(0)
+    p = np.concatenate([[0.3, 0.3, 0.2], np.full(97, 0.2 / 97)])
+    return rng.choice(100, 10_001, p=p).astype(np.int32)
+
+def rows_of(bits, n_rows):
+    return bitmap.positions(bits, n_rows)
+
+def test_rare_values_keep_positions(codes):
+    index = bitmap.BitmapIndex(codes, 100)
+    assert index.values[0].dtype == np.uint8 and index.values[50].dtype == np.uint32
+    assert index.nbytes < 100 * len(codes) // 8
+
+@pytest.mark.parametrize('selected', [[0], [50], [0, 1], [7, 50, 99], [2, 60, 60], []])
+def test_any_of_is_the_or_of_values(codes, selected):
+    index = bitmap.BitmapIndex(codes, 100)
+    got = rows_of(index.any_of(selected), len(codes))
+    assert (got == np.flatnonzero(np.isin(codes, selected))).all()
+
+def test_prefix_bitmaps_between(codes):
+    prefix = bitmap.PrefixBitmaps(codes, 100)
+    for lo, hi in [(0, 100), (0, 1), (3, 40), (40, 40), (99, 100)]:
+        got = rows_of(prefix.between(lo, hi), len(codes))
+        assert (got == np.flatnonzero((codes >= lo) & (codes < hi))).all()
+
+def test_all_of_intersects(codes):
+    index = bitmap.BitmapIndex(codes, 100)
+    prefix = bitmap.PrefixBitmaps(codes, 100)
+    bits = bitmap.all_of([index.any_of([0, 5, 9]), prefix.between(1, 10)])
+    assert (rows_of(bits, len(codes)) == np.flatnonzero(np.isin(codes, [5, 9]))).all()
+    assert bitmap.all_of([]) is None
@@ -0,0 +1,69 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube
+
+@pytest.fixture(scope='module')
+def facts():
+    rng = np.random.default_rng(0)
+    n = 2_000
+    return pd.DataFrame({
+        'año': rng.choice([2023, 2024, 2025], n),
+        'mes_num': rng.integers(1, 13, n),
+        'pais': rng.choice(['Chile', 'Peru', 'Uruguay'], n),
+        'tipo_asignacion': rng.choice(['APP', 'MANUAL', 'SIN_TIPO'], n),
+        'estado': rng.choice(['CANCELADA', 'CONCLUIDA'], n),
+        'servicios': rng.integers(1, 50, n),
+        'expedientes': rng.integers(1, 10, n),
+    })
+
+@pytest.fixture(scope='module')
+def asig(facts):
+    return cube.Cube(facts, cube.ASIG_DIMS)
+
+def matching(facts, sel):
+    keep = np.ones(len(facts), dtype=bool)
+    for d, value in sel.items():
+        if value is not None:
+            keep &= facts[d].isin(value if cube.is_multi(value) else [value]).to_numpy()
+    return facts[keep]
+
+def test_all_slots_match_every_mix_of_values_and_todos(facts, asig):
+    fixed = {'año': 2024, 'mes_num': 3, 'pais': 'Peru', 'tipo_asignacion': 'APP', 'estado': 'CONCLUIDA'}
+    for mask in itertools.product([False, True], repeat=len(fixed)):
+        sel = {d: v if on else None for (d, v), on in zip(fixed.items(), mask)}
+        expected = matching(facts, sel)
+        assert asig.total(sel) == expected['servicios'].sum()
+        assert asig.total(sel, 'expedientes') == expected['expedientes'].sum()
+
+def test_multi_select_and_breakdowns(facts, asig):
+    sel = {'año': [2023, 2025], 'pais': ['Chile', 'Uruguay'], 'estado': 'CANCELADA'}
+    expected = matching(facts, sel)
+    assert asig.total(sel) == expected['servicios'].sum()
+    by_pais = asig.series(sel, 'pais')
+    assert by_pais.to_dict() == expected.groupby('pais')['servicios'].sum().to_dict()
+    assert asig.total({'pais': 'Bolivia'}) == 0
+    assert len(asig.rows(sel)) == len(expected)
+
+def in_range(facts, desde, hasta):
+    mes = facts['año'].astype(str) + '-' + facts['mes_num'].map('{:02d}'.format)
+    return facts[(mes >= desde) & (mes <= hasta)]
+
+@pytest.mark.parametrize('rango', [('2023-01', '2025-12'), ('2023-11', '2024-02'), ('2024-06', '2024-06'),
+                                   ('2022-01', '2023-01'), ('2025-12', '2026-06')])
+def test_prefix_sums_answer_any_range(facts, asig, rango):
+    sel = {'rango': rango, 'pais': ['Chile', 'Peru'], 'estado': 'CONCLUIDA'}
+    expected = matching(in_range(facts, *rango), {d: v for d, v in sel.items() if d != 'rango'})
+    assert asig.total(sel) == expected['servicios'].sum()
+    por_mes = asig.frame(sel, ['mes'])
+    assert por_mes['servicios'].sum() == expected['servicios'].sum()
+    assert list(por_mes['mes']) == sorted(por_mes['mes'])
+    assert (por_mes['mes'] >= rango[0]).all() and (por_mes['mes'] <= rango[1]).all()
+    assert len(asig.rows(sel)) == len(expected)
+
+def test_range_does_not_combine_with_año(asig):
+    with pytest.raises(ValueError):
+        asig.total({'rango': ('2024-01', '2024-03'), 'año': 2024})
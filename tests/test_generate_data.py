@@ -0,0 +1,81 @@
+import gzip
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import generate_data
+
+HEADER = 'id_expediente;id_asistencia;estado_asistencia;tipo_asignacion;creacion_asistencia;observaciones\n'
+
+def client_rows(seed, n=4_000):
+    """Raw Client rows in the export's quirks: padding, casing, blanks, latin-1 text, short dates."""
+    rng = np.random.default_rng(seed)
+    estados = rng.choice(['CONCLUIDA', 'cancelada ', ' PROCESO', 'ABIERTA', ''], n)
+    tipos = rng.choice(['MANUAL', ' app', '', 'ANCLAJE BASE'], n)
+    dias = pd.Timestamp('2024-11-01') + pd.to_timedelta(rng.integers(0, 120, n), unit='D')
+    fechas = np.where(rng.random(n) < 0.01, '2025', dias.strftime('%Y-%m-%d %H:%M:%S'))
+    rows = [f'{e};{i};{s};{t};{f};Atención en Peñalolén\n'
+            for e, i, s, t, f in zip(rng.integers(1, 900, n), range(n), estados, tipos, fechas)]
+    return HEADER + ''.join(rows) + '17;\n'
+
+def write_client(path, text):
+    data = text.encode('latin-1')
+    if path.name.endswith('.gz'):
+        path.write_bytes(gzip.compress(data))
+    elif path.name.endswith('.zst'):
+        with pa.CompressedOutputStream(str(path), 'zstd') as out:
+            out.write(data)
+    elif path.name.endswith('.zip'):
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(path.name[:-len('.zip')] + '.csv', data)
+    else:
+        path.write_bytes(data)
+
+@pytest.mark.parametrize('ext', ['.csv.gz', '.csv.zst', '.zip'])
+def test_compressed_exports_read_like_plain_csv(tmp_path, ext):
+    text = client_rows(0)
+    plain, packed = tmp_path / 'Client06_Argentina_20251027.csv', tmp_path / f'Client06_Argentina_20251027{ext}'
+    write_client(plain, text)
+    write_client(packed, text)
+    expected, rows = generate_data.process_client_file(str(plain), 'Argentina', chunk_bytes=32 << 10)
+    got, got_rows = generate_data.process_client_file(str(packed), 'Argentina', chunk_bytes=32 << 10)
+    assert got_rows == rows
+    pd.testing.assert_frame_equal(got, expected)
+    with generate_data.open_client_text(str(packed)) as f:
+        assert f.read() == text
+
+def test_newest_export_and_preferred_format_win(tmp_path):
+    for name in ['Client06_Argentina_20250101.csv', 'Client06_Argentina_20251027.csv.gz',
+                 'Client06_Argentina_20251027.zip', 'Client99_Atlantida_20251027.csv.zst', 'notes.txt']:
+        (tmp_path / name).write_bytes(b'')
+    files = dict(generate_data.client_files(str(tmp_path)))
+    assert files == {'Client06_Argentina_20251027.csv.gz': 'Argentina',
+                     'Client99_Atlantida_20251027.csv.zst': 'Atlantida'}
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    """Three Client exports (one gzip) and a soa_nodos.csv."""
+    raw = tmp_path_factory.mktemp('paises')
+    for seed, name in enumerate(['Client06_Argentina_20251027.csv', 'Client11_Chile_20251027.csv.gz',
+                                 'Client17_Peru_20251027.csv']):
+        write_client(raw / name, client_rows(seed))
+    soa = pd.DataFrame({'Id_Expediente': range(1, 900, 2), 'Nodo': ['Nodo A', 'Nodo B', 'Nodo C'] * 150})
+    soa.to_csv(raw / 'soa_nodos.csv', index=False)
+    return raw
+
+def generate(exports, data_dir, *args):
+    data_dir.mkdir(exist_ok=True)
+    (data_dir / 'soa_nodos.csv').write_bytes((exports / 'soa_nodos.csv').read_bytes())
+    generate_data.main(['--input-dir', str(exports), '--data-dir', str(data_dir), *args])
+    return {f: (data_dir / f).read_bytes() for f in ('asignaciones_v2.csv', 'nodos_detalle.csv')}
+
+@pytest.mark.parametrize('args', [['--workers', '2'], ['--workers', '1', '--chunk-mb', '1'],
+                                  ['--workers', '1', '--memory-mb', '1']])
+def test_parallel_output_is_byte_identical_to_serial(exports, tmp_path, args):
+    serial = generate(exports, tmp_path / 'serial', '--serial')
+    assert generate(exports, tmp_path / 'parallel', *args) == serial
+    # A rerun served from the cache leaves the outputs as they are
+    assert generate(exports, tmp_path / 'parallel', *args) == serial
@@ -0,0 +1,32 @@
+import numpy as np
+
+from nodomap import SIN_NODO, NodoMap
+
+PAIRS = [('10', 'Guatemala'), ('7', 'Chile'), ('007', 'Peru'), ('ABC-1', 'Chile'), ('10', 'Mexico'),
+         ('123456789012345678', 'Peru'), ('1234567890123456789', 'Guatemala')]
+
+def as_dict():
+    # What the dict of string IDs it replaces held: later pairs win
+    return dict(PAIRS)
+
+def test_lookups_match_a_dict_of_string_ids():
+    ids, nodos = zip(*PAIRS)
+    nodo_map = NodoMap.from_pairs(list(ids), list(nodos))
+    queries = ['10', '7', '007', '07', 'ABC-1', 'abc-1', '123456789012345678', '1234567890123456789', '99', '']
+    expected = [as_dict().get(q, SIN_NODO) for q in queries]
+    assert len(nodo_map) == len(as_dict())
+    assert list(nodo_map.map(np.array(queries, dtype=object))) == expected
+    assert [nodo_map.get(q) for q in queries if q] == expected[:-1]
+    assert list(nodo_map.categorical(np.array(queries, dtype=object))) == expected
+
+def test_csv_cache_round_trip(tmp_path):
+    csv = tmp_path / 'soa_nodos.csv'
+    csv.write_text('Id_Expediente,Nodo\n' + ''.join(f' {i} ,{n}\n' for i, n in PAIRS) + ',Chile\n5,\n',
+                   encoding='utf-8')
+    nodo_map = NodoMap.from_csv(csv)
+    nodo_map.save(tmp_path / 'cache', {'sha256': 'x'})
+    loaded, source = NodoMap.load(tmp_path / 'cache')
+    assert source == {'sha256': 'x'}
+    queries = np.array(['10', '007', 'ABC-1', '5'], dtype=object)
+    assert list(loaded.map(queries)) == ['Mexico', 'Peru', 'Chile', SIN_NODO]
+    assert NodoMap.load(tmp_path / 'missing') == (None, None)
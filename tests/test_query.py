@@ -0,0 +1,52 @@
+import pytest
+
+import query
+
+def test_parse_params_single_values():
+    sel = query.parse_params({'año': '2025', 'mes': '3', 'pais': 'Chile', 'solo_concluidos': 'true'})
+    assert sel == query.selection(año=2025, mes_num=3, pais='Chile', solo_concluidos=True)
+
+def test_parse_params_lists_and_year_month():
+    sel = query.parse_params({'anio': '2025, 2024', 'pais': 'Peru,Chile,Peru', 'tipo': 'APP'})
+    assert sel['año'] == (2024, 2025) and sel['pais'] == ('Chile', 'Peru') and sel['tipo_asignacion'] == 'APP'
+    sel = query.parse_params({'mes': '2024-11'})
+    assert (sel['año'], sel['mes_num']) == (2024, 11)
+    assert query.parse_params({}) == query.selection()
+
+def test_parse_params_range():
+    sel = query.parse_params({'desde': '2025-03', 'hasta': '2024-11'})
+    assert sel['rango'] == ('2024-11', '2025-03') and sel['año'] is None
+
+@pytest.mark.parametrize('params', [{'mes': '13'}, {'año': 'dos mil'}, {'desde': '2025-01'},
+                                    {'desde': '2025-01', 'hasta': '2025-13'},
+                                    {'desde': '2025-01', 'hasta': '2025-02', 'año': '2025'}])
+def test_parse_params_rejects_bad_input(params):
+    with pytest.raises(ValueError):
+        query.parse_params(params)
+
+def test_previous_period_yoy():
+    sel = query.selection(año=[2024, 2025], mes_num=2, pais='Chile')
+    assert query.previous_period(sel, 'yoy') == dict(sel, año=(2023, 2024))
+    sel = query.selection(rango=('2024-11', '2025-02'))
+    assert query.previous_period(sel, 'yoy')['rango'] == ('2023-11', '2024-02')
+
+def test_previous_period_mom():
+    assert query.previous_period(query.selection(año=2025, mes_num=1), 'mom') == query.selection(año=2024, mes_num=12)
+    assert query.previous_period(query.selection(año=2025, mes_num=7), 'mom') == query.selection(año=2025, mes_num=6)
+
+@pytest.mark.parametrize('sel', [query.selection(), query.selection(año=2025),
+                                 query.selection(año=[2024, 2025], mes_num=3),
+                                 query.selection(rango=('2025-01', '2025-03'))])
+def test_previous_period_mom_needs_one_month(sel):
+    assert query.previous_period(sel, 'mom') is None
+
+def test_previous_period_unknown_mode():
+    with pytest.raises(ValueError):
+        query.previous_period(query.selection(año=2025), 'qoq')
+
+def test_history_selection_steps_and_months():
+    sel = query.selection(año=2024, mes_num=3, pais='Chile')
+    assert query.history_selection(sel) == ({**sel, 'año': None}, 12, None)
+    sel = query.selection(año=2024, mes_num=[2, 1])
+    assert query.history_selection(sel) == ({**sel, 'año': None}, 1, (1, 2))
+    assert query.history_selection(query.selection(rango=('2024-01', '2024-06')))[1:] == (1, None)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import sketch
+
+def ids(lo, hi):
+    return np.arange(lo, hi).astype(str)
+
+@pytest.mark.parametrize('n', [10, 1_000, 50_000, 200_000])
+def test_estimate_within_error_bound(n):
+    regs = sketch.registers(np.zeros(n, dtype=np.intp), sketch.hash_ids(ids(0, n)), 1)
+    # 4 standard errors (1.04 / sqrt(M) = 1.6%)
+    assert abs(sketch.estimate(regs)[0] - n) <= max(2, 4 * 1.04 / np.sqrt(sketch.M) * n)
+
+def test_encoded_sketches_round_trip_sparse_and_dense():
+    small = sketch.encode_groups([0, 0, 1], ids(0, 3), 2)
+    big = sketch.encode_groups(np.zeros(20_000), ids(0, 20_000), 1)
+    sketches = sketch.Sketches.from_encoded(small + big)
+    lengths = np.diff(sketches.offsets)
+    assert list(lengths) == [2 * sketch.ENTRY.itemsize, sketch.ENTRY.itemsize, sketch.M]
+    for row, text in enumerate(small + big):
+        merged = sketches.merge([row], [0], 1)[0]
+        assert (merged == sketch.decode(text)).all()
+
+def test_merge_is_the_sketch_of_the_union():
+    codes = np.repeat([0, 1, 2], [3_000, 3_000, 30_000])
+    values = np.concatenate([ids(0, 3_000), ids(2_000, 5_000), ids(4_000, 34_000)])
+    sketches = sketch.Sketches.from_encoded(sketch.encode_groups(codes, values, 3))
+    union = sketch.registers(np.zeros(len(values), dtype=np.intp), sketch.hash_ids(values), 1)
+    assert (sketches.merge([0, 1, 2], [0, 0, 0], 1) == union).all()
+    assert sketches.count([0, 1, 2])[0] == sketch.estimate(union)[0]
+    per_group = sketches.count([0, 1, 2, 0], [0, 0, 1, 1], 2)
+    assert abs(per_group[0] - 5_000) < 250 and abs(per_group[1] - 33_000) < 1_500
+
+def test_from_arrow_reads_stored_and_fixed_size_columns():
+    sketches = sketch.Sketches.from_encoded(sketch.encode_groups(np.arange(50) % 5, ids(0, 50), 5))
+    stored = sketch.Sketches.from_arrow(pa.chunked_array([sketches.to_arrow()]))
+    dense = sketches.merge(np.arange(5), np.arange(5), 5)
+    fixed = pa.FixedSizeBinaryArray.from_buffers(pa.binary(sketch.M), 5, [None, pa.py_buffer(dense.tobytes())])
+    for other in (stored, sketch.Sketches.from_arrow(fixed)):
+        assert (other.offsets == sketches.offsets).all() and (other.data == sketches.data).all()
+
+def test_count_distinct_per_group():
+    frame = pd.DataFrame({'pais': ['A', 'A', 'B']})
+    regs = sketch.Sketches.from_encoded(sketch.encode_groups([0, 0, 1, 1, 2], ['1', '2', '2', '3', '9'], 3))
+    assert sketch.count_distinct(frame, regs) == 4
+    counts = sketch.count_distinct(frame, regs, by='pais')
+    assert counts.to_dict() == {'A': 3, 'B': 1}
+    assert sketch.count_distinct(frame.iloc[:0], regs) == 0
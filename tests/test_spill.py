@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import generate_data
+import spill
+
+KEYS = generate_data.ASIG_KEYS
+
+def partials(n_tables=6, n=3_000, seed=0):
+    rng = np.random.default_rng(seed)
+    return [pd.DataFrame({
+        'pais': rng.choice(['Chile', 'Peru', 'Costa Rica'], n),
+        'mes': rng.choice(['2024-12', '2025-01', '2025-02'], n),
+        'tipo_asignacion': rng.choice(['APP', 'MANUAL'], n),
+        'estado': rng.choice(['CONCLUIDA', 'CANCELADA'], n),
+        'id_expediente': rng.integers(0, 800, n).astype(str),
+        'servicios': rng.integers(1, 4, n),
+    }) for _ in range(n_tables)]
+
+def expected(tables):
+    df = generate_data.rollup(generate_data.combine_pairs(tables), KEYS)
+    return df.sort_values(KEYS, ignore_index=True)
+
+@pytest.mark.parametrize('budget', [1 << 30, 20_000])
+def test_spilled_rollup_matches_in_memory_rollup(tmp_path, budget):
+    tables = partials()
+    rollup = spill.SpillRollup(KEYS, budget, spill_dir=str(tmp_path))
+    for table in tables:
+        rollup.add(table)
+    spilled = len(rollup.runs)
+    result = rollup.result().sort_values(KEYS, ignore_index=True)
+    assert (spilled > 1) == (budget < 1 << 20)
+    pd.testing.assert_frame_equal(result, expected(tables), check_dtype=False)
+    assert os.listdir(tmp_path) == []
+
+def test_empty_input():
+    result = spill.SpillRollup(KEYS, 1 << 20).result()
+    assert len(result) == 0 and list(result.columns) == KEYS + ['servicios', 'expedientes', 'expedientes_hll']
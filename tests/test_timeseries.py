@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube
+import timeseries
+
+@pytest.fixture(scope='module')
+def asig():
+    rng = np.random.default_rng(0)
+    n = 3_000
+    facts = pd.DataFrame({
+        'año': rng.choice([2022, 2023, 2024, 2025], n),
+        'mes_num': rng.integers(1, 13, n),
+        'pais': rng.choice(['Chile', 'Peru', 'Uruguay'], n, p=[0.6, 0.35, 0.05]),
+        'tipo_asignacion': rng.choice(['APP', 'MANUAL'], n),
+        'estado': rng.choice(['CANCELADA', 'CONCLUIDA'], n),
+        'servicios': rng.integers(1, 50, n),
+        'expedientes': rng.integers(1, 10, n),
+    })
+    return cube.Cube(facts, cube.ASIG_DIMS)
+
+SELECTIONS = [{}, {'pais': 'Uruguay', 'estado': 'CANCELADA'}, {'pais': 'Bolivia'}]
+
+def dense(df, key):
+    """Brute-force (series x month) table of ``df`` over every month from its first to last non-zero one."""
+    df = df[df['servicios'] != 0]
+    if key is None:
+        df = df.assign(serie=0)
+        key = 'serie'
+    table = df.pivot_table(index=key, columns='mes', values='servicios', aggfunc='sum', fill_value=0)
+    if table.empty:
+        return table
+    months = pd.period_range(min(table.columns), max(table.columns), freq='M').astype(str)
+    return table.reindex(columns=months, fill_value=0)
+
+def baseline_loop(values, season):
+    """seasonal_baseline() one cell at a time."""
+    out = np.full(values.shape, np.nan)
+    for i, row in enumerate(values):
+        started = np.flatnonzero(np.nan_to_num(row) != 0)
+        for j in range(len(row)):
+            earlier = [row[k] for k in range(j - season, -1, -season)
+                       if len(started) and k >= started[0] and not np.isnan(row[k])]
+            if earlier:
+                out[i, j] = np.mean(earlier)
+    return out
+
+@pytest.mark.parametrize('sel', SELECTIONS)
+@pytest.mark.parametrize('key', [None, 'pais'])
+def test_from_frame_is_the_dense_monthly_table(asig, sel, key):
+    df = asig.frame(sel, ['mes'] if key is None else [key, 'mes'])
+    panel = timeseries.Panel.from_frame(df, key, ['servicios'])['servicios']
+    expected = dense(df, key)
+    assert panel.values.shape == (len(expected) if key else 1, expected.shape[1])
+    if expected.size:
+        assert list(panel.months()) == list(expected.columns)
+        assert np.array_equal(panel.values, expected.to_numpy())
+        if key is not None:
+            assert list(panel.keys) == list(expected.index)
+
+@pytest.mark.parametrize('sel', SELECTIONS)
+@pytest.mark.parametrize('step', [1, 12])
+def test_seasonal_baseline_matches_a_loop(asig, sel, step):
+    hist = {**sel, 'mes_num': 6} if step == 12 else sel
+    panel = timeseries.Panel.from_frame(asig.frame(hist, ['pais', 'mes']), 'pais', ['servicios'], step)['servicios']
+    baseline = timeseries.seasonal_baseline(panel.values, panel.season)
+    assert baseline.shape == panel.values.shape
+    assert np.allclose(baseline, baseline_loop(panel.values, panel.season), equal_nan=True)
+
+@pytest.mark.parametrize('shape', [(0, 0), (0, 30), (1, 0), (1, 1), (1, 30)])
+def test_empty_and_single_series_scores(shape):
+    values = np.arange(np.prod(shape), dtype=np.float64).reshape(shape) + 1
+    baseline = timeseries.seasonal_baseline(values, 12)
+    expected, z = timeseries.anomaly_scores(values, baseline)
+    assert baseline.shape == expected.shape == z.shape == shape
+    assert not timeseries.flags(z).any()
+
+def test_anomaly_scores_flag_a_spike(asig):
+    df = asig.frame({}, ['mes'])
+    panel = timeseries.Panel.from_frame(df, None, ['servicios'])['servicios']
+    spiked = panel.values.copy()
+    spiked[0, -5] *= 10
+    baseline = timeseries.seasonal_baseline(spiked, panel.season)
+    expected, z = timeseries.anomaly_scores(spiked, baseline)
+    resid = spiked - baseline
+    center = np.nanmedian(resid)
+    assert np.allclose(expected, np.maximum(baseline + center, 0), equal_nan=True)
+    assert np.flatnonzero(timeseries.flags(z)[0]).tolist() == [spiked.shape[1] - 5]
+
+def test_trends_of_a_selection_without_rows(asig):
+    sel = {'pais': 'Bolivia'}
+    por_mes = asig.frame(sel, ['mes']).assign(concluidos=0, expedientes=0)
+    tr = timeseries.asignaciones_trends(por_mes, asig.frame(sel, ['pais', 'mes']), 2024)
+    assert tr.mensual.empty and tr.anomalias.empty
+    por_nodo = asig.frame(sel, ['pais', 'mes']).rename(columns={'pais': 'nodo'})
+    tr = timeseries.nodos_trends(por_nodo, 2024)
+    assert tr.mensual.empty and tr.anomalias.empty
+
+@pytest.mark.parametrize('meses', [(1, 2), (1, 2, 3), (6, 12)])
+def test_multi_month_trends_leave_the_other_months_out(asig, meses):
+    hist = {'mes_num': meses}
+    por_mes = asig.frame(hist, ['mes']).assign(concluidos=0, expedientes=0)
+    tr = timeseries.asignaciones_trends(por_mes, asig.frame(hist, ['pais', 'mes']), 2024, meses=meses)
+    mensual = tr.mensual.set_index('mes')
+    assert list(mensual.index) == [f'2024-{m:02d}' for m in meses]
+    assert (mensual['servicios'] > 0).all()
+    assert mensual['acumulado'].tolist() == mensual['servicios'].cumsum().tolist()
+    # A rolling window only counts when all of its months are selected
+    for mes, media in mensual['servicios_media'].items():
+        m = int(mes[5:])
+        window = [f'2024-{k:02d}' for k in range(m - 2, m + 1)]
+        if all(k in meses for k in range(m - 2, m + 1)):
+            assert media == pytest.approx(mensual.loc[window, 'servicios'].mean())
+        else:
+            assert np.isnan(media)
+    assert set(tr.anomalias['mes']) <= set(mensual.index)
+    # Baselines only reach the same month of earlier years
+    panel = timeseries.Panel.from_frame(por_mes, None, ['servicios'], meses=meses)['servicios']
+    assert np.array_equal(np.isnan(panel.values[0]), ~np.isin(panel.ordinals() % 12 + 1, meses))
+    baseline = timeseries.seasonal_baseline(panel.values, panel.season)
+    assert np.allclose(baseline, baseline_loop(panel.values, panel.season), equal_nan=True)
@@ -0,0 +1,259 @@
+"""
+timeseries.py — Monthly series behind the dashboard trend charts.
+
+A Panel holds many monthly series at once (the overall total, one per país
+or one per nodo) as a 2-D array with one row per series and one column per
+month of a dense month index: every month from the first to the last one
+with data, missing months filled with zeros. When only some calendar months
+are selected (several mes_num), the other months are NaN rather than zero:
+they are not data, so rolling means that reach them are NaN and baselines
+skip them, and they are never shown. Rolling means, cumulative
+totals, rates and seasonal baselines are whole-array operations along the
+month axis (cumulative sums and reshapes, never a loop over series), so
+thousands of series cost about as much as one.
+
+Seasonal baseline: the mean of the same calendar month in the earlier years
+of each series (months before a series' first non-zero value don't count).
+A month is flagged as an anomaly when its residual from that baseline is
+more than THRESHOLD robust standard deviations (1.4826 x the median absolute
+deviation of the series' residuals, at least the Poisson noise of the
+baseline) away from the series' median residual, i.e. its usual drift.
+"""
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import cube
+
+WINDOW = 3        # months in the rolling means
+THRESHOLD = 3.0   # robust z-score beyond which a month is an anomaly
+MIN_YEARS = 1     # earlier values a month needs to get a seasonal baseline
+
+# ─── Dense month index ────────────────────────────────────────────────────────
+def month_ordinal(mes):
+    """Months since January of year 0 for an array of 'YYYY-MM' labels."""
+    codes, uniques = pd.factorize(np.asarray(mes, dtype=object))
+    uniques = pd.Series(uniques, dtype=str)
+    ords = uniques.str[:4].astype(int).to_numpy() * 12 + uniques.str[5:7].astype(int).to_numpy() - 1
+    return ords[codes]
+
+@dataclass
+class Panel:
+    """Monthly series as the rows of a (series x month) array over a dense month index."""
+    keys: np.ndarray     # label of each series; [None] for a single unlabelled series
+    start: int           # month ordinal of the first column
+    step: int            # months between columns: 1, or 12 when following one calendar month
+    values: np.ndarray   # float64, series x month
+    meses: tuple = None  # calendar months selected (None: all); the other columns are NaN
+
+    @classmethod
+    def from_frame(cls, df, key, measures, step=1, meses=None):
+        """One Panel per measure from long rows of (``key``, mes, measures...).
+
+        ``key`` None means the rows are a single series. All the panels share
+        one month index, spanning every month where any measure is non-zero.
+        With ``meses``, columns of any other calendar month are NaN.
+        """
+        if key is None:
+            codes, keys = np.zeros(len(df), dtype=np.intp), np.array([None], dtype=object)
+        else:
+            codes, keys = pd.factorize(np.asarray(df[key], dtype=object), sort=True)
+        ords = month_ordinal(df['mes'])
+        used = (df[measures].to_numpy() != 0).any(axis=1) if len(df) else np.zeros(0, dtype=bool)
+        if used.any():
+            start, end = ords[used].min(), ords[used].max()
+        else:
+            start, end = 0, -step
+        cols = (ords - start) // step
+        inside = (ords >= start) & (ords <= end)
+        if meses is not None:
+            meses = tuple(int(m) for m in meses)
+        panels = {}
+        for m in measures:
+            values = np.zeros((len(keys), (end - start) // step + 1))
+            values[codes[inside], cols[inside]] = df[m].to_numpy()[inside]
+            panels[m] = cls(keys, int(start), step, values, meses)
+            if meses is not None:
+                values[:, ~panels[m].selected()] = np.nan
+        return panels
+
+    @property
+    def season(self):
+        """Columns per year."""
+        return 12 // self.step
+
+    def ordinals(self):
+        return self.start + self.step * np.arange(self.values.shape[1])
+
+    def selected(self):
+        """Whether each column is one of the selected calendar months."""
+        if self.meses is None:
+            return np.ones(self.values.shape[1], dtype=bool)
+        return np.isin(self.ordinals() % 12 + 1, self.meses)
+
+    def months(self):
+        """'YYYY-MM' label of each column."""
+        ords = pd.Series(self.ordinals())
+        return cube.month_labels(ords // 12, ords % 12 + 1).to_numpy()
+
+    def columns(self, año, rango=None):
+        """Columns that fall in ``año`` (all of them for None), or in ``rango``.
+
+        A slice for one year or a ('YYYY-MM', 'YYYY-MM') range; for a list of
+        years, or when only some calendar months are selected, an index
+        array, as the columns need not be consecutive.
+        """
+        cols = self._columns(año, rango)
+        if self.meses is None:
+            return cols
+        hit = np.arange(self.values.shape[1])[cols]
+        return hit[self.selected()[hit]]
+
+    def _columns(self, año, rango):
+        if rango is not None:
+            lo, hi = month_ordinal(list(rango))
+            ords = self.ordinals()
+            return slice(int(np.searchsorted(ords, lo)), int(np.searchsorted(ords, hi, side='right')))
+        if año is None:
+            return slice(None)
+        years = self.ordinals() // 12
+        if cube.is_multi(año):
+            return np.flatnonzero(np.isin(years, [int(a) for a in año]))
+        hit = np.flatnonzero(years == int(año))
+        return slice(hit[0], hit[-1] + 1) if len(hit) else slice(0, 0)
+
+    def frame(self, key, cols=slice(None), **arrays):
+        """Long frame of (``key``, mes, arrays...) over ``cols``, series by series."""
+        months = self.months()[cols]
+        out = {}
+        if key is not None:
+            out[key] = np.repeat(self.keys, len(months))
+        out['mes'] = np.tile(months, len(self.keys))
+        for name, arr in arrays.items():
+            out[name] = arr[:, cols].reshape(-1)
+        return pd.DataFrame(out)
+
+# ─── Array operations (along the last axis, every series at once) ─────────────
+def rolling_sum(values, window):
+    """Sum over each trailing ``window`` columns; NaN until a full window is available,
+    and for windows holding a NaN column."""
+    c = np.cumsum(np.nan_to_num(values), axis=-1, dtype=np.float64)
+    gaps = np.cumsum(np.isnan(values), axis=-1)
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] >= window:
+        out[..., window - 1:] = c[..., window - 1:]
+        out[..., window:] -= c[..., :-window]
+        holes = gaps[..., window - 1:].copy()
+        holes[..., 1:] -= gaps[..., :-window]
+        out[..., window - 1:][holes > 0] = np.nan
+    return out
+
+def rolling_mean(values, window=WINDOW):
+    return rolling_sum(values, window) / window
+
+def cumulative(values):
+    return np.cumsum(values, axis=-1, dtype=np.float64)
+
+def rate(num, den, window=1):
+    """100 * num / den per column (pooled over trailing ``window`` columns); NaN where den is 0."""
+    if window > 1:
+        num, den = rolling_sum(num, window), rolling_sum(den, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num / den * 100, np.nan)
+
+def seasonal_baseline(values, season, min_years=MIN_YEARS):
+    """Mean of the same column of earlier seasons (same calendar month, earlier years).
+
+    Columns before a series' first non-zero value, and NaN columns, are not
+    counted as earlier values; NaN where fewer than ``min_years`` of them exist.
+    """
+    n, m = values.shape
+    years = -(-m // season)
+    present = ~np.isnan(values)
+    counted = (np.cumsum(present & (values != 0), axis=1) > 0) & present
+    sums = np.zeros((n, years * season))
+    counts = np.zeros((n, years * season))
+    sums[:, :m] = np.where(counted, values, 0)
+    counts[:, :m] = counted
+    sums, counts = sums.reshape(n, years, season), counts.reshape(n, years, season)
+    earlier_sum = np.cumsum(sums, axis=1) - sums
+    earlier_n = np.cumsum(counts, axis=1) - counts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(earlier_n >= max(min_years, 1), earlier_sum / earlier_n, np.nan)
+    return mean.reshape(n, years * season)[:, :m]
+
+def anomaly_scores(values, baseline):
+    """(expected, robust z) per cell: the baseline shifted by the series' median residual (floored at 0)."""
+    resid = values - baseline
+    with warnings.catch_warnings():
+        # Series with no baseline at all are all-NaN rows
+        warnings.simplefilter('ignore', RuntimeWarning)
+        center = np.nanmedian(resid, axis=1, keepdims=True)
+        mad = np.nanmedian(np.abs(resid - center), axis=1, keepdims=True)
+    expected = np.maximum(baseline + center, 0)
+    scale = np.maximum(1.4826 * mad, np.sqrt(np.maximum(expected, 1)))
+    return expected, (values - expected) / scale
+
+def flags(z, threshold=THRESHOLD):
+    return np.abs(np.nan_to_num(z)) > threshold
+
+# ─── Dashboard trends ─────────────────────────────────────────────────────────
+@dataclass
+class Trends:
+    """Monthly trends of one selection; built from its full history, shown for its año."""
+    mensual: pd.DataFrame    # [key,] mes, servicios, media, ... (dense over the selected months, zeros included)
+    anomalias: pd.DataFrame  # key, mes, servicios, esperado, z: flagged months, strongest first
+
+def seasonal_scores(panel):
+    """anomaly_scores() of every series of ``panel`` against its seasonal baseline."""
+    return anomaly_scores(panel.values, seasonal_baseline(panel.values, panel.season))
+
+def anomalias(panel, key, cols, expected, z, threshold=THRESHOLD):
+    """Flagged months of every series of ``panel`` within ``cols``."""
+    df = panel.frame(key, cols, servicios=panel.values, esperado=expected, z=z)
+    df = df[flags(df['z'].to_numpy(), threshold)]
+    df = df.assign(esperado=df['esperado'].round(0), z=df['z'].round(1))
+    return df.iloc[np.argsort(-df['z'].abs().to_numpy(), kind='stable')].reset_index(drop=True)
+
+def asignaciones_trends(por_mes, por_pais_mes, año=None, step=1, window=WINDOW, threshold=THRESHOLD,
+                        rango=None, meses=None):
+    """Trends of the Asignaciones tab.
+
+    ``por_mes`` (mes, servicios, concluidos, expedientes) and ``por_pais_mes``
+    (pais, mes, servicios) cover every year of the selection; ``año`` (or
+    the month range ``rango``) picks the months shown, so rolling means and
+    baselines reach back across it. ``meses`` restricts them to those
+    calendar months (a multi-month selection).
+    Cumulative servicios start at the first month shown.
+    """
+    measures = ['servicios', 'concluidos', 'expedientes']
+    p = Panel.from_frame(por_mes, None, measures, step, meses)
+    serv, concl = p['servicios'].values, p['concluidos'].values
+    cols = p['servicios'].columns(año, rango)
+    expected, z = seasonal_scores(p['servicios'])
+    acumulado = np.zeros_like(serv)
+    acumulado[:, cols] = cumulative(serv[:, cols])
+    mensual = p['servicios'].frame(
+        None, cols,
+        **{m: p[m].values for m in measures},
+        **{f'{m}_media': rolling_mean(p[m].values, window) for m in measures},
+        pct_conclusion=rate(concl, serv),
+        pct_conclusion_media=rate(concl, serv, window),
+        acumulado=acumulado,
+        esperado=expected,
+        anomalia=flags(z, threshold),
+    )
+    paises = Panel.from_frame(por_pais_mes, 'pais', ['servicios'], step, meses)['servicios']
+    return Trends(mensual=mensual,
+                  anomalias=anomalias(paises, 'pais', paises.columns(año, rango), *seasonal_scores(paises), threshold))
+
+def nodos_trends(por_mes, año=None, step=1, window=WINDOW, threshold=THRESHOLD, rango=None, meses=None):
+    """Trends of the Nodos tab from ``por_mes`` (nodo, mes, servicios) over every year."""
+    p = Panel.from_frame(por_mes, 'nodo', ['servicios'], step, meses)['servicios']
+    cols = p.columns(año, rango)
+    expected, z = seasonal_scores(p)
+    mensual = p.frame('nodo', cols, servicios=p.values, media=rolling_mean(p.values, window),
+                      anomalia=flags(z, threshold))
+    return Trends(mensual=mensual, anomalias=anomalias(p, 'nodo', cols, expected, z, threshold))
@@ -0,0 +1,87 @@
+"""
+timing.py — Opt-in timing spans for app.py and generate_data.py.
+
+A Recorder collects named spans (start, duration, nesting) for one dashboard
+rerun or one generate_data.py run. It is off unless asked for: the app turns
+it on with ?debug=1 in the URL or DASHBOARD_TIMING=1, generate_data.py with
+--trace FILE. A disabled recorder hands out one shared no-op context manager,
+so the instrumented code costs an attribute lookup and a call per span.
+
+Spans export as Chrome trace events (chrome://tracing, https://ui.perfetto.dev).
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+NULL_SPAN = contextlib.nullcontext()
+
+def enabled_by_env():
+    return os.environ.get('DASHBOARD_TIMING', '').lower() in ('1', 'true', 'yes')
+
+class Recorder:
+    """Spans of one run; times are wall-clock so spans from worker processes line up."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = []
+        self.section_span = None
+        self.local = threading.local()
+
+    def span(self, name, **args):
+        """Context manager timing ``name``; spans opened inside it nest under it."""
+        if not self.enabled:
+            return NULL_SPAN
+        return self._span(name, args)
+
+    @contextlib.contextmanager
+    def _span(self, name, args):
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            self.add(name, start, time.time(), depth=depth, **args)
+
+    def section(self, name):
+        """Close the running section (if any) and start ``name``; for straight-line scripts."""
+        if not self.enabled:
+            return
+        self.finish()
+        self.section_span = self._span(name, {})
+        self.section_span.__enter__()
+
+    def finish(self):
+        if self.section_span is not None:
+            self.section_span.__exit__(None, None, None)
+            self.section_span = None
+
+    def add(self, name, start, end, depth=0, pid=None, **args):
+        """Record a span measured elsewhere (e.g. in a worker process)."""
+        if self.enabled:
+            self.spans.append({'name': name, 'start': start, 'end': end, 'depth': depth,
+                               'pid': pid or os.getpid(), 'args': args})
+
+    def rows(self):
+        """Spans in start order as dicts of name, depth, start_ms (from the first span) and ms."""
+        spans = sorted(self.spans, key=lambda s: (s['start'], s['depth']))
+        t0 = spans[0]['start'] if spans else 0
+        return [{'name': s['name'], 'depth': s['depth'],
+                 'start_ms': round((s['start'] - t0) * 1000, 2),
+                 'ms': round((s['end'] - s['start']) * 1000, 2)} for s in spans]
+
+    def chrome_trace(self):
+        events = [{'name': s['name'], 'ph': 'X', 'ts': s['start'] * 1e6,
+                   'dur': (s['end'] - s['start']) * 1e6, 'pid': s['pid'], 'tid': s['pid'],
+                   'args': s['args']} for s in self.spans]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dumps(self):
+        return json.dumps(self.chrome_trace(), ensure_ascii=False, default=str)
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.dumps())